@@ -0,0 +1,269 @@
+"""
+Scaling benchmarks of memoravel.
+
+Runs offline: token counts come from a deterministic word-splitting encoder registered for
+the "benchmark" model, unless --tiktoken is given. Each benchmark runs on synthetic
+conversations of every requested size, mixing system, user, assistant and tool messages
+(with tool calls), and reports the per-call latency and throughput as JSON, along with the
+scaling exponent of each benchmark across sizes (about 0 for an operation whose cost does
+not depend on the size of the history, about 1 for a linear one).
+
+Usage (from the root of the repository):
+
+    python -m benchmarks.bench_memoravel --sizes 10 1000 100000 --output results.json
+    python -m benchmarks.bench_memoravel --compare results.json --tolerance 1.5
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from memoravel import Memoravel, register_encoder
+
+MODEL = "benchmark"
+_PIECE = re.compile(r"\w{1,6}|[^\w\s]|\s+")
+
+
+class OfflineEncoder:
+    """
+    A deterministic encoder that needs no download, splitting text into words of at most 6
+    characters and punctuation, which gives counts close to a real BPE tokenizer.
+    """
+
+    name = "benchmark"
+
+    def encode(self, text):
+        return [hash(piece) & 0xFFFF for piece in _PIECE.findall(text)]
+
+    def encode_batch(self, texts):
+        return [self.encode(text) for text in texts]
+
+
+WORDS = ("the", "memory", "model", "token", "history", "message", "answer", "question", "context",
+         "window", "python", "request", "summary", "weather", "search", "result", "value", "about")
+
+
+def conversation(size, seed=0):
+    """
+    Returns a synthetic conversation of ``size`` messages: a system prompt, then user and
+    assistant turns, with a tool call and its result every few turns and an occasional
+    system message.
+    """
+    rng = random.Random(seed)
+
+    def text(low, high):
+        return " ".join(rng.choice(WORDS) for _ in range(rng.randint(low, high)))
+
+    messages = [{"role": "system", "content": "You are a helpful assistant. " + text(20, 40)}]
+    call = 0
+    while len(messages) < size:
+        turn = len(messages)
+        if turn % 97 == 0:
+            messages.append({"role": "system", "content": text(5, 15)})
+        elif turn % 11 == 0:
+            call += 1
+            messages.append({"role": "assistant", "content": None, "tool_calls": [{
+                "id": f"call_{call}", "type": "function",
+                "function": {"name": "search", "arguments": json.dumps({"query": text(2, 6)})}}]})
+            messages.append({"role": "tool", "tool_call_id": f"call_{call}", "content": json.dumps({"results": [text(5, 20) for _ in range(3)]})})
+        elif turn % 2:
+            messages.append({"role": "user", "content": text(5, 40)})
+        else:
+            messages.append({"role": "assistant", "content": text(10, 120)})
+    return messages[:size]
+
+
+def filled_memory(messages, storage, **kwargs):
+    """
+    Returns an unbounded memory holding ``messages``, with the given limits applied afterwards.
+    """
+    memory = Memoravel(limit=0, max_tokens=0, model=MODEL, storage=storage, preserve_initial_memories=1)
+    memory.extend(messages)
+    for name, value in kwargs.items():
+        setattr(memory, name, value)
+    return memory
+
+
+def measure(function, calls, setup=None):
+    """
+    Calls ``function`` ``calls`` times and returns the latency of each call in microseconds.
+    """
+    latencies = []
+    for _ in range(calls):
+        argument = setup() if setup is not None else None
+        start = time.perf_counter_ns()
+        function() if setup is None else function(argument)
+        latencies.append((time.perf_counter_ns() - start) / 1000)
+    return latencies
+
+
+def summarize(benchmark, size, latencies):
+
+    ordered = sorted(latencies)
+    mean = statistics.mean(ordered)
+    return {
+        "benchmark": benchmark,
+        "size": size,
+        "calls": len(ordered),
+        "mean_us": round(mean, 3),
+        "p50_us": round(ordered[len(ordered) // 2], 3),
+        "p95_us": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        "max_us": round(ordered[-1], 3),
+        "ops_per_sec": round(1e6 / mean, 1) if mean else None,
+    }
+
+
+def run_size(size, calls, storage, directory):
+    """
+    Runs every benchmark on a conversation of ``size`` messages.
+    """
+    messages = conversation(size)
+    extra = conversation(size + calls * 2, seed=1)[size:]
+    tokens = filled_memory(messages, storage).count_tokens()
+    results = []
+
+    # add() into an unbounded memory
+    memory = Memoravel(limit=0, max_tokens=0, model=MODEL, storage=storage)
+    results.append(summarize("add_unbounded", size, measure(lambda message: memory.add(**message), size, iter(messages).__next__)))
+
+    # add() at the budget edge: every call trims one or more messages
+    memory = filled_memory(messages, storage, limit=size, max_tokens=tokens)
+    results.append(summarize("add_at_limit", size, measure(lambda message: memory.add(**message), calls, iter(extra).__next__)))
+
+    # One trim evicting half of the history
+    def over_budget():
+        memory = filled_memory(messages, storage)
+        memory.limit = max(size // 2, 1)
+        return memory
+    results.append(summarize("trim_half", size, measure(lambda memory: memory._trim_history(), min(calls, 10), over_budget)))
+
+    memory = filled_memory(messages, storage)
+    results.append(summarize("count_tokens", size, measure(memory.count_tokens, calls)))
+    results.append(summarize("recall_all", size, measure(memory.recall, min(calls, 50))))
+    results.append(summarize("recall_last_20", size, measure(lambda: memory.recall(last_n=20), calls)))
+    results.append(summarize("view_all", size, measure(memory.view, calls)))
+
+    middle = {"role": "user", "content": "inserted in the middle"}
+    results.append(summarize("insert_middle", size, measure(lambda: memory.insert(len(memory.history) // 2, middle), calls)))
+    results.append(summarize("delete_middle", size, measure(lambda: memory.delete(len(memory.history) // 2), calls)))
+    results.append(summarize("delete_first", size, measure(lambda: memory.delete(1), min(calls, len(memory.history) - 2))))
+
+    memory = filled_memory(messages, storage)
+    for format in ("json", "indexed", "binary", "journal"):
+        path = os.path.join(directory, f"{size}.{format}")
+        results.append(summarize(f"save_{format}", size, measure(lambda: memory.save(path, format=format), 3)))
+        if memory.journal is not None:
+            memory.journal.close()
+        loaded = Memoravel(limit=0, max_tokens=0, model=MODEL, storage=storage)
+        results.append(summarize(f"load_{format}", size, measure(lambda: loaded.load(path, format=format), 3)))
+        if loaded.journal is not None:
+            loaded.journal.close()
+
+    # Appending one message to a journal, the cost of saving after every turn
+    path = os.path.join(directory, f"{size}.appended")
+    memory.save(path, format="journal")
+    results.append(summarize("journal_add_and_save", size, measure(
+        lambda message: (memory.add(**message), memory.save(path, format="journal")), calls, iter(extra).__next__)))
+    memory.journal.close()
+    return results
+
+
+def scaling(results):
+    """
+    Returns the log-log slope of the mean latency of each benchmark against the size.
+    """
+    by_benchmark = {}
+    for result in results:
+        if result["mean_us"] > 0:
+            by_benchmark.setdefault(result["benchmark"], []).append((math.log(result["size"]), math.log(result["mean_us"])))
+    slopes = {}
+    for benchmark, points in by_benchmark.items():
+        if len(points) < 2:
+            continue
+        mean_x = statistics.mean(x for x, _ in points)
+        mean_y = statistics.mean(y for _, y in points)
+        variance = sum((x - mean_x) ** 2 for x, _ in points)
+        if variance:
+            slopes[benchmark] = round(sum((x - mean_x) * (y - mean_y) for x, y in points) / variance, 3)
+    return slopes
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns the results more than ``tolerance`` times slower than the same benchmark and size of ``baseline``.
+    """
+    previous = {(result["benchmark"], result["size"]): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        before = previous.get((result["benchmark"], result["size"]))
+        if before is not None and before["mean_us"] and result["mean_us"] > before["mean_us"] * tolerance:
+            regressions.append({"benchmark": result["benchmark"], "size": result["size"],
+                                "before_us": before["mean_us"], "after_us": result["mean_us"]})
+    return regressions
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Scaling benchmarks of memoravel.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000, 100000], help="Conversation sizes, in messages.")
+    parser.add_argument("--calls", type=int, default=200, help="Calls measured per benchmark.")
+    parser.add_argument("--storage", choices=("list", "deque"), default="list", help="History storage of the memories.")
+    parser.add_argument("--tiktoken", action="store_true", help="Count tokens with the gpt-4o tiktoken encoding instead of the offline encoder.")
+    parser.add_argument("--output", help="Write the results to this JSON file instead of stdout.")
+    parser.add_argument("--compare", help="A previous results file; exits with status 1 if a benchmark got slower.")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="Slowdown ratio tolerated by --compare.")
+    args = parser.parse_args(argv)
+
+    global MODEL
+    if args.tiktoken:
+        MODEL = "gpt-4o"
+    else:
+        register_encoder(MODEL, OfflineEncoder())
+
+    directory = tempfile.mkdtemp()
+    results = []
+    try:
+        for size in args.sizes:
+            print(f"Benchmarking {size} messages...", file=sys.stderr)
+            results.extend(run_size(size, args.calls, args.storage, directory))
+    finally:
+        shutil.rmtree(directory)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "storage": args.storage,
+            "encoder": MODEL,
+            "sizes": args.sizes,
+            "calls": args.calls,
+        },
+        "results": results,
+        "scaling": scaling(results),
+    }
+    status = 0
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            report["regressions"] = compare(results, json.load(file), args.tolerance)
+        status = 1 if report["regressions"] else 0
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,21 @@
 # memoravel/__init__.py
 
 from .memoravel import Memoravel  # Importa a classe principal
+from .backends import Backend, SQLiteBackend
+from .compaction import TruncatingSummarizer
+from .eviction import FIFOEviction, PrefixCacheEviction
+from .exceptions import MemoravelError, PersistenceError, TokenCountError
+from .metrics import Observer, PrometheusObserver
+from .pool import MemoravelPool
+from .relevance import HashingEmbedder, RelevanceEviction
+from .tokens import JSONTokenCounter, ChatTokenCounter, TokenCountCache, get_encoder, register_encoder, warm_up
 
-__all__ = ["Memoravel"]
+__all__ = ["Memoravel", "AsyncMemoravel", "MemoravelError", "TokenCountError", "PersistenceError", "Observer", "PrometheusObserver", "Backend", "SQLiteBackend", "TruncatingSummarizer", "FIFOEviction", "PrefixCacheEviction", "RelevanceEviction", "HashingEmbedder", "MemoravelPool", "JSONTokenCounter", "ChatTokenCounter", "TokenCountCache", "get_encoder", "register_encoder", "warm_up"]
+
+
+def __getattr__(name):
+    # AsyncMemoravel is imported on first use, so importing memoravel does not import asyncio
+    if name == "AsyncMemoravel":
+        from .aio import AsyncMemoravel
+        return AsyncMemoravel
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
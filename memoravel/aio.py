@@ -0,0 +1,197 @@
+import asyncio
+import functools
+import inspect
+import os
+import time
+
+from .compaction import summary_message
+from .exceptions import MemoravelError, PersistenceError
+from .memoravel import Memoravel, _read_json, _write_json
+
+
+class AsyncMemoravel:
+    """
+    An asyncio version of :class:`~memoravel.Memoravel`, for applications running in an event loop.
+
+    Tokenizing large messages and reading or writing files are offloaded to an executor, so
+    they never block the event loop. Mutations of one memory are serialized by an
+    ``asyncio.Lock`` and applied in the order they were called, while many memories (e.g. one
+    per session) progress concurrently. The ``summarizer`` of the memory may be a coroutine
+    function, which is awaited; a synchronous one runs in the executor.
+
+    Args:
+        *args: Positional arguments of :class:`~memoravel.Memoravel`.
+        executor (concurrent.futures.Executor, optional): The executor used for tokenization and file I/O. Default is None (the event loop's default executor).
+        offload_threshold (int, optional): Messages whose text is shorter than this many characters are tokenized directly in the event loop, since handing them to a thread would cost more than encoding them. Default is 2048.
+        **kwargs: Keyword arguments of :class:`~memoravel.Memoravel`.
+
+    Example:
+        .. code-block:: python
+
+            from memoravel import AsyncMemoravel
+
+            async def handle(memory, text):
+                await memory.add("user", text)
+                messages = memory.recall()
+                ...
+                await memory.save("memory.json")
+
+            memory = AsyncMemoravel(limit=20, max_tokens=8000)
+    """
+
+    def __init__(self, *args, executor=None, offload_threshold=2048, **kwargs):
+        self.memory = Memoravel(*args, **kwargs)
+        self.executor = executor
+        self.offload_threshold = offload_threshold
+        self._lock = None
+
+    @property
+    def lock(self):
+        """
+        The ``asyncio.Lock`` serializing the mutations of this memory.
+        """
+        # Created on first use, so the memory can be built outside of a running event loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def add(self, role, content=None, **kwargs):
+        """
+        Adds a new message to the history and trims the history if necessary. See :meth:`Memoravel.add`.
+        """
+        message = self.memory._build_message(role, content, **kwargs)
+        async with self.lock:
+            tokens = await self._count_messages_tokens([message])
+            self.memory._splice(len(self.memory.history), [message], tokens, trim=False)
+            await self._trim_history()
+
+    async def extend(self, messages):
+        """
+        Adds several messages at once and trims the history only once. See :meth:`Memoravel.extend`.
+        """
+        if not isinstance(messages, list) or not all(isinstance(message, dict) for message in messages):
+            raise ValueError("The 'messages' parameter must be a list of dicts.")
+        if not messages:
+            return
+        messages = [self.memory._build_message(**message) for message in messages]
+        async with self.lock:
+            tokens = await self._count_messages_tokens(messages)
+            self.memory._splice(len(self.memory.history), messages, tokens, trim=False)
+            await self._trim_history()
+
+    async def insert(self, index, messages):
+        """
+        Inserts one or more messages at a specific position and trims if necessary. See :meth:`Memoravel.insert`.
+        """
+        if isinstance(messages, dict):
+            messages = [messages]
+        elif not isinstance(messages, list):
+            raise ValueError("The 'messages' parameter must be either a dict or a list of dicts.")
+        async with self.lock:
+            tokens = await self._count_messages_tokens(messages) if messages else []
+            self.memory._splice(index, messages, tokens, trim=False)
+            await self._trim_history()
+
+    async def delete(self, index_or_slice):
+        """
+        Deletes one or more memories from the history. See :meth:`Memoravel.delete`.
+        """
+        async with self.lock:
+            self.memory.delete(index_or_slice)
+
+    def recall(self, last_n=None, first_n=None, index_or_slice=None):
+        """
+        Returns memories from the history. See :meth:`Memoravel.recall`.
+        """
+        return self.memory.recall(last_n=last_n, first_n=first_n, index_or_slice=index_or_slice)
+
+    def count_tokens(self):
+        """
+        Returns the total number of tokens in the current history. See :meth:`Memoravel.count_tokens`.
+        """
+        return self.memory.count_tokens()
+
+    async def save(self, file_path, format="json", compression=None):
+        """
+        Saves the memory content to a file, writing it in the executor. See :meth:`Memoravel.save`.
+        """
+        if format != "json" or compression is not None:
+            # The other formats read the token counts (or attach a journal) as they write, so
+            # mutations wait until the file is written
+            async with self.lock:
+                await self._run(self.memory.save, file_path, format, compression)
+            return
+
+        # Writing a snapshot lets other mutations proceed while the file is written
+        async with self.lock:
+            messages = self.memory.history[:]
+        observer = self.memory.observer
+        start = time.perf_counter() if observer is not None else 0
+        try:
+            await self._run(_write_json, file_path, messages)
+        except Exception as e:
+            raise PersistenceError(f"Error saving file: {e}") from e
+        if observer is not None:
+            observer.persisted("save", "json", os.path.getsize(file_path), time.perf_counter() - start)
+
+    async def load(self, file_path, format=None, lazy=False):
+        """
+        Loads the memory content from a file, reading and tokenizing it in the executor. See :meth:`Memoravel.load`.
+        """
+        observer = self.memory.observer
+        async with self.lock:
+            if format is None:
+                format = await self._run(self.memory._detect_format, file_path)
+            if format != "json" or lazy:
+                await self._run(self.memory.load, file_path, format, lazy)
+                return
+
+            start = time.perf_counter() if observer is not None else 0
+            try:
+                history = await self._run(_read_json, file_path)
+                tokens = await self._run(self.memory._count_messages_tokens, history) if history else []
+            except MemoravelError:
+                raise
+            except Exception as e:
+                raise PersistenceError(f"Error loading file: {e}") from e
+            if self.memory.journal is not None:
+                self.memory.journal.close()
+            self.memory._replace(history, tokens)
+            if observer is not None:
+                observer.persisted("load", "json", os.path.getsize(file_path), time.perf_counter() - start)
+
+    async def _trim_history(self):
+
+        # Compacts first, awaiting the summarizer outside of the memory's own trimming
+        memory = self.memory
+        if memory.summarizer is not None:
+            started = time.perf_counter() if memory.observer is not None else 0
+            with memory._lock:
+                plan = memory._compaction_plan()
+            if plan is not None:
+                start, block = plan
+                if inspect.iscoroutinefunction(memory.summarizer):
+                    summary = await memory.summarizer(block)
+                else:
+                    summary = await self._run(memory.summarizer, block)
+                    if inspect.isawaitable(summary):
+                        summary = await summary
+                message = summary_message(summary)
+                tokens = await self._count_messages_tokens([message])
+                with memory._lock:
+                    memory._apply_compaction(start, block, message, tokens, started)
+        with memory._lock:
+            memory._trim_history(compact=False)
+
+    async def _count_messages_tokens(self, messages):
+
+        # The encoder is created on first use, which is too slow to happen in the event loop
+        size = sum(len(value) for message in messages for value in message.values() if isinstance(value, str))
+        if self.memory._encoder is None or size >= self.offload_threshold:
+            return await self._run(self.memory._count_messages_tokens, messages)
+        return self.memory._count_messages_tokens(messages)
+
+    def _run(self, function, *args):
+
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self.executor, functools.partial(function, *args))
@@ -0,0 +1,298 @@
+import json
+import queue
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+
+class Backend(ABC):
+    """
+    Base class of the storage backends a :class:`~memoravel.Memoravel` can be bound to.
+
+    A bound memory reports every change to its backend as it happens, so the backend can
+    persist it incrementally: messages inserted at a position, messages removed (by a
+    deletion or by trimming), or the whole history replaced (e.g. by ``load``). Subclasses
+    must implement these hooks, and usually :meth:`load` so memories can be restored from them.
+
+    See :class:`SQLiteBackend` for a reference implementation.
+    """
+
+    @abstractmethod
+    def insert(self, session_id, index, messages, tokens):
+        """
+        Persists ``messages`` (with their token counts) inserted before position ``index`` of the session.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def remove(self, session_id, indices, reason="delete"):
+        """
+        Persists the removal of the messages at ``indices`` (sorted), either by "delete" or by "trim".
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def replace(self, session_id, messages, tokens, counted_with):
+        """
+        Persists a whole new history for the session, along with how its tokens were counted.
+        """
+        raise NotImplementedError
+
+    def load(self, session_id, last_n=None):
+        """
+        Returns the messages of a session, their token counts and how the tokens were counted,
+        or ``([], [], None)`` if the session does not exist.
+        """
+        raise NotImplementedError
+
+    def flush(self):
+        """
+        Makes sure every change reported so far is persisted.
+        """
+
+    def close(self):
+        """
+        Flushes the backend and releases its resources.
+        """
+        self.flush()
+
+
+class SQLiteBackend(Backend):
+    """
+    Stores the messages of many sessions in a single SQLite database.
+
+    Each message is one row, keyed by its session and position and stored with its token
+    count, so adding a message inserts one row, trimming deletes a range of rows, and loading
+    the last messages of a session is a single indexed query. The database runs in WAL mode,
+    changes are buffered and written in batches inside a single transaction, and connections
+    come from a small pool, so the backend can be shared by memories in many threads.
+
+    Changes are written when ``batch_size`` of them are buffered, and whenever the backend is
+    flushed, loaded from or closed. Call :meth:`flush` (e.g. after every turn) when each change
+    must be durable right away.
+
+    Args:
+        path (str): The path of the database file.
+        batch_size (int, optional): Number of buffered changes that triggers a write. Default is 32.
+        pool_size (int, optional): Number of connections kept open. Default is 4.
+
+    Example:
+        .. code-block:: python
+
+            from memoravel import Memoravel, SQLiteBackend
+            backend = SQLiteBackend("sessions.db")
+
+            memory = Memoravel(limit=20)
+            memory.bind(backend, "session-42")  # Restores the session, if it exists
+            memory.add("user", "Hello!")
+            backend.flush()
+
+            # The last 10 messages of a session, without creating a memory
+            messages, tokens, counted_with = backend.load("session-42", last_n=10)
+    """
+
+    def __init__(self, path, batch_size=32, pool_size=4):
+        self.path = path
+        self.batch_size = batch_size
+        self._pool = queue.Queue()
+        for _ in range(pool_size):
+            self._pool.put(self._connect())
+        self._pending = []
+        self._lengths = {}
+        self._lock = threading.Lock()
+        with self._connection() as connection:
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    session TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    tokens INTEGER NOT NULL,
+                    message TEXT NOT NULL,
+                    PRIMARY KEY (session, seq)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session TEXT PRIMARY KEY,
+                    counted_with TEXT
+                );
+            """)
+
+    def insert(self, session_id, index, messages, tokens):
+        """
+        Persists ``messages`` (with their token counts) inserted before position ``index`` of the session.
+        """
+        rows = [(count, json.dumps(message, ensure_ascii=False)) for message, count in zip(messages, tokens)]
+        self._buffer(("insert", session_id, index, rows))
+
+    def remove(self, session_id, indices, reason="delete"):
+        """
+        Persists the removal of the messages at ``indices`` (sorted), either by "delete" or by "trim".
+        """
+        if indices:
+            self._buffer(("remove", session_id, list(indices)))
+
+    def replace(self, session_id, messages, tokens, counted_with):
+        """
+        Persists a whole new history for the session, along with how its tokens were counted.
+        """
+        rows = [(count, json.dumps(message, ensure_ascii=False)) for message, count in zip(messages, tokens)]
+        self._buffer(("replace", session_id, rows, json.dumps(counted_with)))
+
+    def load(self, session_id, last_n=None):
+        """
+        Returns the messages of a session, their token counts and how the tokens were counted,
+        or ``([], [], None)`` if the session does not exist.
+
+        Args:
+            session_id (str): The session.
+            last_n (int, optional): Load only the last ``last_n`` messages. Default is None (all of them).
+        """
+        self.flush()
+        with self._connection() as connection:
+            session = connection.execute("SELECT counted_with FROM sessions WHERE session = ?", (session_id,)).fetchone()
+            if last_n is None:
+                rows = connection.execute(
+                    "SELECT tokens, message FROM messages WHERE session = ? ORDER BY seq", (session_id,)).fetchall()
+            else:
+                rows = connection.execute(
+                    "SELECT tokens, message FROM messages WHERE session = ? ORDER BY seq DESC LIMIT ?",
+                    (session_id, last_n)).fetchall()
+                rows.reverse()
+        counted_with = json.loads(session[0]) if session is not None and session[0] is not None else None
+        return [json.loads(row[1]) for row in rows], [row[0] for row in rows], counted_with
+
+    def sessions(self):
+        """
+        Returns the ids of every stored session.
+        """
+        self.flush()
+        with self._connection() as connection:
+            return [row[0] for row in connection.execute("SELECT session FROM sessions ORDER BY session")]
+
+    def delete_session(self, session_id):
+        """
+        Removes a session and all of its messages.
+        """
+        self._buffer(("drop", session_id))
+        self.flush()
+
+    def flush(self):
+        """
+        Writes every buffered change in a single transaction.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if not pending:
+                return
+            with self._connection() as connection:
+                connection.execute("BEGIN")
+                try:
+                    for operation in pending:
+                        getattr(self, "_apply_" + operation[0])(connection, *operation[1:])
+                    connection.execute("COMMIT")
+                except Exception:
+                    connection.execute("ROLLBACK")
+                    # The cached session lengths may include the rolled back changes
+                    self._lengths.clear()
+                    raise
+
+    def close(self):
+        """
+        Flushes the buffered changes and closes every connection.
+        """
+        self.flush()
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def _connect(self):
+
+        connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    @contextmanager
+    def _connection(self):
+
+        connection = self._pool.get()
+        try:
+            yield connection
+        finally:
+            self._pool.put(connection)
+
+    def _buffer(self, operation):
+
+        with self._lock:
+            self._pending.append(operation)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self.flush()
+
+    def _length(self, connection, session_id):
+
+        length = self._lengths.get(session_id)
+        if length is None:
+            length = self._lengths[session_id] = connection.execute(
+                "SELECT COUNT(*) FROM messages WHERE session = ?", (session_id,)).fetchone()[0]
+        return length
+
+    def _seq_at(self, connection, session_id, index):
+
+        return connection.execute(
+            "SELECT seq FROM messages WHERE session = ? ORDER BY seq LIMIT 1 OFFSET ?", (session_id, index)).fetchone()[0]
+
+    def _apply_insert(self, connection, session_id, index, rows):
+
+        connection.execute("INSERT OR IGNORE INTO sessions (session) VALUES (?)", (session_id,))
+        length = self._length(connection, session_id)
+        if index >= length:
+            # Appending: the usual case, a single insert after the last position
+            last = connection.execute("SELECT MAX(seq) FROM messages WHERE session = ?", (session_id,)).fetchone()[0]
+            start = -1 if last is None else last
+            start += 1
+        else:
+            # Make room by shifting the following positions (negated first, to avoid key conflicts)
+            start = self._seq_at(connection, session_id, index)
+            connection.execute("UPDATE messages SET seq = -(seq + ?) WHERE session = ? AND seq >= ?",
+                               (len(rows), session_id, start))
+            connection.execute("UPDATE messages SET seq = -seq WHERE session = ? AND seq < 0", (session_id,))
+        connection.executemany(
+            "INSERT INTO messages (session, seq, tokens, message) VALUES (?, ?, ?, ?)",
+            [(session_id, start + i, count, message) for i, (count, message) in enumerate(rows)])
+        self._lengths[session_id] = length + len(rows)
+
+    def _apply_remove(self, connection, session_id, indices):
+
+        length = self._length(connection, session_id)
+        # Delete each run of consecutive positions, starting from the last one so the
+        # positions of the remaining runs are not shifted
+        runs = []
+        for index in indices:
+            if runs and runs[-1][1] == index:
+                runs[-1][1] = index + 1
+            else:
+                runs.append([index, index + 1])
+        for start, stop in reversed(runs):
+            connection.execute(
+                "DELETE FROM messages WHERE session = ? AND seq IN "
+                "(SELECT seq FROM messages WHERE session = ? ORDER BY seq LIMIT ? OFFSET ?)",
+                (session_id, session_id, stop - start, start))
+        self._lengths[session_id] = length - len(indices)
+
+    def _apply_replace(self, connection, session_id, rows, counted_with):
+
+        connection.execute("DELETE FROM messages WHERE session = ?", (session_id,))
+        connection.execute("INSERT OR REPLACE INTO sessions (session, counted_with) VALUES (?, ?)",
+                           (session_id, counted_with))
+        connection.executemany(
+            "INSERT INTO messages (session, seq, tokens, message) VALUES (?, ?, ?, ?)",
+            [(session_id, i, count, message) for i, (count, message) in enumerate(rows)])
+        self._lengths[session_id] = len(rows)
+
+    def _apply_drop(self, connection, session_id):
+
+        connection.execute("DELETE FROM messages WHERE session = ?", (session_id,))
+        connection.execute("DELETE FROM sessions WHERE session = ?", (session_id,))
+        self._lengths.pop(session_id, None)
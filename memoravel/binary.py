@@ -0,0 +1,142 @@
+import json
+import os
+import struct
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zstd compression is optional
+    zstandard = None
+
+MAGIC = b"MRVLBIN"
+VERSION = 1
+COMPRESSIONS = (None, "zlib", "zstd")
+
+# Magic, version, compression and length of the metadata
+_HEADER = struct.Struct("<7sBBI")
+# Token count, kind of record and length of the message fields
+_RECORD = struct.Struct("<IBI")
+_LENGTH = struct.Struct("<I")
+
+# Kind 0: the message is stored whole as JSON. Kind n > 0: the string content is stored as
+# raw UTF-8 bytes after the other fields, and was the (n - 1)th key of the message
+_PLAIN = 0
+
+
+def is_binary(file_path):
+    """
+    Returns True if ``file_path`` was written in the binary format.
+    """
+    try:
+        with open(file_path, 'rb') as file:
+            return file.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def write_binary(file_path, messages, tokens, meta, compression=None):
+    """
+    Writes a history in the compact binary format.
+
+    The file starts with a versioned header and the metadata, followed by one length-prefixed
+    record per message, holding its cached token count. String contents are stored as raw
+    UTF-8 bytes instead of a JSON string, so contents that are themselves JSON (e.g. tool
+    results) are not escaped a second time. The records can be compressed with zlib or,
+    if the ``zstandard`` package is installed, zstd.
+
+    Args:
+        file_path (str): The path of the file.
+        messages (list): The messages.
+        tokens (list): The token count of each message.
+        meta (dict): Metadata stored with the messages, such as how the tokens were counted.
+        compression (str, optional): None, "zlib" or "zstd". Default is None.
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError("The 'compression' parameter must be None, 'zlib' or 'zstd'.")
+    if compression == "zstd" and zstandard is None:
+        raise ValueError("zstd compression requires the 'zstandard' package.")
+
+    body = bytearray()
+    for message, count in zip(messages, tokens):
+        content = message.get("content")
+        keys = list(message)
+        if isinstance(content, str) and keys.index("content") < 255:
+            fields = _encode({key: value for key, value in message.items() if key != "content"})
+            content = content.encode("utf-8")
+            body += _RECORD.pack(count, keys.index("content") + 1, len(fields))
+            body += fields
+            body += _LENGTH.pack(len(content))
+            body += content
+        else:
+            fields = _encode(message)
+            body += _RECORD.pack(count, _PLAIN, len(fields))
+            body += fields
+
+    if compression == "zlib":
+        body = zlib.compress(body, 1)
+    elif compression == "zstd":
+        body = zstandard.ZstdCompressor().compress(bytes(body))
+
+    meta = _encode(meta)
+    temp_path = file_path + ".tmp"
+    with open(temp_path, 'wb') as file:
+        file.write(_HEADER.pack(MAGIC, VERSION, COMPRESSIONS.index(compression), len(meta)))
+        file.write(meta)
+        file.write(body)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, file_path)
+
+
+def read_binary(file_path):
+    """
+    Reads a file written in the binary format.
+
+    Returns:
+        tuple: The messages, their token counts and the metadata.
+    """
+    with open(file_path, 'rb') as file:
+        data = file.read()
+    if len(data) < _HEADER.size:
+        raise ValueError(f"'{file_path}' is not a memoravel binary file.")
+    magic, version, compression, meta_length = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f"'{file_path}' is not a memoravel binary file.")
+    if version > VERSION:
+        raise ValueError(f"'{file_path}' was written by a newer version of memoravel (format version {version}).")
+
+    position = _HEADER.size
+    meta = json.loads(data[position:position + meta_length])
+    body = data[position + meta_length:]
+    compression = COMPRESSIONS[compression]
+    if compression == "zlib":
+        body = zlib.decompress(body)
+    elif compression == "zstd":
+        if zstandard is None:
+            raise ValueError("Reading zstd compressed files requires the 'zstandard' package.")
+        body = zstandard.ZstdDecompressor().decompressobj().decompress(body)
+
+    messages = []
+    tokens = []
+    body = memoryview(body)
+    position = 0
+    while position < len(body):
+        count, kind, length = _RECORD.unpack_from(body, position)
+        position += _RECORD.size
+        message = json.loads(bytes(body[position:position + length]))
+        position += length
+        if kind != _PLAIN:
+            (length,) = _LENGTH.unpack_from(body, position)
+            position += _LENGTH.size
+            items = list(message.items())
+            items.insert(kind - 1, ("content", str(body[position:position + length], "utf-8")))
+            message = dict(items)
+            position += length
+        messages.append(message)
+        tokens.append(count)
+    return messages, tokens, meta
+
+
+def _encode(value):
+
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
@@ -0,0 +1,332 @@
+"""
+Command-line tool to migrate memories saved with :meth:`Memoravel.save <memoravel.Memoravel.save>`.
+
+Every file is loaded, its tokens are counted for the target model (when they were counted
+for another model or counter), the trimming settings are applied, and the memory is saved
+again, optionally in another format. Files are processed in parallel by a pool of worker
+processes, and their paths are streamed to the workers, so millions of files can be
+migrated without listing them all first.
+
+Usage:
+
+    python -m memoravel sessions/ --model gpt-4o --max-tokens 4000 --limit 50
+    python -m memoravel "archive/**/*.json" --format binary --output migrated/ --report report.jsonl
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from fnmatch import fnmatch
+
+from .journal import read_journal
+from .memoravel import Memoravel
+from .tokens import warm_up
+
+
+def iter_files(paths, pattern="*"):
+    """
+    Yields the ``(path, relative_path)`` of every file to migrate, lazily.
+
+    Each path can be a file, a directory (walked recursively, keeping the files whose name
+    matches ``pattern``) or a glob pattern. The relative path of a file is its path below
+    the directory (or the part of the glob pattern without wildcards) it was found in. The
+    ``.journal`` file next to a journal snapshot is part of it, and is skipped.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, directories, names in os.walk(path):
+                directories.sort()
+                for name in sorted(names):
+                    file_path = os.path.join(root, name)
+                    if fnmatch(name, pattern) and not _is_journal_log(file_path):
+                        yield file_path, os.path.relpath(file_path, path)
+        elif glob.has_magic(path):
+            root = _glob_root(path)
+            for file_path in glob.iglob(path, recursive=True):
+                if os.path.isfile(file_path) and not _is_journal_log(file_path):
+                    yield file_path, os.path.relpath(file_path, root)
+        else:
+            yield path, os.path.basename(path)
+
+
+def _is_journal_log(file_path):
+
+    return file_path.endswith(".journal") and os.path.isfile(file_path[:-len(".journal")])
+
+
+def _glob_root(pattern):
+
+    # The leading directories of a glob pattern, up to the first one with a wildcard
+    parts = pattern.split(os.sep)
+    for i, part in enumerate(parts):
+        if glob.has_magic(part):
+            return os.sep.join(parts[:i]) or os.curdir
+    return os.path.dirname(pattern) or os.curdir
+
+
+def _load(memory, file_path):
+
+    # Loads a file without attaching the memory to it, so a journal is left untouched
+    format = memory._detect_format(file_path)
+    if format == "journal":
+        history, tokens, counted_with, _, _ = read_journal(file_path)
+        if counted_with != memory._counted_with():
+            tokens = memory._count_messages_tokens(history) if history else []
+        memory._replace(history, tokens)
+    else:
+        memory.load(file_path, format=format)
+    return format
+
+
+def migrate_file(file_path, destination, settings, format=None, dry_run=False):
+    """
+    Migrates one saved memory and returns a dict describing the result.
+
+    The memory is loaded with the given ``settings`` (the keyword arguments of
+    :class:`~memoravel.Memoravel`), trimmed, and saved to ``destination`` in ``format``
+    (by default, the format it was loaded from). Files other than journals are written to a
+    temporary file first and then renamed, so an interrupted migration never leaves a
+    truncated memory behind. Errors are returned instead of raised, as ``{"path", "error"}``.
+    """
+    start = time.perf_counter()
+    try:
+        memory = Memoravel(**settings)
+        source_format = _load(memory, file_path)
+        messages, tokens = len(memory.history), memory.count_tokens()
+        memory._trim_history()
+        result = {
+            "path": file_path,
+            "format": format or source_format,
+            "messages": [messages, len(memory.history)],
+            "tokens": [tokens, memory.count_tokens()],
+            "bytes": 0,
+        }
+        if not dry_run:
+            format = format or source_format
+            directory = os.path.dirname(destination)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            if format == "journal":
+                memory.save(destination, format="journal")
+                memory.journal.close()
+                result["bytes"] = os.path.getsize(destination) + os.path.getsize(destination + ".journal")
+            else:
+                temporary = destination + ".tmp"
+                memory.save(temporary, format=format)
+                os.replace(temporary, destination)
+                result["bytes"] = os.path.getsize(destination)
+                if source_format == "journal" and os.path.abspath(destination) == os.path.abspath(file_path):
+                    # The journal of the replaced snapshot no longer applies to it
+                    os.remove(file_path + ".journal")
+    except Exception as e:
+        return {"path": file_path, "error": f"{type(e).__name__}: {e}", "seconds": time.perf_counter() - start}
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def migrate_files(tasks, settings, format=None, dry_run=False):
+    """
+    Migrates a chunk of ``(file_path, destination)`` pairs in a worker, see :func:`migrate_file`.
+    """
+    return [migrate_file(file_path, destination, settings, format, dry_run) for file_path, destination in tasks]
+
+
+class MigrationStats:
+    """
+    Aggregates the results of a migration, keeping only totals so memory use stays constant.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.files = 0
+        self.failed = 0
+        self.trimmed = 0
+        self.messages = [0, 0]
+        self.tokens = [0, 0]
+        self.bytes = 0
+
+    def add(self, result):
+        """
+        Adds the result of one file.
+        """
+        self.files += 1
+        if "error" in result:
+            self.failed += 1
+            return
+        self.trimmed += result["messages"][1] < result["messages"][0]
+        for i in (0, 1):
+            self.messages[i] += result["messages"][i]
+            self.tokens[i] += result["tokens"][i]
+        self.bytes += result["bytes"]
+
+    @property
+    def elapsed(self):
+        """
+        Seconds since the migration started.
+        """
+        return time.perf_counter() - self.started
+
+    def progress(self):
+        """
+        Returns a one-line progress report.
+        """
+        rate = self.files / self.elapsed if self.elapsed else 0.0
+        return f"{self.files} files ({self.failed} failed), {rate:.0f} files/s"
+
+    def summary(self):
+        """
+        Returns the totals as a dict.
+        """
+        return {
+            "files": self.files,
+            "failed": self.failed,
+            "trimmed": self.trimmed,
+            "messages_before": self.messages[0],
+            "messages_after": self.messages[1],
+            "tokens_before": self.tokens[0],
+            "tokens_after": self.tokens[1],
+            "bytes_written": self.bytes,
+            "seconds": round(self.elapsed, 3),
+        }
+
+
+def _chunks(files, output, size):
+
+    # Groups the (file_path, destination) pairs to migrate, so each task amortizes its overhead
+    chunk = []
+    for file_path, relative_path in files:
+        chunk.append((file_path, os.path.join(output, relative_path) if output else file_path))
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run(files, settings, format=None, output=None, dry_run=False, workers=None, chunksize=16, on_result=None):
+    """
+    Migrates ``files`` (``(path, relative_path)`` pairs, see :func:`iter_files`) and returns
+    the :class:`MigrationStats`.
+
+    Chunks of files are submitted to a pool of ``workers`` processes (every core by
+    default, or none with 0, migrating in this process), never more than a few per worker at
+    a time, so neither the paths nor the results accumulate in memory. ``on_result`` is
+    called with the result of each file as soon as it is done.
+    """
+    stats = MigrationStats()
+
+    def collect(results):
+        for result in results:
+            stats.add(result)
+            if on_result is not None:
+                on_result(result, stats)
+
+    chunks = _chunks(files, output, chunksize)
+    if workers == 0:
+        for chunk in chunks:
+            collect(migrate_files(chunk, settings, format, dry_run))
+        return stats
+
+    workers = workers or os.cpu_count() or 1
+    try:
+        # Workers created by forking inherit the loaded encoder
+        warm_up(settings.get("model", "gpt-4o"))
+    except Exception:
+        pass  # Every file will report the error instead
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for chunk in chunks:
+            pending.add(executor.submit(migrate_files, chunk, settings, format, dry_run))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future.result())
+        for future in pending:
+            collect(future.result())
+    return stats
+
+
+def build_parser():
+    """
+    Returns the argument parser of ``python -m memoravel``.
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m memoravel",
+        description="Recount, re-trim and convert memories saved by memoravel, in parallel.")
+    parser.add_argument("paths", nargs="+", help="Files, directories (walked recursively) or glob patterns of saved memories.")
+    parser.add_argument("--pattern", default="*", help="Only migrate the files of the directories whose name matches this pattern. Default is '*'.")
+    parser.add_argument("--output", help="Directory the migrated memories are written to, keeping their relative paths. Default is to overwrite them in place.")
+    parser.add_argument("--format", choices=("json", "journal", "indexed", "binary"), help="Format to save the memories in. Default is the format of each file.")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing anything.")
+    settings = parser.add_argument_group("memory settings", "See the parameters of Memoravel.")
+    settings.add_argument("--model", default="gpt-4o", help="Model the tokens are counted for. Default is 'gpt-4o'.")
+    settings.add_argument("--token-counter", choices=("json", "chat"), default="json", help="How the tokens of each message are counted. Default is 'json'.")
+    settings.add_argument("--limit", type=int, default=0, help="Maximum number of messages, 0 for unlimited. Default is 0.")
+    settings.add_argument("--max-tokens", type=int, default=0, help="Maximum number of tokens, 0 for unlimited. Default is 0.")
+    settings.add_argument("--preserve-initial-memories", type=int, default=0, help="Number of initial messages never trimmed. Default is 0.")
+    settings.add_argument("--no-preserve-system-memories", dest="preserve_system_memories", action="store_false", help="Allow system messages to be trimmed.")
+    settings.add_argument("--preserve-last-memories", type=int, default=1, help="Number of last messages never trimmed. Default is 1.")
+    settings.add_argument("--low-watermark", type=float, default=1.0, help="Fraction of the limits the history is trimmed down to. Default is 1.0.")
+    settings.add_argument("--eviction", choices=("fifo", "prefix_cache", "relevance"), default="fifo", help="Which messages are trimmed. Default is 'fifo'.")
+    execution = parser.add_argument_group("execution")
+    execution.add_argument("--workers", type=int, help="Number of worker processes, 0 to migrate in this process. Default is the number of cores.")
+    execution.add_argument("--chunksize", type=int, default=16, help="Files sent to a worker at a time. Default is 16.")
+    execution.add_argument("--report", help="Write the result of every file to this file, as JSON lines.")
+    execution.add_argument("--quiet", action="store_true", help="Do not report progress and errors.")
+    return parser
+
+
+def main(argv=None):
+    """
+    Runs ``python -m memoravel`` and returns its exit status: 0, or 1 if any file failed.
+    """
+    args = build_parser().parse_args(argv)
+    if args.chunksize <= 0:
+        raise SystemExit("--chunksize must be greater than 0.")
+    settings = {
+        "model": args.model,
+        "token_counter": args.token_counter,
+        "limit": args.limit,
+        "max_tokens": args.max_tokens,
+        "preserve_initial_memories": args.preserve_initial_memories,
+        "preserve_system_memories": args.preserve_system_memories,
+        "preserve_last_memories": args.preserve_last_memories,
+        "low_watermark": args.low_watermark,
+        "eviction": args.eviction,
+    }
+    try:
+        # Reports invalid settings once, instead of once per file
+        Memoravel(**settings)
+    except ValueError as e:
+        raise SystemExit(f"Invalid settings: {e}")
+
+    report = open(args.report, "w", encoding="utf-8") if args.report else None
+    last_progress = [0.0]
+
+    def on_result(result, stats):
+        if report is not None:
+            report.write(json.dumps(result, ensure_ascii=False) + "\n")
+        if args.quiet:
+            return
+        if "error" in result:
+            print(f"error: {result['path']}: {result['error']}", file=sys.stderr)
+        if stats.elapsed - last_progress[0] >= 1:
+            last_progress[0] = stats.elapsed
+            print(stats.progress(), file=sys.stderr)
+
+    try:
+        stats = run(iter_files(args.paths, args.pattern), settings, args.format, args.output,
+                    args.dry_run, args.workers, args.chunksize, on_result)
+    finally:
+        if report is not None:
+            report.close()
+
+    summary = stats.summary()
+    if not args.quiet:
+        print(stats.progress(), file=sys.stderr)
+    print(json.dumps(summary, indent=2))
+    return 1 if summary["failed"] else 0
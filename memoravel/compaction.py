@@ -0,0 +1,82 @@
+import inspect
+
+
+class TruncatingSummarizer:
+    """
+    A deterministic summarizer, which keeps the beginning of each message.
+
+    It does not call any model, so it is meant for tests and as a fallback: the summary lists
+    the role and the first ``chars_per_message`` characters of each summarized message. The
+    lines of a previous summary are carried over, dropping the oldest ones once the summary
+    would exceed ``max_chars``.
+
+    Any callable receiving a list of messages and returning the summary (a string or a whole
+    message), or an awaitable of it, can be used as the ``summarizer`` of a memory.
+
+    Args:
+        chars_per_message (int, optional): Number of characters kept from each message. Default is 80.
+        max_chars (int, optional): Maximum length of the summary. Default is 2000.
+
+    Example:
+        .. code-block:: python
+
+            from memoravel import Memoravel, TruncatingSummarizer
+            memory = Memoravel(limit=0, max_tokens=4000, summarizer=TruncatingSummarizer())
+    """
+
+    prefix = "Summary of the earlier conversation:"
+
+    def __init__(self, chars_per_message=80, max_chars=2000):
+        self.chars_per_message = chars_per_message
+        self.max_chars = max_chars
+
+    def __call__(self, messages):
+        lines = []
+        for message in messages:
+            content = message.get("content")
+            if not isinstance(content, str):
+                continue
+            if content.startswith(self.prefix):
+                lines.extend(content.splitlines()[1:])
+            else:
+                content = " ".join(content.split())
+                if len(content) > self.chars_per_message:
+                    content = content[:self.chars_per_message] + "..."
+                lines.append(f"- {message['role']}: {content}")
+        length = len(self.prefix) + sum(len(line) + 1 for line in lines)
+        while lines and length > self.max_chars:
+            length -= len(lines.pop(0)) + 1
+        return "\n".join([self.prefix] + lines)
+
+
+def summary_message(summary):
+    """
+    Returns the message replacing the summarized messages: the summary itself if the
+    summarizer returned a message, or an assistant message with the summary as content.
+    """
+    if isinstance(summary, dict):
+        return summary
+    return {"role": "assistant", "content": summary}
+
+
+def run_summarizer(summarizer, messages):
+    """
+    Calls a sync or async summarizer from synchronous code.
+    """
+    summary = summarizer(messages)
+    if inspect.isawaitable(summary):
+        # Imported here: asyncio is slow to import, and only async summarizers need it
+        import asyncio
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(_await(summary))
+        if inspect.iscoroutine(summary):
+            summary.close()
+        raise ValueError("An async summarizer cannot be run by a Memoravel used in an event loop; use AsyncMemoravel instead.")
+    return summary
+
+
+async def _await(awaitable):
+
+    return await awaitable
@@ -0,0 +1,125 @@
+class FIFOEviction:
+    """
+    Evicts the oldest removable messages first. This is the default eviction policy.
+
+    An eviction policy is any object with a ``name`` and a ``select(memory, start, stop,
+    total_tokens, length)`` method, returning the sorted indices of the messages to evict
+    from the removable window ``[start, stop)`` of the memory's history, where
+    ``total_tokens`` and ``length`` are the current size of the history. Custom policies can
+    be given to :class:`~memoravel.Memoravel` as well.
+
+    A policy whose choice depends on the token count of each message, and not only on
+    whether the history exceeds its limits, must not set ``reads_tokens`` to False: with
+    ``token_estimation``, the messages it may read are counted exactly before it is called.
+    """
+
+    name = "fifo"
+    reads_tokens = False
+
+    def select(self, memory, start, stop, total_tokens, length):
+        """
+        Returns the indices of the oldest removable messages, up to the low watermark.
+        """
+        to_remove = []
+        for i, (role, tokens) in enumerate(memory.history.entries(start, stop), start):
+            if not memory._exceeds_limits(total_tokens, length, memory.low_watermark):
+                break
+            # If preserve_system_memories is active, skip system messages
+            if memory.preserve_system_memories and role == "system":
+                continue
+            to_remove.append(i)
+            total_tokens -= tokens
+            length -= 1
+        return to_remove
+
+
+class PrefixCacheEviction(FIFOEviction):
+    """
+    Evicts messages so the beginning of the prompt stays cacheable by the provider.
+
+    Providers cache the longest prefix of a prompt that was already sent, so evicting the
+    oldest messages changes the prefix of every following request and misses the cache.
+    This policy never evicts the messages within the first ``stable_prefix_tokens`` tokens
+    of the history (e.g. the system prompt and the first turns), evicts from just after
+    them, and evicts at least ``min_evict_tokens`` tokens at a time, so the prompt keeps the
+    same prefix for many turns after each eviction. The stable prefix never takes more than
+    half of what the history is trimmed down to (its ``max_tokens`` and ``limit`` times its
+    ``low_watermark``), so there is always room to evict after it. If the history cannot fit
+    its limits otherwise, the stable prefix is evicted as well, also in a large chunk.
+
+    Args:
+        stable_prefix_tokens (int, optional): Size of the prefix that is never evicted. Default is 1024, the minimum prompt size cached by OpenAI.
+        min_evict_tokens (int, optional): Minimum number of tokens evicted at once. Default is 1024.
+
+    Example:
+        .. code-block:: python
+
+            from memoravel import Memoravel, PrefixCacheEviction
+            memory = Memoravel(limit=0, max_tokens=16000, eviction=PrefixCacheEviction(stable_prefix_tokens=2048))
+    """
+
+    name = "prefix_cache"
+    reads_tokens = True
+
+    def __init__(self, stable_prefix_tokens=1024, min_evict_tokens=1024):
+        self.stable_prefix_tokens = stable_prefix_tokens
+        self.min_evict_tokens = min_evict_tokens
+
+    def select(self, memory, start, stop, total_tokens, length):
+        """
+        Returns the indices of the messages after the stable prefix to evict, in one large chunk.
+        """
+        # The stable prefix ends at the first message that does not fit entirely in it. It is
+        # clamped to half of what the history is trimmed down to, so the other half is left
+        # for the messages added between two evictions
+        prefix_budget = self.stable_prefix_tokens
+        if memory.max_tokens > 0:
+            prefix_budget = min(prefix_budget, memory.max_tokens * memory.low_watermark / 2)
+        prefix_stop = min(stop, int(memory.limit * memory.low_watermark) // 2) if memory.limit > 0 else stop
+        boundary = 0
+        prefix_tokens = 0
+        for role, tokens in memory.history.entries(0, prefix_stop):
+            if prefix_tokens + tokens > prefix_budget:
+                break
+            prefix_tokens += tokens
+            boundary += 1
+
+        to_remove, evicted, total_tokens, length = self._chunk(memory, max(start, boundary), stop, 0, total_tokens, length)
+        if boundary > start and memory._exceeds_limits(total_tokens, length):
+            # The limits cannot be met after the stable prefix alone: evict from the prefix,
+            # in a chunk as well
+            from_prefix, _, _, _ = self._chunk(memory, start, boundary, evicted, total_tokens, length)
+            to_remove = from_prefix + to_remove
+        return to_remove
+
+    def _chunk(self, memory, start, stop, evicted, total_tokens, length):
+
+        # Evicts from start until at least min_evict_tokens are evicted and the history is
+        # down to its low watermark
+        to_remove = []
+        for i, (role, tokens) in enumerate(memory.history.entries(start, stop), start):
+            if evicted >= self.min_evict_tokens and not memory._exceeds_limits(total_tokens, length, memory.low_watermark):
+                break
+            if memory.preserve_system_memories and role == "system":
+                continue
+            to_remove.append(i)
+            evicted += tokens
+            total_tokens -= tokens
+            length -= 1
+        return to_remove, evicted, total_tokens, length
+
+
+def get_eviction_policy(eviction):
+    """
+    Returns an eviction policy from its name ("fifo", "prefix_cache" or "relevance"), or the given policy itself.
+    """
+    if eviction == "fifo":
+        return FIFOEviction()
+    if eviction == "prefix_cache":
+        return PrefixCacheEviction()
+    if eviction == "relevance":
+        from .relevance import RelevanceEviction
+        return RelevanceEviction()
+    if isinstance(eviction, str) or not hasattr(eviction, "select"):
+        raise ValueError("The 'eviction' parameter must be 'fifo', 'prefix_cache', 'relevance' or an eviction policy object.")
+    return eviction
@@ -0,0 +1,17 @@
+class MemoravelError(Exception):
+    """
+    Base class of the errors raised by memoravel.
+    """
+
+
+class TokenCountError(MemoravelError):
+    """
+    Raised when the tokens of a message cannot be counted, e.g. because the encoder of the
+    model cannot be loaded or the token counter fails.
+    """
+
+
+class PersistenceError(MemoravelError):
+    """
+    Raised when a memory cannot be saved to or loaded from a file.
+    """
@@ -0,0 +1,590 @@
+from bisect import bisect_right
+from collections import deque
+from collections.abc import Sequence
+from itertools import islice
+
+
+class ListHistory:
+    """
+    Stores the messages of a :class:`~memoravel.Memoravel` in plain lists, together with the
+    token count of each message and their running total.
+
+    This is the default storage. It is the fastest one for random access, but removing
+    messages from the front of a long history shifts every message after them.
+    """
+
+    def __init__(self):
+        self._messages = []
+        self._tokens = []
+        self.total_tokens = 0
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __iter__(self):
+        return iter(self._messages)
+
+    def __getitem__(self, index_or_slice):
+        return self._messages[index_or_slice]
+
+    def tokens(self, index_or_slice):
+        """
+        Returns the cached token count of a message, or a list of counts for a slice.
+        """
+        return self._tokens[index_or_slice]
+
+    def entries(self, start, stop):
+        """
+        Iterates over ``(role, tokens)`` pairs of the messages in ``[start, stop)``.
+        """
+        for i in range(max(start, 0), min(stop, len(self._messages))):
+            yield self._messages[i]["role"], self._tokens[i]
+
+    def splice(self, index, messages, tokens):
+        """
+        Inserts ``messages`` (with their token counts) before ``index``, following the
+        semantics of ``list.insert``.
+        """
+        self._messages[index:index] = messages
+        self._tokens[index:index] = tokens
+        self.total_tokens += sum(tokens)
+
+    def remove(self, indices):
+        """
+        Removes the messages at ``indices`` (sorted in ascending order) in a single operation.
+        """
+        if not indices:
+            return
+        if indices[-1] - indices[0] + 1 == len(indices):
+            # Contiguous block: a single slice deletion
+            removed = slice(indices[0], indices[-1] + 1)
+            self.total_tokens -= sum(self._tokens[removed])
+            del self._messages[removed]
+            del self._tokens[removed]
+        else:
+            removed = set(indices)
+            self.total_tokens -= sum(self._tokens[i] for i in indices)
+            self._messages[:] = [msg for i, msg in enumerate(self._messages) if i not in removed]
+            self._tokens[:] = [tokens for i, tokens in enumerate(self._tokens) if i not in removed]
+
+    def recount(self, start, tokens):
+        """
+        Replaces the token counts of the messages from ``start`` to the end of the history.
+        """
+        self.total_tokens += sum(tokens) - sum(self._tokens[start:])
+        self._tokens[start:] = tokens
+
+    def replace(self, messages, tokens):
+        """
+        Replaces the whole content of the history.
+        """
+        self._messages = list(messages)
+        self._tokens = list(tokens)
+        self.total_tokens = sum(self._tokens)
+
+
+class DequeHistory:
+    """
+    Stores the messages of a :class:`~memoravel.Memoravel` for append-heavy workloads that
+    evict from the front.
+
+    The first ``preserved`` messages (the ``preserve_initial_memories`` of the memory) are
+    kept in a small list, and every message after them lives in a deque. Trimming removes
+    messages from the start of the deque, so evicting the oldest removable message costs
+    O(1) instead of shifting the whole history, and the preserved prefix and the most recent
+    messages are never moved.
+
+    Args:
+        preserved (int, optional): Number of initial messages kept out of the deque. Default is 0.
+    """
+
+    def __init__(self, preserved=0):
+        self.preserved = preserved
+        self._head_messages = []
+        self._head_tokens = []
+        self._body_messages = deque()
+        self._body_tokens = deque()
+        self.total_tokens = 0
+
+    def __len__(self):
+        return len(self._head_messages) + len(self._body_messages)
+
+    def __iter__(self):
+        yield from self._head_messages
+        yield from self._body_messages
+
+    def __getitem__(self, index_or_slice):
+        return self._get(self._head_messages, self._body_messages, index_or_slice)
+
+    def tokens(self, index_or_slice):
+        """
+        Returns the cached token count of a message, or a list of counts for a slice.
+        """
+        return self._get(self._head_tokens, self._body_tokens, index_or_slice)
+
+    def entries(self, start, stop):
+        """
+        Iterates over ``(role, tokens)`` pairs of the messages in ``[start, stop)``.
+        """
+        start = max(start, 0)
+        stop = min(stop, len(self))
+        if start >= stop:
+            return
+        head_length = len(self._head_messages)
+        for i in range(start, min(stop, head_length)):
+            yield self._head_messages[i]["role"], self._head_tokens[i]
+        if stop <= head_length:
+            return
+        body_length = len(self._body_messages)
+        low, high = max(start - head_length, 0), stop - head_length
+        if low > body_length - high:
+            # The range is closer to the right end: walk the deque from there
+            body = list(islice(zip(reversed(self._body_messages), reversed(self._body_tokens)), body_length - high, body_length - low))
+            body.reverse()
+        else:
+            # Lazily, so a caller that stops early (e.g. trimming) never walks the rest
+            body = islice(zip(self._body_messages, self._body_tokens), low, high)
+        for message, count in body:
+            yield message["role"], count
+
+    def splice(self, index, messages, tokens):
+        """
+        Inserts ``messages`` (with their token counts) before ``index``, following the
+        semantics of ``list.insert``.
+        """
+        length = len(self)
+        if index < 0:
+            index = max(index + length, 0)
+        index = min(index, length)
+
+        head_length = len(self._head_messages)
+        if index < head_length or (index == head_length and head_length < self.preserved):
+            self._head_messages[index:index] = messages
+            self._head_tokens[index:index] = tokens
+        else:
+            self._insert_body(index - head_length, messages, tokens)
+        self.total_tokens += sum(tokens)
+        self._rebalance()
+
+    def remove(self, indices):
+        """
+        Removes the messages at ``indices`` (sorted in ascending order) in a single operation.
+        """
+        if not indices:
+            return
+        head_length = len(self._head_messages)
+        head_indices = [i for i in indices if i < head_length]
+        body_indices = [i - head_length for i in indices if i >= head_length]
+
+        if head_indices:
+            removed = set(head_indices)
+            self.total_tokens -= sum(self._head_tokens[i] for i in head_indices)
+            self._head_messages = [msg for i, msg in enumerate(self._head_messages) if i not in removed]
+            self._head_tokens = [tokens for i, tokens in enumerate(self._head_tokens) if i not in removed]
+        if body_indices:
+            self._remove_body(body_indices)
+        self._rebalance()
+
+    def recount(self, start, tokens):
+        """
+        Replaces the token counts of the messages from ``start`` to the end of the history.
+        """
+        head_length = len(self._head_tokens)
+        # The counts are replaced from the right end of the deque, where new messages are added
+        popped = [self._body_tokens.pop() for _ in range(len(self) - max(start, head_length))]
+        self.total_tokens -= sum(popped)
+        if start < head_length:
+            self.total_tokens += sum(tokens[:head_length - start]) - sum(self._head_tokens[start:])
+            self._head_tokens[start:] = tokens[:head_length - start]
+            tokens = tokens[head_length - start:]
+        self._body_tokens.extend(tokens)
+        self.total_tokens += sum(tokens)
+
+    def replace(self, messages, tokens):
+        """
+        Replaces the whole content of the history.
+        """
+        self._head_messages = []
+        self._head_tokens = []
+        self._body_messages = deque(messages)
+        self._body_tokens = deque(tokens)
+        self.total_tokens = sum(self._body_tokens)
+        self._rebalance()
+
+    def _insert_body(self, offset, messages, tokens):
+
+        if offset == len(self._body_messages):
+            self._body_messages.extend(messages)
+            self._body_tokens.extend(tokens)
+            return
+        # Rotate the insertion point to the left end, insert there and rotate back
+        self._body_messages.rotate(-offset)
+        self._body_tokens.rotate(-offset)
+        self._body_messages.extendleft(reversed(messages))
+        self._body_tokens.extendleft(reversed(tokens))
+        self._body_messages.rotate(offset)
+        self._body_tokens.rotate(offset)
+
+    def _remove_body(self, offsets):
+
+        messages = self._body_messages
+        tokens = self._body_tokens
+        removed = set(offsets)
+        if offsets[-1] < len(messages) - offsets[0]:
+            # Removal close to the front (the usual trimming case): pop everything up to
+            # the last removed message and push back the ones that must stay
+            stop = offsets[-1] + 1
+            popped = [(messages.popleft(), tokens.popleft()) for _ in range(stop)]
+            kept = [entry for i, entry in enumerate(popped) if i not in removed]
+            self.total_tokens -= sum(entry[1] for i, entry in enumerate(popped) if i in removed)
+            for message, count in reversed(kept):
+                messages.appendleft(message)
+                tokens.appendleft(count)
+        else:
+            # Removal close to the end: do the same from the right side
+            first = offsets[0]
+            popped = [(messages.pop(), tokens.pop()) for _ in range(len(messages) - first)]
+            popped.reverse()
+            kept = [entry for i, entry in enumerate(popped, first) if i not in removed]
+            self.total_tokens -= sum(entry[1] for i, entry in enumerate(popped, first) if i in removed)
+            for message, count in kept:
+                messages.append(message)
+                tokens.append(count)
+
+    def _rebalance(self):
+
+        # Keep exactly min(preserved, len(self)) messages in the head
+        overflow = len(self._head_messages) - self.preserved
+        if overflow > 0:
+            self._body_messages.extendleft(reversed(self._head_messages[self.preserved:]))
+            self._body_tokens.extendleft(reversed(self._head_tokens[self.preserved:]))
+            del self._head_messages[self.preserved:]
+            del self._head_tokens[self.preserved:]
+        while len(self._head_messages) < self.preserved and self._body_messages:
+            self._head_messages.append(self._body_messages.popleft())
+            self._head_tokens.append(self._body_tokens.popleft())
+
+    def _range(self, head, body, start, stop):
+
+        head_length = len(head)
+        result = head[start:stop]
+        if stop > head_length:
+            low, high = max(start - head_length, 0), stop - head_length
+            if low > len(body) - high:
+                # The range is closer to the right end (e.g. the last messages): walk from there
+                tail = list(islice(reversed(body), len(body) - high, len(body) - low))
+                tail.reverse()
+                result.extend(tail)
+            else:
+                result.extend(islice(body, low, high))
+        return result
+
+    def _get(self, head, body, index_or_slice):
+
+        length = len(head) + len(body)
+        if isinstance(index_or_slice, slice):
+            indices = range(*index_or_slice.indices(length))
+            if not indices:
+                return []
+            low = min(indices[0], indices[-1])
+            high = max(indices[0], indices[-1]) + 1
+            chunk = self._range(head, body, low, high)
+            return chunk[indices[0] - low::indices.step]
+        index = index_or_slice
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError("history index out of range")
+        if index < len(head):
+            return head[index]
+        return body[index - len(head)]
+
+
+class SharedHistory:
+    """
+    Stores the messages of a :class:`~memoravel.Memoravel` as ranges of other histories, so
+    the memories forked from each other (see :meth:`Memoravel.fork <memoravel.Memoravel.fork>`)
+    share the messages they have in common, with their token counts.
+
+    Each segment is a range of a history. A segment shared with another memory is never
+    modified: removing messages from it only narrows or splits its range, and new messages
+    go into segments of their own, which are modified in place until they are shared in
+    turn. Forking shares every segment, so it costs the same whatever the length of the
+    history, and each branch only stores the messages it added.
+
+    Args:
+        history (object, optional): A history whose messages become the first, shared segment. Default is None (empty).
+    """
+
+    # Above this many segments, the history is copied into a single one
+    max_segments = 64
+
+    def __init__(self, history=None):
+        # Each segment is [history, start, stop, owned], where an owned segment covers its
+        # whole history, which no other memory references
+        self._segments = []
+        self._starts = None
+        self._length = 0
+        self.total_tokens = 0
+        if history is not None and len(history):
+            self._segments.append([history, 0, len(history), False])
+            self._length = len(history)
+            self.total_tokens = history.total_tokens
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        for history, start, stop, _ in self._segments:
+            yield from history[start:stop]
+
+    def __getitem__(self, index_or_slice):
+        return self._get(index_or_slice, False)
+
+    def tokens(self, index_or_slice):
+        """
+        Returns the cached token count of a message, or a list of counts for a slice.
+        """
+        return self._get(index_or_slice, True)
+
+    def entries(self, start, stop):
+        """
+        Iterates over ``(role, tokens)`` pairs of the messages in ``[start, stop)``.
+        """
+        start = max(start, 0)
+        stop = min(stop, self._length)
+        if start >= stop:
+            return
+        i, offset = self._locate(start)
+        for history, first, last, _ in self._segments[i:]:
+            if offset >= stop:
+                break
+            yield from history.entries(first + max(start - offset, 0), first + min(stop - offset, last - first))
+            offset += last - first
+
+    def fork(self):
+        """
+        Returns a history with the same messages, sharing every segment of this one.
+        """
+        for segment in self._segments:
+            segment[3] = False
+        forked = SharedHistory()
+        forked._segments = [list(segment) for segment in self._segments]
+        forked._length = self._length
+        forked.total_tokens = self.total_tokens
+        return forked
+
+    def splice(self, index, messages, tokens):
+        """
+        Inserts ``messages`` (with their token counts) before ``index``, following the
+        semantics of ``list.insert``.
+        """
+        if not messages:
+            return
+        length = self._length
+        index = min(max(index + length, 0) if index < 0 else index, length)
+        i, offset = self._locate(index) if index < length else (len(self._segments), length)
+        if index == offset and i > 0 and self._segments[i - 1][3]:
+            # At the end of an owned segment
+            i -= 1
+            offset -= self._segments[i][2]
+        if i < len(self._segments) and self._segments[i][3]:
+            segment = self._segments[i]
+            segment[0].splice(index - offset, messages, tokens)
+            segment[2] = len(segment[0])
+        else:
+            segment = self._owned(messages, tokens)
+            if index == offset:
+                self._segments.insert(i, segment)
+            else:
+                # Split the shared segment around the new one
+                history, start, stop, _ = self._segments[i]
+                split = start + index - offset
+                self._segments[i:i + 1] = [[history, start, split, False], segment, [history, split, stop, False]]
+        self._length += len(messages)
+        self.total_tokens += sum(tokens)
+        self._changed()
+
+    def remove(self, indices):
+        """
+        Removes the messages at ``indices`` (sorted in ascending order) in a single operation.
+        """
+        if not indices:
+            return
+        segments = []
+        position = 0
+        offset = 0
+        for segment in self._segments:
+            history, start, stop, owned = segment
+            end = offset + stop - start
+            removed = []
+            while position < len(indices) and indices[position] < end:
+                removed.append(indices[position] - offset)
+                position += 1
+            offset = end
+            if not removed:
+                segments.append(segment)
+            elif owned:
+                total_tokens = history.total_tokens
+                history.remove(removed)
+                self.total_tokens -= total_tokens - history.total_tokens
+                segment[2] = len(history)
+                if len(history):
+                    segments.append(segment)
+            else:
+                # Keep the ranges between the removed messages of the shared segment
+                previous = start
+                for i in removed:
+                    self.total_tokens -= history.tokens(start + i)
+                    if start + i > previous:
+                        segments.append(self._narrowed(history, previous, start + i))
+                    previous = start + i + 1
+                if stop > previous:
+                    segments.append(self._narrowed(history, previous, stop))
+        self._segments = segments
+        self._length -= len(indices)
+        self._changed()
+
+    def replace(self, messages, tokens):
+        """
+        Replaces the whole content of the history.
+        """
+        self._segments = [self._owned(messages, tokens)] if messages else []
+        self._length = len(messages)
+        self.total_tokens = sum(tokens)
+        self._changed()
+
+    def recount(self, start, tokens):
+        """
+        Replaces the token counts of the messages from ``start`` to the end of the history.
+        """
+        if start >= self._length:
+            return
+        messages = self[start:]
+        # The counts of shared segments must not change, so the messages move to a new segment
+        self.remove(list(range(start, self._length)))
+        self.splice(start, messages, tokens)
+
+    def _owned(self, messages, tokens):
+
+        history = ListHistory()
+        history.splice(0, messages, tokens)
+        return [history, 0, len(history), True]
+
+    def _narrowed(self, history, start, stop):
+
+        # A range of a shared history, copied out once it keeps most of the history alive
+        # for few messages
+        if 4 * (stop - start) < len(history):
+            return self._owned(history[start:stop], history.tokens(slice(start, stop)))
+        return [history, start, stop, False]
+
+    def _changed(self):
+
+        self._starts = None
+        if len(self._segments) > self.max_segments:
+            messages, tokens = self[:], self.tokens(slice(None))
+            self._segments = [self._owned(messages, tokens)]
+
+    def _locate(self, index):
+
+        # Returns the position of the segment holding index and the index of its first message
+        if self._starts is None:
+            self._starts = []
+            offset = 0
+            for _, start, stop, _ in self._segments:
+                self._starts.append(offset)
+                offset += stop - start
+        i = bisect_right(self._starts, index) - 1
+        return i, self._starts[i]
+
+    def _range(self, start, stop, tokens):
+
+        result = []
+        if start >= stop:
+            return result
+        i, offset = self._locate(start)
+        for history, first, last, _ in self._segments[i:]:
+            if offset >= stop:
+                break
+            part = slice(first + max(start - offset, 0), first + min(stop - offset, last - first))
+            result.extend(history.tokens(part) if tokens else history[part])
+            offset += last - first
+        return result
+
+    def _get(self, index_or_slice, tokens):
+
+        if isinstance(index_or_slice, slice):
+            indices = range(*index_or_slice.indices(self._length))
+            if not indices:
+                return []
+            low = min(indices[0], indices[-1])
+            high = max(indices[0], indices[-1]) + 1
+            chunk = self._range(low, high, tokens)
+            return chunk[indices[0] - low::indices.step]
+        index = index_or_slice
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("history index out of range")
+        i, offset = self._locate(index)
+        history, start = self._segments[i][:2]
+        return history.tokens(start + index - offset) if tokens else history[start + index - offset]
+
+
+class HistoryView(Sequence):
+    """
+    A read-only view of a range of a history, which does not copy the messages.
+
+    Views are returned by :meth:`Memoravel.view <memoravel.Memoravel.view>`. They support
+    ``len``, indexing, slicing (which returns another view) and iteration, and reflect the
+    history as it was when the view was created: a view must not be used after the memory
+    is changed.
+    """
+
+    def __init__(self, history, indices):
+        self._history = history
+        self._indices = indices
+
+    def __len__(self):
+        return len(self._indices)
+
+    def __iter__(self):
+        if type(self._history) is ListHistory:
+            # Index the list directly, without copying any part of it
+            return map(self._history._messages.__getitem__, self._indices)
+        return iter(self._read(self._history.__getitem__))
+
+    def __getitem__(self, index_or_slice):
+        if isinstance(index_or_slice, slice):
+            return HistoryView(self._history, self._indices[index_or_slice])
+        return self._history[self._indices[index_or_slice]]
+
+    def __eq__(self, other):
+        if isinstance(other, (HistoryView, list)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self):
+        return f"HistoryView({list(self)!r})"
+
+    def tokens(self):
+        """
+        Returns the cached token count of each message of the view.
+        """
+        if type(self._history) is ListHistory:
+            return list(map(self._history._tokens.__getitem__, self._indices))
+        return self._read(self._history.tokens)
+
+    def _read(self, get):
+
+        # Reads the whole range with a single slice of the history: indexing the other
+        # storages is the expensive part (e.g. O(n) per message in a deque)
+        indices = self._indices
+        if not indices:
+            return []
+        if indices.step > 0:
+            return get(slice(indices.start, indices.stop, indices.step))
+        values = get(slice(indices[-1], indices[0] + 1, -indices.step))
+        values.reverse()
+        return values
@@ -0,0 +1,160 @@
+import json
+import mmap
+import os
+import struct
+
+from .history import ListHistory
+
+MAGIC = b"MRVLIDX\x01"
+
+# Offset, length and token count of a message, and the code of its role
+_ENTRY = struct.Struct("<QIIB")
+# Offset and number of index entries, offset and length of the metadata, magic
+_FOOTER = struct.Struct("<QIQI8s")
+
+# Roles stored in the index, so trimming can skip system messages without decoding them
+ROLES = ("", "system", "user", "assistant", "tool", "developer", "function")
+_ROLE_CODES = {role: code for code, role in enumerate(ROLES) if role}
+
+
+def is_indexed(file_path):
+    """
+    Returns True if ``file_path`` was written in the indexed format.
+    """
+    try:
+        with open(file_path, 'rb') as file:
+            return file.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def encode_message(message):
+    """
+    Returns the compact JSON serialization of a message, as stored in the indexed format.
+    """
+    return json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def write_indexed(file_path, history, meta):
+    """
+    Writes a history in the indexed format.
+
+    The file holds the compact JSON of each message, followed by a metadata object and an
+    offset table with the position, size, token count and role of every message, so a reader
+    can find and decode any single message without parsing the others. The file is replaced
+    atomically.
+
+    Args:
+        file_path (str): The path of the file.
+        history (object): The history of a memory (e.g. :class:`~memoravel.history.ListHistory`).
+        meta (dict): Metadata stored with the messages, such as how the tokens were counted.
+    """
+    if isinstance(history, LazyHistory):
+        records = history.records()
+    else:
+        records = ((encode_message(message), count, _ROLE_CODES.get(message.get("role"), 0))
+                   for message, count in zip(history, history.tokens(slice(None))))
+
+    temp_path = file_path + ".tmp"
+    with open(temp_path, 'wb') as file:
+        file.write(MAGIC)
+        offset = len(MAGIC)
+        index = bytearray()
+        count = 0
+        for raw, tokens, role in records:
+            file.write(raw)
+            index += _ENTRY.pack(offset, len(raw), tokens, role)
+            offset += len(raw)
+            count += 1
+        meta = json.dumps(meta).encode("utf-8")
+        file.write(meta)
+        file.write(index)
+        file.write(_FOOTER.pack(offset + len(meta), count, offset, len(meta), MAGIC))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, file_path)
+
+
+def read_indexed(file_path):
+    """
+    Opens a file written in the indexed format, without decoding any message.
+
+    Returns:
+        tuple: A :class:`LazyHistory` over the file and its metadata.
+    """
+    with open(file_path, 'rb') as file:
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(data) < len(MAGIC) + _FOOTER.size or data[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"'{file_path}' is not a memoravel indexed file.")
+    index_offset, count, meta_offset, meta_length, magic = _FOOTER.unpack(data[-_FOOTER.size:])
+    if magic != MAGIC:
+        raise ValueError(f"'{file_path}' is truncated or corrupted.")
+    meta = json.loads(data[meta_offset:meta_offset + meta_length])
+    index = list(_ENTRY.iter_unpack(data[index_offset:index_offset + count * _ENTRY.size]))
+    return LazyHistory(data, index), meta
+
+
+class LazyHistory(ListHistory):
+    """
+    A history backed by a memory-mapped indexed file, which decodes each message only the
+    first time it is accessed.
+
+    Token counts and roles come from the offset table, so counting tokens and trimming never
+    decode a message, and ``recall(last_n=20)`` decodes only 20 messages even if the file holds
+    hundreds of thousands. Messages added later are stored as usual.
+    """
+
+    def __init__(self, data, index):
+        super().__init__()
+        self._data = data
+        self._index = index
+        # Messages not decoded yet are represented by their position in the offset table
+        self._messages = list(range(len(index)))
+        self._tokens = [entry[2] for entry in index]
+        self.total_tokens = sum(self._tokens)
+
+    def __iter__(self):
+        for i in range(len(self._messages)):
+            yield self._decode(i)
+
+    def __getitem__(self, index_or_slice):
+        if isinstance(index_or_slice, slice):
+            return [self._decode(i) for i in range(*index_or_slice.indices(len(self._messages)))]
+        self._messages[index_or_slice]  # Raises IndexError as a list would
+        return self._decode(index_or_slice % len(self._messages))
+
+    def entries(self, start, stop):
+        """
+        Iterates over ``(role, tokens)`` pairs of the messages in ``[start, stop)``.
+        """
+        for i in range(max(start, 0), min(stop, len(self._messages))):
+            message = self._messages[i]
+            if type(message) is int and self._index[message][3]:
+                yield ROLES[self._index[message][3]], self._tokens[i]
+            else:
+                yield self._decode(i)["role"], self._tokens[i]
+
+    def records(self):
+        """
+        Iterates over the serialized messages, copying the bytes of those not decoded yet.
+        """
+        for message, tokens in zip(self._messages, self._tokens):
+            if type(message) is int:
+                offset, length, _, role = self._index[message]
+                yield self._data[offset:offset + length], tokens, role
+            else:
+                yield encode_message(message), tokens, _ROLE_CODES.get(message.get("role"), 0)
+
+    def decoded(self):
+        """
+        Returns how many messages have been decoded (or added) so far.
+        """
+        return sum(1 for message in self._messages if type(message) is not int)
+
+    def _decode(self, i):
+
+        message = self._messages[i]
+        if type(message) is int:
+            offset, length, _, _ = self._index[message]
+            message = self._messages[i] = json.loads(self._data[offset:offset + length])
+        return message
@@ -0,0 +1,220 @@
+import json
+import os
+import uuid
+
+from .backends import Backend
+from .history import ListHistory
+
+# Compact separators: journal records are written on every mutation
+_SEPARATORS = (",", ":")
+
+
+def _dumps(value):
+
+    return json.dumps(value, ensure_ascii=False, separators=_SEPARATORS)
+
+
+def is_journal(file_path):
+    """
+    Returns True if ``file_path`` is a snapshot written by a :class:`Journal`.
+    """
+    try:
+        with open(file_path, 'rb') as file:
+            return file.read(13) == b'{"memoravel":'
+    except OSError:
+        return False
+
+
+class Journal(Backend):
+    """
+    Persists a memory as a snapshot plus an append-only journal of its changes.
+
+    The snapshot (``path``) holds the whole history, one compact JSON line per message. Every
+    later change (adding, inserting, deleting and trimming) is appended to the journal
+    (``path + ".journal"``) as one JSON line, so saving after each turn writes only what
+    changed instead of the whole history. Writes are fsynced in batches, and after
+    ``compact_every`` records the journal is folded into a new snapshot.
+
+    Snapshots are replaced atomically and carry a generation that the journal repeats in its
+    first line, so a crash at any point leaves a snapshot and a journal that replay to a
+    consistent state: a journal from another generation is ignored, and a partially written
+    last record is dropped.
+
+    Journals are normally created through ``Memoravel.save(file_path, format="journal")``. A
+    journal is the :class:`~memoravel.backends.Backend` of a single memory, so the session id
+    given to its hooks is ignored.
+
+    Args:
+        path (str): The path of the snapshot file.
+        fsync_every (int, optional): Number of records written between two fsyncs. Default is 16.
+        compact_every (int, optional): Number of records after which the journal is compacted into a new snapshot. Default is 1000.
+    """
+
+    def __init__(self, path, fsync_every=16, compact_every=1000):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.fsync_every = fsync_every
+        self.compact_every = compact_every
+        self.memory = None
+        self.generation = None
+        self._file = None
+        self._records = 0
+        self._unsynced = 0
+        # Bytes written so far, snapshots included
+        self.written = 0
+
+    def attach(self, memory, generation=None, valid_size=None):
+        """
+        Starts journaling the changes of ``memory``.
+
+        Without a ``generation``, a new snapshot of the memory is written first. With the
+        generation of the snapshot the memory was just loaded from, the existing journal is
+        kept and appended to, after truncating it to the ``valid_size`` returned by
+        :func:`read_journal`.
+        """
+        self.memory = memory
+        if generation is None:
+            self.compact()
+        else:
+            if valid_size is not None:
+                # Drop a record left half-written by a crash, so new records start on a clean line
+                with open(self.journal_path, 'r+b') as file:
+                    file.truncate(valid_size)
+            self.generation = generation
+            self._file = open(self.journal_path, 'a', encoding='utf-8')
+        memory.backend = self
+        memory.session_id = None
+
+    def insert(self, session_id, index, messages, tokens):
+        """
+        Records the insertion of ``messages`` (with their token counts) before ``index``.
+        """
+        self._write(["i", index, [[count, message] for count, message in zip(tokens, messages)]])
+
+    def remove(self, session_id, indices, reason="delete"):
+        """
+        Records the removal of the messages at ``indices`` (sorted), either by "delete" or by "trim".
+        """
+        if indices:
+            self._write(["t" if reason == "trim" else "d", list(indices)])
+
+    def replace(self, session_id, messages, tokens, counted_with):
+        """
+        Starts a new snapshot, since the whole history of the memory was replaced.
+        """
+        self.compact()
+
+    def flush(self):
+        """
+        Writes the buffered records to disk and fsyncs the journal.
+        """
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def compact(self):
+        """
+        Writes a new snapshot of the memory and starts an empty journal.
+        """
+        history = self.memory.history
+        generation = uuid.uuid4().hex
+        header = {"memoravel": "journal", "version": 1, "generation": generation,
+                  "tokens": self.memory._counted_with()}
+        lines = [_dumps(header)]
+        lines.extend(_dumps([count, message]) for count, message in zip(history.tokens(slice(None)), history))
+        self.written += _write_atomic(self.path, "\n".join(lines) + "\n")
+
+        # The journal is replaced after the snapshot: until then it belongs to another generation
+        if self._file is not None:
+            self._file.close()
+        self.written += _write_atomic(self.journal_path, _dumps({"generation": generation}) + "\n")
+        self._file = open(self.journal_path, 'a', encoding='utf-8')
+        self.generation = generation
+        self._records = 0
+        self._unsynced = 0
+
+    def close(self):
+        """
+        Flushes and closes the journal, and stops journaling the memory.
+        """
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
+        if self.memory is not None and self.memory.backend is self:
+            self.memory.backend = None
+        self.memory = None
+
+    def _write(self, record):
+
+        line = _dumps(record) + "\n"
+        self._file.write(line)
+        self.written += len(line.encode("utf-8"))
+        self._records += 1
+        self._unsynced += 1
+        if self._records >= self.compact_every:
+            self.compact()
+        elif self._unsynced >= self.fsync_every:
+            self.flush()
+
+
+def read_journal(path):
+    """
+    Replays a snapshot and its journal, without modifying either of them.
+
+    Returns:
+        tuple: The messages, their token counts, the ``[counter, model]`` the counts were made with, the generation of the snapshot, and the size of the valid part of the journal. The generation and the size are None if the journal is missing or belongs to another snapshot.
+    """
+    with open(path, 'r', encoding='utf-8') as file:
+        header = json.loads(file.readline())
+        history = ListHistory()
+        entries = [json.loads(line) for line in file if line.strip()]
+        history.replace([entry[1] for entry in entries], [entry[0] for entry in entries])
+
+    generation = header["generation"]
+    journal_path = path + ".journal"
+    valid_size = _replay(journal_path, generation, history) if os.path.exists(journal_path) else None
+    if valid_size is None:
+        generation = None
+
+    return history[:], history.tokens(slice(None)), header["tokens"], generation, valid_size
+
+
+def _replay(journal_path, generation, history):
+
+    # Returns the size of the valid part of the journal, or None if it belongs to another generation
+    with open(journal_path, 'rb') as file:
+        first = file.readline()
+        try:
+            if not first.endswith(b"\n") or json.loads(first)["generation"] != generation:
+                return None
+        except ValueError:
+            return None
+        valid_size = len(first)
+        for line in file:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if record[0] == "i":
+                history.splice(record[1], [entry[1] for entry in record[2]], [entry[0] for entry in record[2]])
+            else:
+                history.remove(record[1])
+            valid_size += len(line)
+    return valid_size
+
+
+def _write_atomic(path, text):
+
+    # Returns the number of bytes written
+    data = text.encode("utf-8")
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+    return len(data)
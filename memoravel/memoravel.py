@@ -1,5 +1,31 @@
-import tiktoken
+import copy
 import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+from .compaction import run_summarizer, summary_message
+from .eviction import get_eviction_policy
+from .exceptions import MemoravelError, PersistenceError, TokenCountError
+from .history import ListHistory, DequeHistory, HistoryView, SharedHistory
+from .binary import is_binary, read_binary, write_binary
+from .indexed import is_indexed, read_indexed, write_indexed
+from .journal import Journal, is_journal, read_journal
+from .payload import PayloadCache, build_payload
+from .streaming import MessageStream
+from .tokens import CachedTokenCounter, get_encoder, get_token_cache, get_token_counter
+
+def _write_json(file_path, messages):
+    
+    with open(file_path, 'w', encoding='utf-8') as file:
+        json.dump(messages, file, ensure_ascii=False, indent=2)
+
+
+def _read_json(file_path):
+    
+    with open(file_path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
 
 # NOTE: This class currently only works with the OpenAI API format.
 # TODO: Implement compatibility with other model APIs.
@@ -7,7 +33,7 @@ import json
 # TODO: Fazer exemplos para a pasta examples
 
 class Memoravel:
-    def __init__(self, limit=10, max_tokens=8000, preserve_initial_memories=0, preserve_system_memories=True, preserve_last_memories=1, model="gpt-4o"):
+    def __init__(self, limit=10, max_tokens=8000, preserve_initial_memories=0, preserve_system_memories=True, preserve_last_memories=1, model="gpt-4o", storage="list", token_counter="json", token_cache=None, thread_safe=False, summarizer=None, compaction_target=0.5, high_watermark=1.0, low_watermark=1.0, eviction="fifo", observer=None, token_estimation=False):
         """
         A class to manage conversation memory for Language Models, maintaining message history
         and managing tokens to simulate persistent memory.
@@ -25,6 +51,17 @@ class Memoravel:
             preserve_system_memories (bool, optional): If True, system messages will be preserved during trimming. Default is True.
             preserve_last_memories (int, optional): Number of recent messages to preserve during trimming. Default is 1.
             model (str, optional): The model for which the encoding will be used, for token counting purposes. Default is "gpt-4o".
+            storage (str, optional): How the history is stored in memory. "list" is best for random access, "deque" keeps the preserved initial memories apart and makes evicting the oldest messages O(1), which suits long conversations that add and trim on every turn. Default is "list".
+            token_counter (str or object, optional): How the tokens of each message are counted. "json" encodes the JSON serialization of the message, "chat" follows OpenAI's chat format (see :class:`~memoravel.ChatTokenCounter`), which is closer to what the model actually receives. A custom counter object can also be given. Default is "json".
+            token_cache (bool or TokenCountCache, optional): A cache of token counts by message content, shared between memories, so identical messages (e.g. system prompts) are encoded once per process. True uses the process-wide :data:`~memoravel.tokens.default_token_cache`. Default is None (no cache).
+            thread_safe (bool, optional): If True, mutations (adding, inserting, deleting, loading and trimming) are serialized by a lock, so the memory can be shared by several threads. Tokenization happens outside of the lock, and readers get consistent snapshots. Default is False.
+            summarizer (callable, optional): When the history exceeds ``max_tokens``, the oldest removable messages are replaced by a single summary message instead of being deleted. The summarizer receives the messages to compact and returns the summary (a string, used as the content of an assistant message, or a whole message), or an awaitable of it. See :class:`~memoravel.TruncatingSummarizer`. Default is None (messages are deleted).
+            compaction_target (float, optional): Fraction of ``max_tokens`` that a compaction brings the history down to, so the summarizer runs once per batch of messages rather than on every message added at the edge of the budget. Default is 0.5.
+            high_watermark (float, optional): Fraction of ``limit`` and ``max_tokens`` above which the history is trimmed. Default is 1.0.
+            low_watermark (float, optional): Fraction of ``limit`` and ``max_tokens`` the history is trimmed down to. With a low watermark below the high one, trimming evicts a batch of messages at once and then leaves the beginning of the history unchanged for several turns, which keeps provider-side prompt caches warm. Default is 1.0.
+            eviction (str or object, optional): Which messages are evicted when the history is trimmed. "fifo" evicts the oldest removable messages, "prefix_cache" keeps a stable prefix of the history for provider-side prompt caching and evicts large chunks right after it (see :class:`~memoravel.PrefixCacheEviction`), "relevance" evicts the messages least related to the latest user message first (see :class:`~memoravel.RelevanceEviction`, requires numpy). A custom policy object can also be given. Default is "fifo".
+            observer (Observer, optional): Receives measurements of tokenization, trimming, persistence and caches (see :class:`~memoravel.Observer` and :class:`~memoravel.PrometheusObserver`). Default is None (nothing is measured).
+            token_estimation (bool, optional): If True, messages added at the end of the history are not encoded right away: their tokens are bounded by the UTF-8 size of what the token counter would encode, since a token is at least one byte. They are encoded, in one batch, only when the bounded total of the history reaches the budget (or when exact counts are needed, e.g. by :meth:`count_tokens` or :meth:`save`), so most calls to :meth:`add` far from ``max_tokens`` encode nothing, while trimming decisions stay exactly the same. Messages are always counted exactly while the memory is bound to a backend or journal, which store the counts. Requires a token counter with an ``upper_bound`` method. Default is False.
         
         Example:
             .. code-block:: python
@@ -38,47 +75,357 @@ class Memoravel:
             raise ValueError("The number of 'preserve_initial_memories' cannot be greater than 'limit'.")
         if preserve_last_memories > limit > 0:
             raise ValueError("The number of 'preserve_last_memories' cannot be greater than 'limit'.")
+        if storage not in ("list", "deque"):
+            raise ValueError("The 'storage' parameter must be either 'list' or 'deque'.")
+        if not 0 < compaction_target <= 1:
+            raise ValueError("The 'compaction_target' parameter must be greater than 0 and at most 1.")
+        if not 0 < low_watermark <= high_watermark <= 1:
+            raise ValueError("The watermarks must satisfy 0 < 'low_watermark' <= 'high_watermark' <= 1.")
+        token_counter = get_token_counter(token_counter)
+        if token_estimation and not hasattr(token_counter, "upper_bound"):
+            raise ValueError("The 'token_estimation' parameter requires a token counter with an 'upper_bound' method.")
         
         self.limit = limit
         self.max_tokens = max_tokens
         self.preserve_initial_memories = preserve_initial_memories
         self.preserve_system_memories = preserve_system_memories
         self.preserve_last_memories = preserve_last_memories
-        self.history = []
-        self.encoder = tiktoken.encoding_for_model(model)
+        # The history also caches the token count of each message and their running total,
+        # so it never needs to be re-encoded after a message enters it
+        self.history = DequeHistory(preserve_initial_memories) if storage == "deque" else ListHistory()
+        self.model = model
+        self._encoder = None
+        self._lock = threading.RLock() if thread_safe else nullcontext()
+        # The backend every change is reported to, if the memory is bound to one (see bind)
+        # or saved with format="journal" (see Journal)
+        self.backend = None
+        self.session_id = None
+        # Bytes of the journal already reported to the observer by save()
+        self._journal_saved = 0
+        # Serialized messages reused by payload()
+        self.payload_cache = PayloadCache()
+        # The message being streamed, if any (see stream)
+        self._stream = None
+        self.summarizer = summarizer
+        self.compaction_target = compaction_target
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.eviction = get_eviction_policy(eviction)
+        # Number of leading messages unchanged since the last recall (see unchanged_prefix)
+        self._unchanged = 0
+        self.token_counter = token_counter
+        self.token_cache = get_token_cache(token_cache)
+        if self.token_cache is not None:
+            self.token_counter = CachedTokenCounter(self.token_counter, self.token_cache)
+        self.observer = observer
+        self.token_estimation = token_estimation
+        # Number of messages at the end of the history whose counts are only upper bounds
+        # (see _resolve_estimates), and the bounded and exact tokens of those counted since,
+        # which calibrate count_tokens(exact=False)
+        self._estimated = 0
+        self._bounded_tokens = 0
+        self._exact_tokens = 0
+
+    @property
+    def observer(self):
+        """
+        The :class:`~memoravel.Observer` receiving the measurements of this memory, or None.
+        """
+        return self._observer
+
+    @observer.setter
+    def observer(self, observer):
+        self._observer = observer
+        if isinstance(self.token_counter, CachedTokenCounter):
+            self.token_counter.observer = observer
+
+    @property
+    def journal(self):
+        """
+        The :class:`~memoravel.journal.Journal` of the memory, if it is saved with format="journal".
+        """
+        return self.backend if isinstance(self.backend, Journal) else None
+
+    @property
+    def encoder(self):
+        """
+        The tiktoken encoder used to count tokens. It is shared with every memory of the same
+        model and only created the first time tokens are counted.
+        """
+        if self._encoder is None:
+            self._encoder = get_encoder(self.model)
+        return self._encoder
+
+    @encoder.setter
+    def encoder(self, encoder):
+        self._encoder = encoder
+
+    def _count_message_tokens(self, message):
+        
+        return self._count_messages_tokens([message])[0]
+
+    def _count_messages_tokens(self, messages):
+        
+        observer = self._observer
+        start = time.perf_counter() if observer is not None else 0
+        try:
+            counts = self.token_counter.count_batch(messages, self.encoder)
+        except Exception as e:
+            raise TokenCountError(f"Error counting tokens: {e}") from e
+        if observer is not None:
+            observer.tokenized(len(messages), sum(counts), time.perf_counter() - start)
+        return counts
+
+    def _build_message(self, role, content=None, **kwargs):
+        
+        # Building the message structure
+        message = {"role": role}
+        
+        # Adding content if available
+        if content is not None:
+            if isinstance(content, (dict, list)):
+                message["content"] = json.dumps(content)
+            else:
+                message["content"] = content
+        
+        # Adding additional fields, such as tool_calls or tool_call_id
+        for key, value in kwargs.items():
+            message[key] = value
+        
+        return message
+
+    def _counted_with(self):
+        
+        # Identifies how the cached token counts were made, so saved counts can be reused
+        return [self.token_counter.name, self.model]
+
+    def _splice(self, index, messages, tokens, trim=True, estimated=False):
+        
+        # Inserts messages whose tokens were already counted (or bounded, if estimated) and
+        # trims the history
+        with self._lock:
+            # The actual position, as list.insert would resolve it
+            length = len(self.history)
+            index = min(max(index + length, 0) if index < 0 else index, length)
+            if estimated and (index < length or self.backend is not None):
+                # Only the last messages of a memory without backend keep estimated counts
+                tokens = self._count_messages_tokens(messages)
+                estimated = False
+            if not estimated:
+                self._resolve_estimates()
+            self._changed(index)
+            self.history.splice(index, messages, tokens)
+            if estimated:
+                self._estimated += len(messages)
+            if self.backend is not None:
+                self.backend.insert(self.session_id, index, messages, tokens)
+            if trim and self.summarizer is None:
+                self._trim_spliced(index, messages)
+        if trim and self.summarizer is not None:
+            # Compacting calls the summarizer, which must not hold the lock
+            self._trim_spliced(index, messages)
+
+    def _trim_spliced(self, index, messages):
+
+        # Trims the history after messages were spliced in at index. Trimming may have to
+        # count tokens exactly (the estimated counts, or a summary): if they cannot be
+        # counted, the messages are taken out again, so the history is left unchanged
+        try:
+            self._trim_history()
+        except TokenCountError:
+            with self._lock:
+                current = self.history[index:index + len(messages)]
+                if len(current) == len(messages) and all(a is b for a, b in zip(current, messages)):
+                    indices = list(range(index, index + len(messages)))
+                    self._forget_estimates(indices)
+                    self._forget_payloads(indices)
+                    self.history.remove(indices)
+                    if self.backend is not None:
+                        self.backend.remove(self.session_id, indices)
+            raise
+
+    def _replace(self, messages, tokens):
+        
+        with self._lock:
+            self.history.replace(messages, tokens)
+            self._estimated = 0
+            self._changed(0)
+            self.payload_cache.clear()
+            if self.backend is not None:
+                self.backend.replace(self.session_id, messages, tokens, self._counted_with())
+
+    def _exceeds_limits(self, total_tokens, length, watermark=1.0):
+        
+        return (
+            (self.max_tokens > 0 and total_tokens > self.max_tokens * watermark) or
+            (self.limit > 0 and length > self.limit * watermark)
+        )
+
+    def _tokens_to_append(self, messages):
+
+        # Returns the tokens of messages about to be appended, and whether they are only
+        # upper bounds (see token_estimation)
+        if self.token_estimation and self.backend is None:
+            return [self.token_counter.upper_bound(message) for message in messages], True
+        return self._count_messages_tokens(messages), False
+
+    def _resolve_estimates(self):
+
+        # Replaces the upper bounds of the last messages with their exact counts, encoding
+        # them in one batch
+        if not self._estimated:
+            return
+        start = len(self.history) - self._estimated
+        tokens = self._count_messages_tokens(self.history[start:])
+        self._bounded_tokens += sum(self.history.tokens(slice(start, None)))
+        self._exact_tokens += sum(tokens)
+        self.history.recount(start, tokens)
+        self._estimated = 0
+
+    def _forget_estimates(self, indices):
+
+        # Called before the messages at indices are removed: those with estimated counts will
+        # never need to be encoded
+        first_estimated = len(self.history) - self._estimated
+        self._estimated -= sum(1 for i in indices if i >= first_estimated)
+
+    def _forget_payloads(self, indices):
 
-    def _trim_history(self):
+        # Called before the messages at indices are removed: their cached serializations
+        # will never be sent again
+        if len(self.payload_cache):
+            self.payload_cache.discard([self.history[i] for i in indices])
+
+    def _size(self):
+
+        # The tokens and length of the history, with the message being streamed as its last memory
+        total_tokens = self.history.total_tokens
+        length = len(self.history)
+        if self._stream is not None:
+            total_tokens += self._stream.tokens
+            length += 1
+        return total_tokens, length
+
+    def _trim_history(self, compact=True):
         
-        total_tokens = self.count_tokens()
+        # The summarizer runs outside of the lock (see _compact), so with compact=True and a
+        # summarizer, the caller must not hold the lock either
+        if compact and self.summarizer is not None:
+            self._compact()
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
 
-        # Index from which we can remove messages
+        total_tokens, length = self._size()
+        if not self._exceeds_limits(total_tokens, length, self.high_watermark):
+            return
+        if self._estimated and (
+            self._exceeds_limits(total_tokens, 0, self.low_watermark) or
+            (getattr(self.eviction, "reads_tokens", True) and
+             len(self.history) - self._estimated < length - self.preserve_last_memories)
+        ):
+            # The bounds could change which messages are evicted: they either make the
+            # history look over its token budget, or are read by the policy
+            self._resolve_estimates()
+            total_tokens, length = self._size()
+            if not self._exceeds_limits(total_tokens, length, self.high_watermark):
+                return
+        start = time.perf_counter() if self._observer is not None else 0
+
+        # Removing messages never moves the ones preserved at the end, so the removable
+        # window can be computed once: it starts after the initial memories and ends
+        # before the last memories that must be preserved
         removable_start_index = self.preserve_initial_memories
+        removable_end_index = length - self.preserve_last_memories
+
+        # The policy selects the messages to evict in one pass over the window, and they are
+        # all removed in a single operation
+        to_remove = self.eviction.select(self, removable_start_index, removable_end_index, total_tokens, length)
+        if not to_remove:
+            return
+
+        self._changed(to_remove[0])
+        total_tokens = self.history.total_tokens
+        self._forget_estimates(to_remove)
+        self._forget_payloads(to_remove)
+        self.history.remove(to_remove)
+        if self.backend is not None:
+            self.backend.remove(self.session_id, to_remove, "trim")
+        if self._observer is not None:
+            reason = "limit" if self.limit > 0 and length > self.limit * self.high_watermark else "tokens"
+            self._observer.trimmed(len(to_remove), total_tokens - self.history.total_tokens, reason, time.perf_counter() - start)
+
+    def _compaction_plan(self):
 
-        # Calculate the index up to which we can remove (before the last memories that must be preserved)
-        removable_end_index = len(self.history) - self.preserve_last_memories
-
-        # Check if the history can be adjusted (if there are messages that can be removed)
-        while (
-            (self.max_tokens > 0 and total_tokens > self.max_tokens) or
-            (self.limit > 0 and len(self.history) > self.limit)
-        ) and self._has_removable_memory(removable_start_index, removable_end_index):
-            # Find the index of the first removable message
-            for i in range(removable_start_index, removable_end_index):
-                # If preserve_system_memories is active, skip system messages
-                if self.preserve_system_memories and self.history[i]["role"] == "system":
+        # Returns the start and the messages of the block to summarize, or None if the
+        # history is within the token budget
+        total_tokens, length = self._size()
+        if not (self.max_tokens > 0 and total_tokens > self.max_tokens * self.high_watermark):
+            return None
+        if self._estimated:
+            self._resolve_estimates()
+            total_tokens, length = self._size()
+            if total_tokens <= self.max_tokens * self.high_watermark:
+                return None
+
+        # The oldest contiguous run of removable messages, long enough to bring the history
+        # down to the target (a preserved system message ends the run)
+        target = self.max_tokens * self.compaction_target
+        start = None
+        stop = None
+        entries = self.history.entries(self.preserve_initial_memories, length - self.preserve_last_memories)
+        for i, (role, tokens) in enumerate(entries, self.preserve_initial_memories):
+            if self.preserve_system_memories and role == "system":
+                if start is None:
                     continue
-                # Remove the first removable message
-                self.history.pop(i)
                 break
-            total_tokens = self.count_tokens()
-            removable_end_index = len(self.history) - self.preserve_last_memories
+            if start is None:
+                start = i
+            stop = i + 1
+            total_tokens -= tokens
+            if total_tokens <= target:
+                break
+        if start is None:
+            return None
+        return start, self.history[start:stop]
 
-    def _has_removable_memory(self, start_index, end_index):
-        
-        return any(
-            (msg["role"] != "system" or not self.preserve_system_memories)
-            for msg in self.history[start_index:end_index]
-        )
+    def _apply_compaction(self, start, block, message, tokens, started=0):
+
+        # Replaces the block with its summary, unless the history changed in the meantime
+        current = self.history[start:start + len(block)]
+        if len(current) != len(block) or any(a is not b for a, b in zip(current, block)):
+            return
+        indices = list(range(start, start + len(block)))
+        self._changed(start)
+        total_tokens = self.history.total_tokens
+        # Each change is reported right after it is made: a journal compacted by one of the
+        # records snapshots the history as it is at that point
+        self.payload_cache.discard(block)
+        self.history.remove(indices)
+        if self.backend is not None:
+            self.backend.remove(self.session_id, indices, "trim")
+        evicted_tokens = total_tokens - self.history.total_tokens
+        self.history.splice(start, [message], tokens)
+        if self.backend is not None:
+            self.backend.insert(self.session_id, start, [message], tokens)
+        if self._observer is not None:
+            self._observer.trimmed(len(block), evicted_tokens, "compaction", time.perf_counter() - started)
+
+    def _compact(self):
+
+        # The summarizer (usually a call to a model) runs without holding the lock, so readers
+        # are not blocked by it; the block is not replaced if the history changed meanwhile
+        started = time.perf_counter() if self._observer is not None else 0
+        with self._lock:
+            plan = self._compaction_plan()
+        if plan is None:
+            return
+        start, block = plan
+        message = summary_message(run_summarizer(self.summarizer, block))
+        tokens = self._count_messages_tokens([message])
+        with self._lock:
+            self._apply_compaction(start, block, message, tokens, started)
 
     def add(self, role, content=None, **kwargs):
         """
@@ -100,26 +447,150 @@ class Memoravel:
                 memory.add("tool", "content", custom_field="this is a custom field content")
         
         """
-        # Building the message structure
-        message = {"role": role}
+        message = self._build_message(role, content, **kwargs)
+        tokens, estimated = self._tokens_to_append([message])
+        # Trim the history after adding a new message
+        self._splice(len(self.history), [message], tokens, estimated=estimated)
+
+    def stream(self, role="assistant", **kwargs):
+        """
+        Starts a message whose content is streamed, such as the reply of a streamed completion.
+
+        The returned :class:`~memoravel.streaming.MessageStream` accumulates the deltas of the
+        message and adds it to the history when it is finalized. Its tokens are counted as the
+        deltas arrive, and the history is trimmed as if the message were already its last
+        memory, so :meth:`count_tokens` plus ``stream.tokens`` is the size of the next request
+        before the stream ends. Only one message can be streamed at a time.
+
+        Args:
+            role (str, optional): The role of the message. Default is "assistant".
+            kwargs: Additional fields that should be added to the message.
+
+        Returns:
+            MessageStream: The message being streamed.
+
+        Example:
+            .. code-block:: python
+
+                from memoravel import Memoravel
+                memory = Memoravel(limit=5)
+                memory.add(role="user", content="Hello!")
+
+                with memory.stream() as message:
+                    for delta in ["Hi! ", "How can ", "I help?"]:
+                        message.feed(delta)
+                        print(memory.count_tokens() + message.tokens)
+
+        """
+        with self._lock:
+            if self._stream is not None:
+                raise ValueError("Another message is already being streamed.")
+            self._stream = MessageStream(self, role, **kwargs)
+            return self._stream
+
+    def _update_stream(self, stream):
+
+        with self._lock:
+            streaming = self._stream is stream
+        if streaming:
+            self._trim_history()
+
+    def _finish_stream(self, stream, message=None, tokens=None, estimated=False):
+
+        with self._lock:
+            if self._stream is stream:
+                self._stream = None
+        if message is not None:
+            self._splice(len(self.history), [message], tokens, estimated=estimated)
+
+    def extend(self, messages):
+        """
+        Adds several messages to the end of the history at once and trims the history only once,
+        after all of them were added.
         
-        # Adding content if available
-        if content is not None:
-            if isinstance(content, (dict, list)):
-                message["content"] = json.dumps(content)
-            else:
-                message["content"] = content
+        The messages are tokenized in a single batch, which is much faster than calling
+        :meth:`add` for each one (e.g. when storing a turn with several tool calls).
         
-        # Adding additional fields, such as tool_calls or tool_call_id
-        for key, value in kwargs.items():
-            message[key] = value
+        Args:
+            messages (list): A list of message dicts. Each one must have a 'role', and may have a 'content' (str, dict or list) and any additional fields, just like the arguments of :meth:`add`.
         
-        self.history.append(message)
-        self._trim_history()  # Trim the history after adding a new message
+        Example:
+            .. code-block:: python
+            
+                from memoravel import Memoravel
+                memory = Memoravel()
+                memory.extend([
+                    {"role": "user", "content": "What's the weather in Paris?"},
+                    {"role": "assistant", "tool_calls": [{"id": "call_1", "type": "function", "function": {"name": "get_weather", "arguments": "{\\"city\\": \\"Paris\\"}"}}]},
+                    {"role": "tool", "content": {"temperature": 18}, "tool_call_id": "call_1"},
+                ])
+        
+        """
+        if not isinstance(messages, list) or not all(isinstance(message, dict) for message in messages):
+            raise ValueError("The 'messages' parameter must be a list of dicts.")
+        if not messages:
+            return
+        
+        messages = [self._build_message(**message) for message in messages]
+        tokens, estimated = self._tokens_to_append(messages)
+        self._splice(len(self.history), messages, tokens, estimated=estimated)
+
+    def fork(self):
+        """
+        Returns a branch of the memory: a new memory with the same messages and settings,
+        which evolves independently from then on.
+
+        The branch shares the messages of the memory and their token counts instead of
+        copying them, so forking takes the same time whatever the length of the history, and
+        no message is encoded again. Each memory only stores the messages added to it after
+        the fork, and trimming, deleting or inserting messages in one of them never changes
+        the other. Messages must not be modified in place after they are added.
+
+        The branch is not bound to the backend or journal of the memory, and starts with an
+        empty payload cache. Both memories store their history in shared segments from then
+        on (see :class:`~memoravel.history.SharedHistory`).
+
+        Returns:
+            Memoravel: The branch.
+
+        Example:
+            .. code-block:: python
+
+                from memoravel import Memoravel
+                memory = Memoravel(limit=20)
+                memory.add("user", "Write a haiku about the sea.")
+
+                # Sample several continuations from the same conversation
+                branches = [memory.fork() for _ in range(4)]
+                for branch in branches:
+                    branch.add("assistant", "...")
+
+        """
+        with self._lock:
+            # Shared counts must be exact, since the branches would encode their bounds separately
+            self._resolve_estimates()
+            if not isinstance(self.history, SharedHistory):
+                self.history = SharedHistory(self.history)
+            branch = copy.copy(self)
+            branch.history = self.history.fork()
+        branch._lock = nullcontext() if isinstance(self._lock, nullcontext) else threading.RLock()
+        branch.backend = None
+        branch.session_id = None
+        branch._journal_saved = 0
+        branch.payload_cache = PayloadCache()
+        branch._stream = None
+        return branch
 
-    def count_tokens(self):
+    def count_tokens(self, exact=True):
         """
         Counts the total number of tokens in the current history.
+
+        The count of each message is computed once, when it enters the history, so this
+        method only returns the cached running total. With ``token_estimation``, the messages
+        that were not encoded yet are encoded first.
+        
+        Args:
+            exact (bool, optional): If False, the tokens of the messages that were not encoded yet are estimated instead, from their upper bounds and the ratio of exact counts to upper bounds of the messages encoded so far. Default is True.
         
         Returns:
             int: The total token count.
@@ -134,11 +605,13 @@ class Memoravel:
                 total_tokens = memory.count_tokens()
         
         """
-        try:
-            return sum(len(self.encoder.encode(json.dumps(msg))) for msg in self.history)
-        except Exception as e:
-            print(f"Error counting tokens: {e}")
-            return False
+        with self._lock:
+            if exact:
+                self._resolve_estimates()
+            elif self._estimated and self._bounded_tokens:
+                bounded = sum(self.history.tokens(slice(len(self.history) - self._estimated, None)))
+                return self.history.total_tokens - bounded + round(bounded * self._exact_tokens / self._bounded_tokens)
+            return self.history.total_tokens
 
     def recall(self, last_n=None, first_n=None, index_or_slice=None):
         """
@@ -176,10 +649,16 @@ class Memoravel:
         if sum(param is not None for param in [last_n, first_n, index_or_slice]) > 1:
             raise ValueError("Only one of the parameters 'last_n', 'first_n', or 'slice_range' can be used at a time.")
         
+        with self._lock:
+            self._unchanged = len(self.history)
+            return self._recall(last_n, first_n, index_or_slice)
+
+    def _recall(self, last_n, first_n, index_or_slice):
+        
         if last_n is not None:
-            result = self.history[-last_n:] if last_n <= len(self.history) else self.history
+            result = self.history[-last_n:]
         elif first_n is not None:
-            result = self.history[:first_n] if first_n <= len(self.history) else self.history
+            result = self.history[:first_n]
         elif index_or_slice is not None:
             if not isinstance(index_or_slice, (slice, int)):
                 raise ValueError("The 'index_or_slice' parameter must be a slice or an integer.")
@@ -187,16 +666,154 @@ class Memoravel:
             if isinstance(index_or_slice, int):
                 result = [result]  # Ensure the result is always a list
         else:
-            result = self.history
+            result = self.history[:]
         
         return result
     
-    def save(self, file_path):
+    def view(self, last_n=None, first_n=None, index_or_slice=None):
+        """
+        Returns the same memories as :meth:`recall`, as a read-only view that does not copy them.
+
+        The view supports ``len``, indexing, slicing and iteration, and can be passed wherever
+        a sequence of messages is expected. It reflects the history at the time it was created,
+        so it must not be used after the memory is changed.
+
+        Args:
+            last_n (int, optional): Number of last memories to be retrieved.
+            first_n (int, optional): Number of first memories to be retrieved.
+            index_or_slice (int or slice, optional): An index or a slice of the history.
+
+        Returns:
+            HistoryView: A view of the retrieved memories.
+
+        Example:
+            .. code-block:: python
+
+                from memoravel import Memoravel
+                memory = Memoravel(limit=5)
+                memory.add(role="user", content="Hello!")
+                for message in memory.view(last_n=10):
+                    print(message["content"])
+
+        """
+        if sum(param is not None for param in [last_n, first_n, index_or_slice]) > 1:
+            raise ValueError("Only one of the parameters 'last_n', 'first_n', or 'slice_range' can be used at a time.")
+
+        with self._lock:
+            self._unchanged = len(self.history)
+            return HistoryView(self.history, self._select(last_n, first_n, index_or_slice))
+
+    def payload(self, last_n=None, first_n=None, index_or_slice=None, **fields):
+        """
+        Returns the JSON body of a chat completion request with the selected memories as its "messages".
+
+        The serialized JSON of each message is cached the first time it is part of a payload,
+        so building the body of the next request only encodes the messages added since, and
+        joins the cached bytes of the others. Messages must not be modified in place after
+        they are added.
+
+        Args:
+            last_n (int, optional): Number of last memories to be sent.
+            first_n (int, optional): Number of first memories to be sent.
+            index_or_slice (int or slice, optional): An index or a slice of the history.
+            **fields: The other fields of the request, such as "model" or "temperature".
+
+        Returns:
+            bytes: The UTF-8 encoded JSON body.
+
+        Example:
+            .. code-block:: python
+
+                from memoravel import Memoravel
+                memory = Memoravel(limit=5)
+                memory.add(role="user", content="Hello!")
+                body = memory.payload(model="gpt-4o", temperature=0)
+                # e.g. httpx.post(url, content=body, headers={"Content-Type": "application/json"})
+
+        """
+        if sum(param is not None for param in [last_n, first_n, index_or_slice]) > 1:
+            raise ValueError("Only one of the parameters 'last_n', 'first_n', or 'slice_range' can be used at a time.")
+
+        with self._lock:
+            self._unchanged = len(self.history)
+            messages = HistoryView(self.history, self._select(last_n, first_n, index_or_slice))
+            hits, misses = self.payload_cache.hits, self.payload_cache.misses
+            encoded = self.payload_cache.encode(messages)
+            if self._observer is not None:
+                self._observer.cache_lookup("payload", self.payload_cache.hits - hits, self.payload_cache.misses - misses)
+        return build_payload(encoded, fields)
+
+    def _select(self, last_n, first_n, index_or_slice):
+
+        # The positions recall() would return, without copying the messages
+        indices = range(len(self.history))
+        if last_n is not None:
+            return indices[-last_n:]
+        if first_n is not None:
+            return indices[:first_n]
+        if index_or_slice is not None:
+            if not isinstance(index_or_slice, (slice, int)):
+                raise ValueError("The 'index_or_slice' parameter must be a slice or an integer.")
+            if isinstance(index_or_slice, int):
+                index = indices[index_or_slice]  # Raises IndexError as a list would
+                return range(index, index + 1)
+            return indices[index_or_slice]
+        return indices
+
+    def unchanged_prefix(self):
+        """
+        Returns how much of the beginning of the history is unchanged since the last
+        :meth:`recall` (or :meth:`view` or :meth:`payload`).
+
+        Messages added at the end do not change the prefix, while trimming, deleting or
+        inserting a message changes everything after it. The unchanged prefix is the part
+        of the next request that a provider-side prompt cache can still serve.
+
+        Returns:
+            tuple: The number of unchanged messages and their total token count.
+
+        Example:
+            .. code-block:: python
+
+                from memoravel import Memoravel
+                memory = Memoravel(limit=20, eviction="prefix_cache")
+                messages = memory.recall()
+                memory.add(role="user", content="Hello!")
+                unchanged_messages, unchanged_tokens = memory.unchanged_prefix()
+
+        """
+        with self._lock:
+            self._resolve_estimates()
+            length = min(self._unchanged, len(self.history))
+            return length, sum(self.history.tokens(slice(0, length)))
+
+    def _changed(self, index):
+
+        # Called before the history is modified from position index onwards
+        if index < self._unchanged:
+            self._unchanged = index
+
+    def save(self, file_path, format="json", compression=None):
        """
-       Saves the memory content to a JSON file.
+       Saves the memory content to a file.
+
+       With the "json" format, the whole history is written as a JSON list. With the "journal"
+       format, the first save writes a snapshot of the history and, from then on, every change
+       to the memory is appended to a journal next to it (``file_path + ".journal"``). Saving
+       again to the same path then only makes sure the latest changes are on disk, so the cost
+       of each save no longer grows with the length of the conversation. The "indexed" format
+       stores the messages with an offset table of their positions and token counts, so very
+       large histories can be loaded lazily (see :meth:`load`). The "binary" format is the most
+       compact: length-prefixed records with the cached token count of each message and the
+       string contents stored raw (not JSON-escaped), optionally compressed.
 
        Args:
-           file_path (str): The path where the JSON file should be saved.
+           file_path (str): The path where the file should be saved.
+           format (str, optional): "json", "journal", "indexed" or "binary". Default is "json".
+           compression (str, optional): Only for the "binary" format: None, "zlib" or "zstd" (requires the ``zstandard`` package). Default is None.
+       
+       Raises:
+           PersistenceError: If the file cannot be written.
        
        Example:
            .. code-block:: python
@@ -206,19 +823,75 @@ class Memoravel:
                memory.add(role="user", content="Hello!")
                memory.save("memory.json")
                
+               # Journaled persistence: cheap to call after every turn
+               memory.save("memory.jsonl", format="journal")
+               memory.add(role="assistant", content="Hi! How can I help?")
+               memory.save("memory.jsonl", format="journal")
+               
        """
+       if format not in ("json", "journal", "indexed", "binary"):
+           raise ValueError("The 'format' parameter must be 'json', 'journal', 'indexed' or 'binary'.")
+       if compression is not None and format != "binary":
+           raise ValueError("The 'compression' parameter can only be used with the 'binary' format.")
+       if format == "journal" and self.backend is not None and self.journal is None:
+           raise ValueError("A memory bound to a backend cannot be saved with the 'journal' format.")
+       
+       if format != "json":
+           # The other formats store the token counts, which must be exact
+           with self._lock:
+               self._resolve_estimates()
+       
+       start = time.perf_counter() if self._observer is not None else 0
        try:
-           with open(file_path, 'w', encoding='utf-8') as file:
-               json.dump(self.history, file, ensure_ascii=False, indent=2)
+           if format == "journal":
+               with self._lock:
+                   if self.journal is not None and self.journal.path == file_path:
+                       # The records appended since the last save were written by the mutations
+                       written = self._journal_saved
+                       self.journal.flush()
+                   else:
+                       if self.journal is not None:
+                           self.journal.close()
+                       written = 0
+                       Journal(file_path).attach(self)
+                   size = self.journal.written - written
+                   self._journal_saved = self.journal.written
+           elif format == "indexed":
+               with self._lock:
+                   write_indexed(file_path, self.history, {"tokens": self._counted_with()})
+           elif format == "binary":
+               with self._lock:
+                   messages, tokens = self.history[:], self.history.tokens(slice(None))
+               write_binary(file_path, messages, tokens, {"tokens": self._counted_with()}, compression)
+           else:
+               with self._lock:
+                   messages = self.history[:]
+               _write_json(file_path, messages)
+           if self._observer is not None:
+               if format != "journal":
+                   size = os.path.getsize(file_path)
+               self._observer.persisted("save", format, size, time.perf_counter() - start)
+       except MemoravelError:
+           raise
        except Exception as e:
-           print(f"Error saving file: {e}")
+           raise PersistenceError(f"Error saving file: {e}") from e
 
-    def load(self, file_path):
+    def load(self, file_path, format=None, lazy=False):
        """
-       Loads the memory content from a JSON file.
+       Loads the memory content from a file.
+
+       A memory loaded from a journal (see :meth:`save`) keeps appending its changes to that
+       journal.
 
        Args:
-           file_path (str): The path to the JSON file to load.
+           file_path (str): The path to the file to load.
+           format (str, optional): "json", "journal", "indexed" or "binary". Default is None (detected from the file).
+           lazy (bool, optional): Only for the "indexed" format. If True, the file is memory-mapped and each message is decoded only when it is first accessed; token counts and roles are read from the file's index, so counting tokens and trimming decode nothing. Not allowed while the memory is bound to a backend, which would have to store every message. Default is False.
+       
+       Raises:
+           ValueError: If ``lazy`` is True and the file is not in the "indexed" format, or the memory is bound to a backend.
+           PersistenceError: If the file cannot be read or is not a valid memoravel file.
+           TokenCountError: If the messages must be counted again and their tokens cannot be counted.
        
        Example:
            .. code-block:: python
@@ -227,12 +900,130 @@ class Memoravel:
                memory = Memoravel()
                memory.load("memory.json")
                
+               # Open a huge archived history, decoding only the last 20 messages
+               memory = Memoravel(limit=0, max_tokens=0)
+               memory.load("archive.idx", lazy=True)
+               last_messages = memory.recall(last_n=20)
+               
        """
+       if format not in (None, "json", "journal", "indexed", "binary"):
+           raise ValueError("The 'format' parameter must be 'json', 'journal', 'indexed' or 'binary'.")
+       if lazy and self.backend is not None and self.backend is not self.journal:
+           # The backend would never be told about the messages of the mapped file
+           raise ValueError("A memory bound to a backend cannot be loaded lazily; unbind it or load it with lazy=False.")
+       if format is None:
+           format = self._detect_format(file_path)
+       if lazy and format != "indexed":
+           raise ValueError("lazy loading requires the 'indexed' format")
+       
+       start = time.perf_counter() if self._observer is not None else 0
        try:
-           with open(file_path, 'r', encoding='utf-8') as file:
-               self.history = json.load(file)
+           journaled = format == "journal"
+           if format == "indexed":
+               lazy_history, meta = read_indexed(file_path)
+               if meta["tokens"] == self._counted_with():
+                   if lazy:
+                       with self._lock:
+                           if self.journal is not None:
+                               self.journal.close()
+                           self.history = lazy_history
+                           self._estimated = 0
+                           self._changed(0)
+                           self.payload_cache.clear()
+                       if self._observer is not None:
+                           self._observer.persisted("load", format, os.path.getsize(file_path), time.perf_counter() - start)
+                       return
+                   history, tokens = lazy_history[:], lazy_history.tokens(slice(None))
+               else:
+                   # The counts were made for another model or counter: every message must be recounted
+                   history = lazy_history[:]
+                   tokens = self._count_messages_tokens(history) if history else []
+           elif format == "binary":
+               history, tokens, meta = read_binary(file_path)
+               if meta["tokens"] != self._counted_with():
+                   tokens = self._count_messages_tokens(history) if history else []
+           elif journaled:
+               history, tokens, counted_with, generation, valid_size = read_journal(file_path)
+               if counted_with != self._counted_with():
+                   # The counts were made for another model or counter: recount and start a new snapshot
+                   tokens = self._count_messages_tokens(history) if history else []
+                   generation = None
+           else:
+               history = _read_json(file_path)
+               tokens = self._count_messages_tokens(history) if history else []
+       except MemoravelError:
+           raise
        except Exception as e:
-           print(f"Error loading file: {e}")
+           raise PersistenceError(f"Error loading file: {e}") from e
+       
+       with self._lock:
+           if self.journal is not None:
+               self.journal.close()
+           self._replace(history, tokens)
+           if journaled:
+               Journal(file_path).attach(self, generation, valid_size)
+       if self._observer is not None:
+           size = os.path.getsize(file_path)
+           if journaled and os.path.exists(file_path + ".journal"):
+               size += os.path.getsize(file_path + ".journal")
+           self._observer.persisted("load", format, size, time.perf_counter() - start)
+
+    def bind(self, backend, session_id):
+        """
+        Binds the memory to a session of a storage backend.
+
+        The session is loaded into the memory (an empty session is created if it does not
+        exist yet), and from then on every change to the memory is persisted incrementally by
+        the backend: adding a message stores one message, and trimming removes only the
+        evicted ones.
+
+        Args:
+            backend (Backend): The backend, e.g. a :class:`~memoravel.SQLiteBackend`.
+            session_id (str): The id of the session in the backend.
+        
+        Example:
+            .. code-block:: python
+            
+                from memoravel import Memoravel, SQLiteBackend
+                backend = SQLiteBackend("sessions.db")
+                memory = Memoravel(limit=20)
+                memory.bind(backend, "session-42")
+                memory.add("user", "Hello!")
+                backend.flush()
+        
+        """
+        messages, tokens, counted_with = backend.load(session_id)
+        with self._lock:
+            self.unbind()
+            self.backend = backend
+            self.session_id = session_id
+            if counted_with == self._counted_with():
+                self.history.replace(messages, tokens)
+                self._estimated = 0
+                self._changed(0)
+                self.payload_cache.clear()
+            else:
+                # A new session, or one counted for another model or counter
+                self._replace(messages, self._count_messages_tokens(messages) if messages else [])
+
+    def unbind(self):
+        """
+        Stops persisting the changes of the memory to its backend (or journal), after flushing it.
+        """
+        with self._lock:
+            if self.journal is not None:
+                self.journal.close()
+            elif self.backend is not None:
+                self.backend.flush()
+            self.backend = None
+            self.session_id = None
+
+    def _detect_format(self, file_path):
+        
+        for format, is_format in (("journal", is_journal), ("indexed", is_indexed), ("binary", is_binary)):
+            if is_format(file_path):
+                return format
+        return "json"
 
     def delete(self, index_or_slice):
         """
@@ -259,10 +1050,24 @@ class Memoravel:
                 
         """
         
-        if isinstance(index_or_slice, (slice, int)):
-            del self.history[index_or_slice]
-        else:
+        if not isinstance(index_or_slice, (slice, int)):
             raise ValueError("The 'slice_range' parameter must be a slice object or int.")
+        
+        with self._lock:
+            if isinstance(index_or_slice, slice):
+                indices = sorted(range(*index_or_slice.indices(len(self.history))))
+            else:
+                index = index_or_slice + len(self.history) if index_or_slice < 0 else index_or_slice
+                if not 0 <= index < len(self.history):
+                    raise IndexError("list assignment index out of range")
+                indices = [index]
+            if indices:
+                self._changed(indices[0])
+            self._forget_estimates(indices)
+            self._forget_payloads(indices)
+            self.history.remove(indices)
+            if self.backend is not None:
+                self.backend.remove(self.session_id, indices)
 
     def insert(self, index, messages):
         """
@@ -288,12 +1093,9 @@ class Memoravel:
                 
         """
         if isinstance(messages, dict):
-            self.history.insert(index, messages)
-        elif isinstance(messages, list):
-            for i, message in enumerate(messages):
-                self.history.insert(index + i, message)
-        else:
+            messages = [messages]
+        elif not isinstance(messages, list):
             raise ValueError("The 'messages' parameter must be either a dict or a list of dicts.")
         
         # Trim the history after insertion
-        self._trim_history()
+        self._splice(index, messages, self._count_messages_tokens(messages) if messages else [])
@@ -0,0 +1,159 @@
+import threading
+
+
+class Observer:
+    """
+    Receives measurements from the memories it is given to, as their ``observer``.
+
+    Every method does nothing, so an observer only overrides what it needs. Memories without
+    an observer skip the measurements altogether, so instrumentation costs nothing unless it
+    is enabled. An observer can be shared by many memories, and may be called from several
+    threads at once.
+
+    Example:
+        .. code-block:: python
+
+            from memoravel import Memoravel, Observer
+
+            class LogObserver(Observer):
+                def trimmed(self, evicted, tokens, reason, seconds):
+                    print(f"Evicted {evicted} messages ({tokens} tokens) over the {reason} limit")
+
+            memory = Memoravel(limit=20, observer=LogObserver())
+    """
+
+    def tokenized(self, messages, tokens, seconds):
+        """
+        Called after ``messages`` messages were counted by the tokenizer, totalling ``tokens`` tokens, in ``seconds``.
+        """
+
+    def trimmed(self, evicted, tokens, reason, seconds):
+        """
+        Called after a trim evicted ``evicted`` messages totalling ``tokens`` tokens, in ``seconds``.
+        The ``reason`` is "limit" (too many messages), "tokens" (too many tokens) or "compaction"
+        (the messages were replaced by a summary). With ``token_estimation``, messages evicted
+        before they were encoded count for the upper bound of their tokens.
+        """
+
+    def persisted(self, operation, format, size, seconds):
+        """
+        Called after a memory was saved or loaded (``operation`` is "save" or "load") in the
+        given ``format``, with the number of bytes written or read, in ``seconds``.
+        """
+
+    def cache_lookup(self, cache, hits, misses):
+        """
+        Called after a lookup of several entries in a cache: "token_counts" (see
+        :class:`~memoravel.TokenCountCache`) or "payload" (serialized messages reused by
+        :meth:`Memoravel.payload <memoravel.Memoravel.payload>`).
+        """
+
+
+class PrometheusObserver(Observer):
+    """
+    Aggregates the measurements of every memory it observes into counters, exported in the
+    Prometheus text exposition format.
+
+    Serve the output of :meth:`render` on a metrics endpoint, e.g. with the ``prometheus_client``
+    custom collector of your choice or a plain HTTP handler.
+
+    Args:
+        namespace (str, optional): Prefix of every metric name. Default is "memoravel".
+
+    Example:
+        .. code-block:: python
+
+            from memoravel import Memoravel, PrometheusObserver
+            observer = PrometheusObserver()
+            memory = Memoravel(limit=20, observer=observer)
+            memory.add("user", "Hello!")
+            print(observer.render())
+    """
+
+    _METRICS = (
+        ("tokenizer_calls_total", "Calls to the tokenizer."),
+        ("tokenized_messages_total", "Messages counted by the tokenizer."),
+        ("tokenized_tokens_total", "Tokens counted by the tokenizer."),
+        ("tokenizer_seconds_total", "Time spent counting tokens."),
+        ("trims_total", "Trims that evicted messages, by reason."),
+        ("evicted_messages_total", "Messages evicted by trimming, by reason."),
+        ("evicted_tokens_total", "Tokens evicted by trimming, by reason."),
+        ("trim_seconds_total", "Time spent trimming, by reason."),
+        ("persistence_operations_total", "Saves and loads, by operation and format."),
+        ("persistence_bytes_total", "Bytes written and read, by operation and format."),
+        ("persistence_seconds_total", "Time spent saving and loading, by operation and format."),
+        ("cache_hits_total", "Cache hits, by cache."),
+        ("cache_misses_total", "Cache misses, by cache."),
+    )
+
+    def __init__(self, namespace="memoravel"):
+        self.namespace = namespace
+        self._values = {name: {} for name, _ in self._METRICS}
+        self._lock = threading.Lock()
+
+    def tokenized(self, messages, tokens, seconds):
+        self._add((
+            ("tokenizer_calls_total", (), 1),
+            ("tokenized_messages_total", (), messages),
+            ("tokenized_tokens_total", (), tokens),
+            ("tokenizer_seconds_total", (), seconds),
+        ))
+
+    def trimmed(self, evicted, tokens, reason, seconds):
+        labels = (("reason", reason),)
+        self._add((
+            ("trims_total", labels, 1),
+            ("evicted_messages_total", labels, evicted),
+            ("evicted_tokens_total", labels, tokens),
+            ("trim_seconds_total", labels, seconds),
+        ))
+
+    def persisted(self, operation, format, size, seconds):
+        labels = (("operation", operation), ("format", format))
+        self._add((
+            ("persistence_operations_total", labels, 1),
+            ("persistence_bytes_total", labels, size),
+            ("persistence_seconds_total", labels, seconds),
+        ))
+
+    def cache_lookup(self, cache, hits, misses):
+        labels = (("cache", cache),)
+        self._add((
+            ("cache_hits_total", labels, hits),
+            ("cache_misses_total", labels, misses),
+        ))
+
+    def value(self, name, **labels):
+        """
+        Returns the current value of a metric (without the namespace), e.g. ``value("trims_total", reason="tokens")``.
+        """
+        with self._lock:
+            return self._values[name].get(tuple(sorted(labels.items())), 0)
+
+    def render(self):
+        """
+        Returns every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            for name, help_text in self._METRICS:
+                full_name = f"{self.namespace}_{name}"
+                lines.append(f"# HELP {full_name} {help_text}")
+                lines.append(f"# TYPE {full_name} counter")
+                for labels, value in sorted(self._values[name].items()):
+                    label_text = ",".join(f'{key}="{_escape(str(label))}"' for key, label in labels)
+                    lines.append(f"{full_name}{{{label_text}}} {value}" if label_text else f"{full_name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def _add(self, increments):
+
+        with self._lock:
+            for name, labels, amount in increments:
+                labels = tuple(sorted(labels))
+                values = self._values[name]
+                values[labels] = values.get(labels, 0) + amount
+
+
+def _escape(value):
+
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
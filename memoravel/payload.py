@@ -0,0 +1,70 @@
+import json
+
+from .indexed import encode_message
+
+
+class PayloadCache:
+    """
+    Caches the serialized JSON of each message, so a request body can be built by joining bytes.
+
+    Messages are identified by the object itself, not by their content, so the cache never
+    hashes or compares them: a message must not be modified in place once it is in a memory.
+    Entries are kept until their messages leave the history of the memory, which discards
+    them as it removes the messages.
+    """
+
+    def __init__(self):
+        # id(message) -> (message, bytes); the message is kept so its id cannot be reused
+        self._encoded = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._encoded)
+
+    def encode(self, messages):
+        """
+        Returns the serialized JSON of each message, encoding only those not cached yet.
+        """
+        encoded = self._encoded
+        result = []
+        for message in messages:
+            entry = encoded.get(id(message))
+            if entry is None or entry[0] is not message:
+                entry = encoded[id(message)] = (message, encode_message(message))
+                self.misses += 1
+            else:
+                self.hits += 1
+            result.append(entry[1])
+        return result
+
+    def discard(self, messages):
+        """
+        Drops the cached serialization of ``messages``, which are leaving the history.
+        """
+        encoded = self._encoded
+        for message in messages:
+            entry = encoded.get(id(message))
+            if entry is not None and entry[0] is message:
+                del encoded[id(message)]
+
+    def clear(self):
+        """
+        Drops every cached serialization.
+        """
+        self._encoded = {}
+
+
+def build_payload(encoded_messages, fields):
+    """
+    Returns the JSON body of a chat request, with the already serialized ``encoded_messages``
+    as its "messages" and the other ``fields`` (e.g. "model") before them.
+    """
+    body = bytearray(b"{")
+    if fields:
+        body += json.dumps(fields, ensure_ascii=False, separators=(",", ":")).encode("utf-8")[1:-1]
+        body += b","
+    body += b'"messages":['
+    body += b",".join(encoded_messages)
+    body += b"]}"
+    return bytes(body)
@@ -0,0 +1,243 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from .backends import Backend, SQLiteBackend
+from .indexed import encode_message
+from .memoravel import Memoravel
+
+
+class _SessionSize:
+
+    # The serialized size and token count of each message of a resident session, with their
+    # totals, kept in step with its history
+    def __init__(self, messages, tokens):
+        self.sizes = [len(encode_message(message)) for message in messages]
+        self.tokens = list(tokens)
+        self.total_bytes = sum(self.sizes)
+        self.total_tokens = sum(self.tokens)
+
+    def insert(self, index, messages, tokens):
+        sizes = [len(encode_message(message)) for message in messages]
+        self.sizes[index:index] = sizes
+        self.tokens[index:index] = tokens
+        self.total_bytes += sum(sizes)
+        self.total_tokens += sum(tokens)
+
+    def remove(self, indices):
+        self.total_bytes -= sum(self.sizes[i] for i in indices)
+        self.total_tokens -= sum(self.tokens[i] for i in indices)
+        if indices[-1] - indices[0] + 1 == len(indices):
+            # A contiguous range, as removed by trimming
+            del self.sizes[indices[0]:indices[-1] + 1]
+            del self.tokens[indices[0]:indices[-1] + 1]
+        else:
+            removed = set(indices)
+            self.sizes = [size for i, size in enumerate(self.sizes) if i not in removed]
+            self.tokens = [count for i, count in enumerate(self.tokens) if i not in removed]
+
+
+class _SizedBackend(Backend):
+
+    # Forwards the changes of the pool's memories to its backend, measuring each session
+    # from the same changes, so the resident size is known without serializing any history
+    def __init__(self, backend):
+        self.backend = backend
+        self.sizes = {}
+
+    def insert(self, session_id, index, messages, tokens):
+        self.sizes[session_id].insert(index, messages, tokens)
+        self.backend.insert(session_id, index, messages, tokens)
+
+    def remove(self, session_id, indices, reason="delete"):
+        if indices:
+            self.sizes[session_id].remove(indices)
+        self.backend.remove(session_id, indices, reason)
+
+    def replace(self, session_id, messages, tokens, counted_with):
+        self.sizes[session_id] = _SessionSize(messages, tokens)
+        self.backend.replace(session_id, messages, tokens, counted_with)
+
+    def load(self, session_id, last_n=None):
+        messages, tokens, counted_with = self.backend.load(session_id, last_n)
+        self.sizes[session_id] = _SessionSize(messages, tokens)
+        return messages, tokens, counted_with
+
+    def flush(self):
+        self.backend.flush()
+
+
+class MemoravelPool:
+    """
+    Hands out one :class:`~memoravel.Memoravel` per session id, keeping only the most recently
+    used sessions in memory.
+
+    Every memory of the pool is bound to its session in a storage backend, so its changes are
+    persisted as they happen. When the resident sessions exceed ``max_sessions``,
+    ``max_resident_tokens`` or ``max_resident_bytes``, the least recently used ones are flushed and dropped from memory, and
+    they are restored from the backend the next time they are requested.
+
+    A memory returned by :meth:`get` may be evicted by any later call to the pool, and must
+    not be used after that. Use :meth:`session` to keep a session resident while working with it.
+
+    Args:
+        backend (Backend or str): The backend the sessions are stored in, or the path of a :class:`~memoravel.SQLiteBackend` database.
+        max_sessions (int, optional): Maximum number of resident sessions. Default is 128. Set to ``0`` for unlimited.
+        max_resident_tokens (int, optional): Maximum number of tokens of all the resident sessions together. Default is None (unlimited).
+        max_resident_bytes (int, optional): Maximum size of all the resident sessions together, measured as their serialized JSON. Default is None (unlimited).
+        **kwargs: Keyword arguments of the :class:`~memoravel.Memoravel` of each session.
+
+    Example:
+        .. code-block:: python
+
+            from memoravel import MemoravelPool
+            pool = MemoravelPool("sessions.db", max_sessions=1000, limit=20, token_cache=True)
+
+            with pool.session("session-42") as memory:
+                memory.add("user", "Hello!")
+                messages = memory.recall()
+
+            print(pool.hit_rate, pool.evictions)
+    """
+
+    def __init__(self, backend, max_sessions=128, max_resident_tokens=None, max_resident_bytes=None, **kwargs):
+        if isinstance(backend, str):
+            backend = SQLiteBackend(backend)
+            self._owns_backend = True
+        else:
+            self._owns_backend = False
+        self.backend = backend
+        self.max_sessions = max_sessions
+        self.max_resident_tokens = max_resident_tokens
+        self.max_resident_bytes = max_resident_bytes
+        self.kwargs = kwargs
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._memories = OrderedDict()
+        self._pins = {}
+        # The memories are bound through it, so it measures every resident session
+        self._sized = _SizedBackend(backend)
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._memories)
+
+    def __contains__(self, session_id):
+        return session_id in self._memories
+
+    @property
+    def hit_rate(self):
+        """
+        The fraction of requests served by a resident session.
+        """
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else 0.0
+
+    def get(self, session_id):
+        """
+        Returns the memory of a session, restoring it from the backend (or creating it) if it
+        is not resident.
+        """
+        with self._lock:
+            memory = self._memories.get(session_id)
+            if memory is not None:
+                self._memories.move_to_end(session_id)
+                self.hits += 1
+            else:
+                self.misses += 1
+                memory = Memoravel(**self.kwargs)
+                memory.bind(self._sized, session_id)
+                self._memories[session_id] = memory
+            self._evict(keep=session_id)
+            return memory
+
+    @contextmanager
+    def session(self, session_id):
+        """
+        Returns the memory of a session, which is kept resident until the block exits.
+        """
+        with self._lock:
+            memory = self.get(session_id)
+            self._pins[session_id] = self._pins.get(session_id, 0) + 1
+        try:
+            yield memory
+        finally:
+            with self._lock:
+                self._pins[session_id] -= 1
+                if not self._pins[session_id]:
+                    del self._pins[session_id]
+                self._evict()
+
+    def evict(self, session_id):
+        """
+        Flushes a session to the backend and drops it from memory.
+        """
+        with self._lock:
+            memory = self._memories.pop(session_id, None)
+            if memory is not None:
+                memory.unbind()
+                self._sized.sizes.pop(session_id, None)
+                self.evictions += 1
+
+    def delete(self, session_id):
+        """
+        Removes a session from the pool and from the backend.
+        """
+        with self._lock:
+            memory = self._memories.pop(session_id, None)
+            if memory is not None:
+                memory.unbind()
+                self._sized.sizes.pop(session_id, None)
+            self.backend.delete_session(session_id)
+
+    def resident_tokens(self):
+        """
+        Returns the number of tokens of all the resident sessions.
+        """
+        with self._lock:
+            return sum(self._sized.sizes[session_id].total_tokens for session_id in self._memories)
+
+    def resident_bytes(self):
+        """
+        Returns the serialized size of all the resident sessions.
+        """
+        with self._lock:
+            return sum(self._sized.sizes[session_id].total_bytes for session_id in self._memories)
+
+    def flush(self):
+        """
+        Makes sure every change of every session is persisted.
+        """
+        self.backend.flush()
+
+    def close(self):
+        """
+        Flushes every session and drops them from memory, closing the backend if the pool created it.
+        """
+        with self._lock:
+            for memory in self._memories.values():
+                memory.unbind()
+            self._memories.clear()
+            self._sized.sizes.clear()
+            if self._owns_backend:
+                self.backend.close()
+            else:
+                self.backend.flush()
+
+    def _evict(self, keep=None):
+
+        sessions = len(self._memories)
+        tokens = self.resident_tokens()
+        size = self.resident_bytes()
+        # Least recently used first, skipping the session just requested and those in use
+        candidates = [session_id for session_id in self._memories if session_id != keep and session_id not in self._pins]
+        for session_id in candidates:
+            if ((not self.max_sessions or sessions <= self.max_sessions)
+                    and (self.max_resident_tokens is None or tokens <= self.max_resident_tokens)
+                    and (self.max_resident_bytes is None or size <= self.max_resident_bytes)):
+                break
+            sessions -= 1
+            tokens -= self._sized.sizes[session_id].total_tokens
+            size -= self._sized.sizes[session_id].total_bytes
+            self.evict(session_id)
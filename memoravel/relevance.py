@@ -0,0 +1,200 @@
+import json
+import math
+import re
+import weakref
+import zlib
+
+from .eviction import FIFOEviction
+
+_WORD = re.compile(r"\w+")
+
+
+def _numpy():
+
+    # numpy is optional, and only imported when a relevance policy is created
+    try:
+        import numpy
+    except ImportError:
+        raise ValueError("Relevance eviction requires the 'numpy' package.") from None
+    return numpy
+
+
+def message_text(message):
+    """
+    Returns the text of a message that relevance is computed from: its text content, the
+    text parts of a multi-part content and the arguments of its tool calls.
+    """
+    content = message.get("content")
+    texts = []
+    if isinstance(content, str):
+        texts.append(content)
+    elif isinstance(content, list):
+        texts.extend(part.get("text", "") for part in content if isinstance(part, dict))
+    elif content is not None:
+        texts.append(json.dumps(content, ensure_ascii=False))
+    for tool_call in message.get("tool_calls") or ():
+        texts.append(tool_call.get("function", {}).get("arguments", ""))
+    return " ".join(texts)
+
+
+class HashingEmbedder:
+    """
+    Embeds texts offline, by hashing their words into a fixed number of dimensions.
+
+    Each word is hashed to a dimension and a sign, weighted by ``1 + log(count)`` and, when
+    ``idf`` is given, by the inverse document frequency of the word. The vectors are
+    L2-normalized, so their dot product is the cosine similarity of the texts. It needs no
+    model or vocabulary, which makes it a good default for scoring the relevance of messages.
+
+    An embedder is any callable receiving a list of texts and returning a 2-D array with
+    one row per text, so other embedding models can be plugged in as well.
+
+    Args:
+        dim (int, optional): Number of dimensions. Default is 1024.
+        idf (dict, optional): Inverse document frequency of each word. Default is None (every word weighs the same).
+    """
+
+    def __init__(self, dim=1024, idf=None):
+        self.np = _numpy()
+        self.dim = dim
+        self.idf = idf
+
+    def __call__(self, texts):
+        np = self.np
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts = {}
+            for word in _WORD.findall(text.lower()):
+                counts[word] = counts.get(word, 0) + 1
+            for word, count in counts.items():
+                digest = zlib.crc32(word.encode("utf-8"))
+                weight = 1 + math.log(count)
+                if self.idf is not None:
+                    weight *= self.idf.get(word, 1.0)
+                vectors[row, digest % self.dim] += weight if digest & 0x80000000 else -weight
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+
+class _VectorIndex:
+
+    # The embeddings of the messages of one memory, one row each in a matrix grown by
+    # doubling, so adding a message only writes its row
+
+    def __init__(self, np, dim):
+        self.np = np
+        self.matrix = np.zeros((64, dim), dtype=np.float32)
+        self.rows = {}
+        self.free = []
+        self.size = 0
+
+    def rows_of(self, messages, embedder):
+        missing = [message for message in messages if self._row(message) is None]
+        if missing:
+            vectors = embedder([message_text(message) for message in missing])
+            for message, vector in zip(missing, vectors):
+                self._add(message, vector)
+        return [self.rows[id(message)][1] for message in messages]
+
+    def discard(self, messages):
+        for message in messages:
+            entry = self.rows.get(id(message))
+            if entry is not None and entry[0] is message:
+                del self.rows[id(message)]
+                self.free.append(entry[1])
+
+    def prune(self, live):
+        live = {id(message) for message in live}
+        self.discard([entry[0] for key, entry in list(self.rows.items()) if key not in live])
+
+    def _row(self, message):
+        entry = self.rows.get(id(message))
+        return entry[1] if entry is not None and entry[0] is message else None
+
+    def _add(self, message, vector):
+        if self.free:
+            row = self.free.pop()
+        else:
+            if self.size == len(self.matrix):
+                grown = self.np.zeros((2 * len(self.matrix), self.matrix.shape[1]), dtype=self.matrix.dtype)
+                grown[:self.size] = self.matrix
+                self.matrix = grown
+            row = self.size
+            self.size += 1
+        self.matrix[row] = vector
+        # The message is kept with its row, so its id cannot be reused by another message
+        self.rows[id(message)] = (message, row)
+
+
+class RelevanceEviction(FIFOEviction):
+    """
+    Evicts the messages least relevant to the latest user message first.
+
+    Every message is embedded once, the first time it can be evicted, into a row of a
+    matrix kept for each memory. When the history must be trimmed, the latest user message
+    is embedded and every removable message is scored by a single matrix-vector product;
+    the least relevant ones are evicted until the history fits its limits. Facts stated
+    early in a conversation are kept as long as they relate to what is being discussed,
+    while unrelated chatter goes first. A small ``recency_weight`` favours recent messages
+    among equally relevant ones.
+
+    Requires ``numpy``.
+
+    Args:
+        embedder (callable, optional): Embeds a list of texts into a 2-D array. Default is a :class:`HashingEmbedder`.
+        recency_weight (float, optional): Bonus given to the most recent removable message, decreasing linearly to 0 for the oldest. Default is 0.1.
+
+    Example:
+        .. code-block:: python
+
+            from memoravel import Memoravel, RelevanceEviction
+            memory = Memoravel(limit=50, eviction=RelevanceEviction())
+    """
+
+    name = "relevance"
+
+    def __init__(self, embedder=None, recency_weight=0.1):
+        self.np = _numpy()
+        self.embedder = embedder if embedder is not None else HashingEmbedder()
+        self.recency_weight = recency_weight
+        self._indexes = weakref.WeakKeyDictionary()
+
+    def select(self, memory, start, stop, total_tokens, length):
+        """
+        Returns the indices of the least relevant removable messages, up to the low watermark.
+        """
+        np = self.np
+        history = memory.history
+        stop = min(stop, len(history))
+        query = next((message for message in reversed(history) if message.get("role") == "user"), None)
+        if start >= stop or query is None:
+            return super().select(memory, start, stop, total_tokens, length)
+
+        candidates = history[start:stop]
+        index = self._indexes.get(memory)
+        if index is None:
+            index = self._indexes[memory] = _VectorIndex(np, len(self.embedder([""])[0]))
+        elif len(index.rows) > 2 * len(history):
+            # Messages deleted by other means than trimming
+            index.prune(history)
+        rows = np.fromiter(index.rows_of(candidates, self.embedder), dtype=np.intp, count=len(candidates))
+        vector = np.asarray(self.embedder([message_text(query)])[0], dtype=np.float32)
+
+        # One matrix-vector product scores every message
+        scores = (index.matrix[:index.size] @ vector)[rows]
+        if self.recency_weight:
+            scores = scores + self.recency_weight * np.linspace(0, 1, len(candidates), dtype=np.float32)
+
+        to_remove = []
+        tokens = history.tokens(slice(start, stop))
+        for offset in np.argsort(scores, kind="stable"):
+            if not memory._exceeds_limits(total_tokens, length, memory.low_watermark):
+                break
+            if memory.preserve_system_memories and candidates[offset].get("role") == "system":
+                continue
+            to_remove.append(start + int(offset))
+            total_tokens -= tokens[offset]
+            length -= 1
+        to_remove.sort()
+        index.discard([history[i] for i in to_remove])
+        return to_remove
@@ -0,0 +1,164 @@
+import re
+
+# Encoding is resumed after the last whitespace, where tokenizers almost always start a new token
+_BOUNDARY = re.compile(r"\s(?=\S*$)")
+# Text without whitespace longer than this is cut anyway, so it is not encoded over and over
+_MAX_TAIL = 1024
+
+
+class _IncrementalTokens:
+
+    # Counts the tokens of a text received in chunks, encoding each part about once: the text
+    # before the last boundary is counted for good, and only the tail after it is encoded again
+
+    def __init__(self, encoder, serialize_text=None):
+        self.encoder = encoder
+        self.serialize_text = serialize_text
+        self.counted = 0
+        self.tail = ""
+        self.tail_tokens = 0
+
+    def feed(self, text):
+        if self.serialize_text is not None:
+            text = self.serialize_text(text)
+        self.tail += text
+        match = _BOUNDARY.search(self.tail)
+        cut = match.start() if match else (len(self.tail) - 16 if len(self.tail) > _MAX_TAIL else 0)
+        if cut > 0:
+            self.counted += len(self.encoder.encode(self.tail[:cut]))
+            self.tail = self.tail[cut:]
+        self.tail_tokens = len(self.encoder.encode(self.tail)) if self.tail else 0
+
+    @property
+    def tokens(self):
+        return self.counted + self.tail_tokens
+
+
+class MessageStream:
+    """
+    A message being streamed into a :class:`~memoravel.Memoravel`, created by
+    :meth:`Memoravel.stream <memoravel.Memoravel.stream>`.
+
+    Deltas are accumulated with :meth:`feed`, and the message is added to the history by
+    :meth:`finalize`. While the message is in flight, its tokens are counted incrementally
+    (encoding only the new text of each delta) and the memory trims its history as if the
+    message were already its last memory, so the budget of the next request is known
+    before the stream ends.
+
+    Used as a context manager, the stream is finalized when the block exits, or cancelled
+    if it exits with an exception.
+    """
+
+    def __init__(self, memory, role="assistant", **kwargs):
+        self.memory = memory
+        self.role = role
+        self.kwargs = kwargs
+        self.closed = False
+        self._content = []
+        self._tool_calls = {}
+        # Counters that encode a serialization (e.g. JSON) escape the streamed text the same way
+        self._serialize_text = getattr(memory.token_counter, "serialize_text", None)
+        self._text = _IncrementalTokens(memory.encoder, self._serialize_text)
+        self._arguments = {}
+        self._names = 0
+        # Tokens of the message without its streamed parts (role, overhead, other fields)
+        self._base = memory._count_message_tokens(memory._build_message(role, "", **kwargs))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.closed:
+            return
+        if exc_type is None:
+            self.finalize()
+        else:
+            self.cancel()
+
+    @property
+    def content(self):
+        """
+        The content received so far.
+        """
+        return "".join(self._content)
+
+    @property
+    def tool_calls(self):
+        """
+        The tool calls received so far, merged by their index.
+        """
+        return [self._tool_calls[index] for index in sorted(self._tool_calls)]
+
+    @property
+    def tokens(self):
+        """
+        The estimated token count of the message received so far.
+        """
+        return (self._base + self._text.tokens + self._names
+                + sum(arguments.tokens for arguments in self._arguments.values()))
+
+    def feed(self, content=None, tool_calls=None):
+        """
+        Appends a delta to the message: a chunk of its content and/or chunks of its tool calls.
+
+        Args:
+            content (str, optional): The next chunk of the content.
+            tool_calls (list, optional): Tool call deltas as streamed by the OpenAI API, each with an "index" and partial "id", "type" and "function" fields.
+
+        Example:
+            .. code-block:: python
+
+                with memory.stream() as message:
+                    for chunk in client.chat.completions.create(..., stream=True):
+                        delta = chunk.choices[0].delta
+                        message.feed(delta.content, delta.model_dump().get("tool_calls"))
+
+        """
+        if self.closed:
+            raise ValueError("The stream is already finalized or cancelled.")
+        encoder = self._text.encoder
+        if content:
+            self._content.append(content)
+            self._text.feed(content)
+        for delta in tool_calls or ():
+            index = delta.get("index", len(self._tool_calls))
+            call = self._tool_calls.setdefault(index, {"id": None, "type": "function", "function": {"name": "", "arguments": ""}})
+            if delta.get("id"):
+                call["id"] = delta["id"]
+            if delta.get("type"):
+                call["type"] = delta["type"]
+            function = delta.get("function") or {}
+            if function.get("name"):
+                call["function"]["name"] += function["name"]
+                self._names += len(encoder.encode(function["name"]))
+            if function.get("arguments"):
+                call["function"]["arguments"] += function["arguments"]
+                arguments = self._arguments.get(index)
+                if arguments is None:
+                    arguments = self._arguments[index] = _IncrementalTokens(encoder, self._serialize_text)
+                arguments.feed(function["arguments"])
+        self.memory._update_stream(self)
+
+    def finalize(self):
+        """
+        Adds the complete message to the history, with its exact token count (or its upper
+        bound, with ``token_estimation``), and returns it.
+        """
+        if self.closed:
+            raise ValueError("The stream is already finalized or cancelled.")
+        kwargs = dict(self.kwargs)
+        if self._tool_calls:
+            kwargs["tool_calls"] = self.tool_calls
+        message = self.memory._build_message(self.role, self.content if self._content or not self._tool_calls else None, **kwargs)
+        tokens, estimated = self.memory._tokens_to_append([message])
+        self.closed = True
+        self.memory._finish_stream(self, message, tokens, estimated)
+        return message
+
+    def cancel(self):
+        """
+        Discards the message.
+        """
+        if not self.closed:
+            self.closed = True
+            self.memory._finish_stream(self)
@@ -0,0 +1,404 @@
+import hashlib
+import json
+import math
+import threading
+from collections import OrderedDict
+
+
+# Process-wide registry of encoders, shared by every Memoravel using the same model
+_encoders = {}
+_encoders_lock = threading.Lock()
+
+
+def get_encoder(model):
+    """
+    Returns the tiktoken encoder of a model, creating it on first use.
+
+    Encoders are shared by the whole process, so every :class:`~memoravel.Memoravel` using
+    the same model reuses the same encoder. tiktoken itself is only imported when the first
+    encoder is created.
+
+    Args:
+        model (str): The model name, e.g. "gpt-4o".
+
+    Returns:
+        tiktoken.Encoding: The encoder of the model.
+    """
+    encoder = _encoders.get(model)
+    if encoder is None:
+        with _encoders_lock:
+            encoder = _encoders.get(model)
+            if encoder is None:
+                import tiktoken
+                encoder = _encoders[model] = tiktoken.encoding_for_model(model)
+    return encoder
+
+
+def register_encoder(model, encoder):
+    """
+    Registers the encoder to be used for a model, e.g. a custom or offline tokenizer.
+
+    The encoder must provide ``encode(text)`` and ``encode_batch(texts)``, like a tiktoken encoding.
+    """
+    with _encoders_lock:
+        _encoders[model] = encoder
+
+
+def warm_up(*models):
+    """
+    Creates the encoders of the given models ("gpt-4o" when none is given) ahead of time.
+
+    Call it before forking worker processes (e.g. in a pre-fork server's master process), so
+    every worker inherits the loaded encoders instead of loading them on its first request.
+
+    Example:
+        .. code-block:: python
+
+            import memoravel
+            memoravel.warm_up("gpt-4o", "gpt-4")
+    """
+    for model in models or ("gpt-4o",):
+        get_encoder(model)
+
+
+class JSONTokenCounter:
+    """
+    Counts the tokens of a message by encoding its JSON serialization.
+
+    This is how memoravel has always counted tokens. It is model agnostic, but it also counts
+    the quotes, braces and key names of the serialization, so it overestimates what the
+    message actually costs in a chat completion request.
+
+    A token counter is any object with a ``name`` and the ``count(message, encoder)`` and
+    ``count_batch(messages, encoder)`` methods, so custom counters can be given to
+    :class:`~memoravel.Memoravel` as well. Counters with an ``upper_bound(message)`` method
+    can also be used with ``token_estimation``.
+    """
+
+    name = "json"
+
+    def count(self, message, encoder):
+        """
+        Returns the number of tokens of a single message.
+        """
+        return len(encoder.encode(json.dumps(message)))
+
+    def count_batch(self, messages, encoder):
+        """
+        Returns the number of tokens of each message, encoding all of them in one batch.
+        """
+        # A single message does not pay for the thread pool used by encode_batch
+        if len(messages) == 1:
+            return [self.count(messages[0], encoder)]
+        return [len(tokens) for tokens in encoder.encode_batch([json.dumps(message) for message in messages])]
+
+    def upper_bound(self, message):
+        """
+        Returns an upper bound of the number of tokens of a message, without encoding it.
+
+        Every token encodes at least one byte, so a message never has more tokens than its
+        serialization has bytes (the serialization is ASCII, so bytes are characters).
+        """
+        return len(json.dumps(message))
+
+    def serialize_text(self, text):
+        """
+        Returns a string value as it appears in the encoded serialization (escaped, without
+        quotes), so streamed text can be counted chunk by chunk.
+        """
+        return json.dumps(text)[1:-1]
+
+
+class ChatTokenCounter:
+    """
+    Counts the tokens of a message the way OpenAI's chat completion format bills them.
+
+    Every message costs a fixed overhead plus the tokens of each of its values; a ``name``
+    costs one extra token. Text content, each text part of a multi-part content and the name
+    and arguments of each tool call are encoded separately, without any JSON serialization,
+    and image parts are costed from their size and detail, as described in OpenAI's vision
+    pricing.
+
+    Args:
+        tokens_per_message (int, optional): Fixed overhead of every message. Default is 3.
+        tokens_per_name (int, optional): Extra tokens of a message with a 'name'. Default is 1.
+        tokens_per_tool_call (int, optional): Fixed overhead of every tool call. Default is 3.
+        image_size (callable, optional): A function receiving an image URL and returning its ``(width, height)``, or None when unknown. Images of unknown size are costed as the largest high detail image. Default is None.
+
+    Example:
+        .. code-block:: python
+
+            from memoravel import Memoravel, ChatTokenCounter
+            memory = Memoravel(max_tokens=8000, token_counter=ChatTokenCounter())
+    """
+
+    name = "chat"
+
+    def __init__(self, tokens_per_message=3, tokens_per_name=1, tokens_per_tool_call=3, image_size=None):
+        self.tokens_per_message = tokens_per_message
+        self.tokens_per_name = tokens_per_name
+        self.tokens_per_tool_call = tokens_per_tool_call
+        self.image_size = image_size
+
+    @property
+    def cache_key(self):
+        """
+        Identifies the counting rules of this counter in a :class:`TokenCountCache`.
+        """
+        return (self.name, self.tokens_per_message, self.tokens_per_name, self.tokens_per_tool_call, id(self.image_size))
+
+    def count(self, message, encoder):
+        """
+        Returns the number of tokens of a single message.
+        """
+        texts, tokens = self._split(message)
+        return tokens + sum(len(encoder.encode(text)) for text in texts)
+
+    def count_batch(self, messages, encoder):
+        """
+        Returns the number of tokens of each message, encoding all of their texts in one batch.
+        """
+        if len(messages) == 1:
+            return [self.count(messages[0], encoder)]
+        splits = [self._split(message) for message in messages]
+        encoded = iter(encoder.encode_batch([text for texts, _ in splits for text in texts]))
+        return [tokens + sum(len(next(encoded)) for _ in texts) for texts, tokens in splits]
+
+    def upper_bound(self, message):
+        """
+        Returns an upper bound of the number of tokens of a message, without encoding it: its
+        fixed costs plus the UTF-8 length of its texts. See :meth:`JSONTokenCounter.upper_bound`.
+        """
+        texts, tokens = self._split(message)
+        return tokens + sum(len(text.encode("utf-8")) for text in texts)
+
+    def image_tokens(self, width, height, detail="auto"):
+        """
+        Returns the number of tokens of an image of the given size.
+
+        Low detail images cost a flat 85 tokens. Other images are scaled to fit in a
+        2048x2048 square and then to have their shortest side at most 768 pixels, and cost
+        170 tokens for each 512 pixels tile plus 85 tokens.
+        """
+        if detail == "low":
+            return 85
+        scale = min(1, 2048 / max(width, height))
+        width, height = width * scale, height * scale
+        scale = min(1, 768 / min(width, height))
+        width, height = width * scale, height * scale
+        return 170 * math.ceil(width / 512) * math.ceil(height / 512) + 85
+
+    def _split(self, message):
+
+        # Returns the texts that must be encoded and the tokens that are known without encoding
+        texts = []
+        tokens = self.tokens_per_message
+        for key, value in message.items():
+            if key == "content":
+                tokens += self._split_content(value, texts)
+            elif key == "tool_calls" and isinstance(value, list):
+                for tool_call in value:
+                    function = tool_call.get("function", {})
+                    texts.append(function.get("name", ""))
+                    texts.append(function.get("arguments", ""))
+                    tokens += self.tokens_per_tool_call
+            elif value is not None:
+                texts.append(value if isinstance(value, str) else json.dumps(value))
+                if key == "name":
+                    tokens += self.tokens_per_name
+        return texts, tokens
+
+    def _split_content(self, content, texts):
+
+        if content is None:
+            return 0
+        if isinstance(content, str):
+            texts.append(content)
+            return 0
+        if not isinstance(content, list):
+            texts.append(json.dumps(content))
+            return 0
+        tokens = 0
+        for part in content:
+            if part.get("type") == "text":
+                texts.append(part.get("text", ""))
+            elif part.get("type") == "image_url":
+                tokens += self._image_part_tokens(part.get("image_url", {}))
+            else:
+                texts.append(json.dumps(part))
+        return tokens
+
+    def _image_part_tokens(self, image_url):
+
+        if isinstance(image_url, str):
+            image_url = {"url": image_url}
+        detail = image_url.get("detail", "auto")
+        size = self.image_size(image_url.get("url")) if self.image_size is not None else None
+        if size is None:
+            # Unknown size: assume the most expensive image (2048x768 after scaling, 8 tiles)
+            size = (2048, 768)
+        return self.image_tokens(size[0], size[1], detail)
+
+
+class TokenCountCache:
+    """
+    A bounded LRU cache mapping the content hash of a message to its token count.
+
+    Many sessions share identical messages, like system prompts, tool schemas or canned
+    replies. Sharing one cache between memories makes each of them be encoded once per
+    process instead of once per session. The cache is thread-safe.
+
+    Args:
+        maxsize (int, optional): The maximum number of counts kept. Default is 4096.
+
+    Example:
+        .. code-block:: python
+
+            from memoravel import Memoravel, TokenCountCache
+            cache = TokenCountCache(maxsize=10000)
+            memory = Memoravel(token_cache=cache)
+            ...
+            print(cache.hits, cache.misses, cache.hit_rate)
+    """
+
+    def __init__(self, maxsize=4096):
+        if maxsize <= 0:
+            raise ValueError("The 'maxsize' parameter must be greater than 0.")
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._counts)
+
+    @property
+    def hit_rate(self):
+        """
+        The fraction of lookups that were found in the cache.
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, key):
+        """
+        Returns the cached count of ``key``, or None.
+        """
+        with self._lock:
+            count = self._counts.get(key)
+            if count is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._counts.move_to_end(key)
+            return count
+
+    def put(self, key, count):
+        """
+        Stores the count of ``key``, evicting the least recently used count if the cache is full.
+        """
+        with self._lock:
+            self._counts[key] = count
+            self._counts.move_to_end(key)
+            if len(self._counts) > self.maxsize:
+                self._counts.popitem(last=False)
+
+    def clear(self):
+        """
+        Removes every count and resets the statistics.
+        """
+        with self._lock:
+            self._counts.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+# The cache used by memories created with token_cache=True
+default_token_cache = TokenCountCache()
+
+
+class CachedTokenCounter:
+    """
+    Wraps a token counter, looking up the count of each message in a :class:`TokenCountCache`
+    before encoding it.
+
+    Args:
+        counter (object): The token counter that counts the messages missing from the cache.
+        cache (TokenCountCache): The cache, usually shared between memories.
+    """
+
+    def __init__(self, counter, cache):
+        self.counter = counter
+        self.cache = cache
+        self.name = counter.name
+        # Set by the memory using this counter, see Memoravel.observer
+        self.observer = None
+
+    def count(self, message, encoder):
+        """
+        Returns the number of tokens of a single message.
+        """
+        return self.count_batch([message], encoder)[0]
+
+    def count_batch(self, messages, encoder):
+        """
+        Returns the number of tokens of each message, encoding only the ones missing from the cache.
+        """
+        keys = [self._key(message, encoder) for message in messages]
+        counts = [self.cache.get(key) for key in keys]
+        missing = [i for i, count in enumerate(counts) if count is None]
+        if self.observer is not None:
+            self.observer.cache_lookup("token_counts", len(counts) - len(missing), len(missing))
+        if missing:
+            missing_counts = self.counter.count_batch([messages[i] for i in missing], encoder)
+            for i, count in zip(missing, missing_counts):
+                counts[i] = count
+                self.cache.put(keys[i], count)
+        return counts
+
+    def upper_bound(self, message):
+        """
+        Returns an upper bound of the number of tokens of a message, as given by the wrapped counter.
+        """
+        return self.counter.upper_bound(message)
+
+    def serialize_text(self, text):
+        """
+        Returns a string value as the wrapped counter encodes it. See :meth:`JSONTokenCounter.serialize_text`.
+        """
+        serialize_text = getattr(self.counter, "serialize_text", None)
+        return text if serialize_text is None else serialize_text(text)
+
+    def _key(self, message, encoder):
+
+        digest = hashlib.blake2b(json.dumps(message, sort_keys=True).encode("utf-8"), digest_size=16).digest()
+        counter_key = getattr(self.counter, "cache_key", self.counter.name)
+        return (counter_key, getattr(encoder, "name", type(encoder).__name__), digest)
+
+
+def get_token_counter(token_counter):
+    """
+    Returns a token counter from its name ("json" or "chat"), or the given counter itself.
+    """
+    if token_counter == "json":
+        return JSONTokenCounter()
+    if token_counter == "chat":
+        return ChatTokenCounter()
+    if isinstance(token_counter, str) or not hasattr(token_counter, "count_batch"):
+        raise ValueError("The 'token_counter' parameter must be 'json', 'chat' or a token counter object.")
+    return token_counter
+
+
+def get_token_cache(token_cache):
+    """
+    Returns the cache to use from the ``token_cache`` parameter of a memory: None (no cache),
+    True (the process-wide :data:`default_token_cache`) or a :class:`TokenCountCache`.
+    """
+    if token_cache is None or token_cache is False:
+        return None
+    if token_cache is True:
+        return default_token_cache
+    if not isinstance(token_cache, TokenCountCache):
+        raise ValueError("The 'token_cache' parameter must be None, True or a TokenCountCache.")
+    return token_cache
@@ -22,6 +22,10 @@ setup(
         "tiktoken>=0.1",
         "jsonschema>=4.0"
     ],
+    extras_require={
+        "zstd": ["zstandard"],
+        "relevance": ["numpy"],
+    },
     keywords='LLM memory message history',
     license='MIT',
 )
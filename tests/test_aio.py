@@ -0,0 +1,110 @@
+# tests/test_aio.py
+
+import unittest
+import asyncio
+import os
+from memoravel import AsyncMemoravel
+
+
+class TestAsyncMemoravel(unittest.TestCase):
+    def setUp(self):
+        self.test_file = "test_memoria_async.json"
+
+    def tearDown(self):
+        for path in (self.test_file, self.test_file + ".journal"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_add_and_trim(self):
+        async def run():
+            memory = AsyncMemoravel(limit=3, max_tokens=0, preserve_system_memories=False, preserve_last_memories=0)
+            for i in range(4):
+                await memory.add("user", f"Mensagem {i+1}")
+            return memory.recall()
+
+        history = asyncio.run(run())
+        self.assertEqual([msg["content"] for msg in history], ["Mensagem 2", "Mensagem 3", "Mensagem 4"])
+
+    def test_concurrent_adds_keep_call_order(self):
+        async def run():
+            # Alternate large (offloaded) and small (inline) messages
+            memory = AsyncMemoravel(limit=0, max_tokens=0, offload_threshold=100)
+            contents = [("x " * 200 if i % 2 else "y") + str(i) for i in range(20)]
+            await asyncio.gather(*(memory.add("user", content) for content in contents))
+            return memory, contents
+
+        memory, contents = asyncio.run(run())
+        self.assertEqual([msg["content"] for msg in memory.recall()], contents)
+        counter = memory.memory.token_counter
+        self.assertEqual(memory.count_tokens(), sum(counter.count_batch(memory.recall(), memory.memory.encoder)))
+
+    def test_extend_insert_delete(self):
+        async def run():
+            memory = AsyncMemoravel(limit=10)
+            await memory.extend([{"role": "user", "content": "Mensagem 1"}, {"role": "user", "content": "Mensagem 4"}])
+            await memory.insert(1, [{"role": "user", "content": "Mensagem 2"}, {"role": "user", "content": "Mensagem 3"}])
+            await memory.delete(0)
+            return memory.recall()
+
+        history = asyncio.run(run())
+        self.assertEqual([msg["content"] for msg in history], ["Mensagem 2", "Mensagem 3", "Mensagem 4"])
+
+    def test_async_summarizer(self):
+        async def summarizer(messages):
+            await asyncio.sleep(0)
+            return f"{len(messages)} mensagens"
+
+        async def run():
+            memory = AsyncMemoravel(limit=0, max_tokens=60, summarizer=summarizer)
+            for i in range(8):
+                await memory.add("user", f"Mensagem {i+1}")
+            return memory
+
+        memory = asyncio.run(run())
+        history = memory.recall()
+        self.assertTrue(history[0]["content"].endswith("mensagens"))
+        self.assertEqual(history[-1]["content"], "Mensagem 8")
+        self.assertLessEqual(memory.count_tokens(), 60)
+
+    def test_save_and_load(self):
+        async def run():
+            memory = AsyncMemoravel()
+            await memory.add("assistant", "Message 1")
+            await memory.add("user", "Message 2")
+            await memory.save(self.test_file)
+
+            new_memory = AsyncMemoravel()
+            await new_memory.load(self.test_file)
+            return memory, new_memory
+
+        memory, new_memory = asyncio.run(run())
+        self.assertEqual(new_memory.recall(), memory.recall())
+        self.assertEqual(new_memory.count_tokens(), memory.count_tokens())
+
+    def test_save_and_load_other_formats(self):
+        async def run(format, compression, lazy):
+            memory = AsyncMemoravel(limit=0, max_tokens=0)
+            await memory.add("assistant", "Message 1")
+            await memory.save(self.test_file, format=format, compression=compression)
+            await memory.add("user", "Message 2")
+            await memory.save(self.test_file, format=format, compression=compression)
+
+            # The format is detected from the file
+            new_memory = AsyncMemoravel(limit=0, max_tokens=0)
+            await new_memory.load(self.test_file, lazy=lazy)
+            if memory.memory.journal is not None:
+                memory.memory.journal.close()
+                new_memory.memory.journal.close()
+            return memory, new_memory
+
+        for format, compression, lazy in (("binary", "zlib", False), ("indexed", None, True), ("journal", None, False)):
+            memory, new_memory = asyncio.run(run(format, compression, lazy))
+            self.assertEqual(new_memory.recall(), memory.recall())
+            self.assertEqual(new_memory.count_tokens(), memory.count_tokens())
+
+        with self.assertRaises(ValueError):
+            asyncio.run(AsyncMemoravel().save(self.test_file, compression="zlib"))
+
+
+if __name__ == "__main__":
+    unittest.main()
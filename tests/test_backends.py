@@ -0,0 +1,121 @@
+# tests/test_backends.py
+
+import unittest
+import os
+import shutil
+import tempfile
+from memoravel import Memoravel, SQLiteBackend
+from memoravel.backends import Backend
+
+
+class TestSQLiteBackend(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.backend = SQLiteBackend(os.path.join(self.directory, "sessions.db"), batch_size=4)
+
+    def tearDown(self):
+        self.backend.close()
+        shutil.rmtree(self.directory)
+
+    def test_changes_are_persisted(self):
+        memory = Memoravel(limit=5, preserve_system_memories=True, preserve_last_memories=1)
+        memory.bind(self.backend, "a")
+        memory.add("system", "Mensagem de sistema")
+        for i in range(12):
+            memory.add("user", f"Mensagem {i+1}")
+            if i == 5:
+                memory.insert(1, [{"role": "assistant", "content": "Inserida"}, {"role": "user", "content": "Outra"}])
+                memory.delete(-2)
+            if i == 8:
+                memory.insert(-1, {"role": "assistant", "content": "Antes da última"})
+
+        messages, tokens, counted_with = self.backend.load("a")
+        self.assertEqual(messages, memory.recall())
+        self.assertEqual(sum(tokens), memory.count_tokens())
+        self.assertEqual(counted_with, ["json", "gpt-4o"])
+
+        # Binding a new memory restores the session without counting tokens again
+        new_memory = Memoravel(limit=5)
+        new_memory.token_counter.count = new_memory.token_counter.count_batch = None
+        new_memory.bind(self.backend, "a")
+        self.assertEqual(new_memory.recall(), memory.recall())
+        self.assertEqual(new_memory.count_tokens(), memory.count_tokens())
+
+    def test_last_n_and_sessions(self):
+        for session in ("a", "b"):
+            memory = Memoravel(limit=0, max_tokens=0)
+            memory.bind(self.backend, session)
+            memory.extend([{"role": "user", "content": f"{session} {i}"} for i in range(6)])
+            memory.unbind()
+
+        messages, tokens, _ = self.backend.load("b", last_n=2)
+        self.assertEqual(messages, [{"role": "user", "content": "b 4"}, {"role": "user", "content": "b 5"}])
+        self.assertEqual(len(tokens), 2)
+        self.assertEqual(self.backend.sessions(), ["a", "b"])
+
+        self.backend.delete_session("a")
+        self.assertEqual(self.backend.sessions(), ["b"])
+        self.assertEqual(self.backend.load("a"), ([], [], None))
+
+    def test_load_file_replaces_session(self):
+        file_path = os.path.join(self.directory, "memoria.json")
+        memory = Memoravel(limit=0, max_tokens=0)
+        memory.add("user", "Do arquivo")
+        memory.save(file_path)
+
+        memory = Memoravel(limit=0, max_tokens=0)
+        memory.bind(self.backend, "a")
+        memory.add("user", "Antiga")
+        memory.load(file_path)
+        self.assertEqual(self.backend.load("a")[0], [{"role": "user", "content": "Do arquivo"}])
+
+    def test_bound_memory_cannot_be_loaded_lazily(self):
+        file_path = os.path.join(self.directory, "memoria.idx")
+        memory = Memoravel(limit=0, max_tokens=0)
+        memory.add("user", "Do arquivo")
+        memory.save(file_path, format="indexed")
+
+        memory = Memoravel(limit=0, max_tokens=0)
+        memory.bind(self.backend, "a")
+        memory.add("user", "Antiga")
+        with self.assertRaises(ValueError):
+            memory.load(file_path, lazy=True)
+        self.assertEqual(self.backend.load("a")[0], memory.recall())
+
+        memory.load(file_path)
+        self.assertEqual(self.backend.load("a")[0], [{"role": "user", "content": "Do arquivo"}])
+
+    def test_backends_must_implement_the_hooks(self):
+        class Incomplete(Backend):
+            def insert(self, session_id, index, messages, tokens):
+                pass
+
+            def remove(self, session_id, indices, reason="delete"):
+                pass
+
+        with self.assertRaises(TypeError):
+            Backend()
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+    def test_counts_are_recomputed_for_another_model(self):
+        memory = Memoravel(limit=0, max_tokens=0)
+        memory.bind(self.backend, "a")
+        memory.add("user", "Olá")
+        memory.unbind()
+
+        memory = Memoravel(limit=0, max_tokens=0, token_counter="chat")
+        memory.bind(self.backend, "a")
+        self.assertEqual(self.backend.load("a")[2], ["chat", "gpt-4o"])
+        self.assertEqual(memory.count_tokens(), memory._count_message_tokens(memory.recall()[0]))
+
+    def test_bound_memory_cannot_be_journaled(self):
+        memory = Memoravel()
+        memory.bind(self.backend, "a")
+        file_path = os.path.join(self.directory, "memoria.jsonl")
+        with self.assertRaises(ValueError):
+            memory.save(file_path, format="journal")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+# tests/test_binary.py
+
+import unittest
+import os
+import shutil
+import tempfile
+from unittest import mock
+from memoravel import Memoravel
+from memoravel.binary import is_binary, read_binary, write_binary, zstandard
+
+
+class TestBinaryFormat(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.test_file = os.path.join(self.directory, "memoria.bin")
+        self.memory = Memoravel(limit=0, max_tokens=0)
+        self.memory.add("system", "Você é um assistente")
+        self.memory.add("user", "Qual é o clima em Paris?")
+        self.memory.add("assistant", tool_calls=[{"id": "call_1", "type": "function", "function": {"name": "clima", "arguments": "{\"cidade\": \"Paris\"}"}}])
+        self.memory.add("tool", {"temperatura": 18, "descricao": "ensolarado"}, tool_call_id="call_1")
+        self.memory.insert(1, {"role": "user", "content": [{"type": "text", "text": "Olá"}]})
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assert_round_trip(self, compression=None):
+        self.memory.save(self.test_file, format="binary", compression=compression)
+        self.assertTrue(is_binary(self.test_file))
+
+        new_memory = Memoravel(limit=0, max_tokens=0)
+        with mock.patch.object(new_memory, "_count_messages_tokens", side_effect=AssertionError("tokens recounted")):
+            new_memory.load(self.test_file)
+        self.assertEqual(new_memory.recall(), self.memory.recall())
+        self.assertEqual([list(msg) for msg in new_memory.recall()], [list(msg) for msg in self.memory.recall()])
+        self.assertEqual(new_memory.count_tokens(), self.memory.count_tokens())
+
+    def test_round_trip(self):
+        self.assert_round_trip()
+
+    def test_round_trip_zlib(self):
+        self.assert_round_trip("zlib")
+
+    @unittest.skipIf(zstandard is None, "zstandard is not installed")
+    def test_round_trip_zstd(self):
+        self.assert_round_trip("zstd")
+
+    def test_contents_are_not_escaped_twice(self):
+        self.memory.save(self.test_file, format="binary")
+        with open(self.test_file, "rb") as file:
+            data = file.read()
+        self.assertIn('{"temperatura": 18, "descricao": "ensolarado"}'.encode("utf-8"), data)
+        self.assertIn("Você é um assistente".encode("utf-8"), data)
+
+    def test_recounts_tokens_of_another_counter(self):
+        write_binary(self.test_file, self.memory.recall(), [1] * 5, {"tokens": ["other", "gpt-4o"]})
+        new_memory = Memoravel(limit=0, max_tokens=0)
+        new_memory.load(self.test_file)
+        self.assertEqual(new_memory.count_tokens(), self.memory.count_tokens())
+
+    def test_newer_version_is_rejected(self):
+        self.memory.save(self.test_file, format="binary")
+        with open(self.test_file, "r+b") as file:
+            file.seek(7)
+            file.write(bytes([99]))
+        with self.assertRaises(ValueError):
+            read_binary(self.test_file)
+
+    def test_invalid_compression(self):
+        with self.assertRaises(ValueError):
+            self.memory.save(self.test_file, format="json", compression="zlib")
+        with self.assertRaises(ValueError):
+            write_binary(self.test_file, [], [], {}, compression="lz4")
+
+
+if __name__ == "__main__":
+    unittest.main()
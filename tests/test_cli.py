@@ -0,0 +1,100 @@
+# tests/test_cli.py
+
+import unittest
+import io
+import json
+import os
+import shutil
+import tempfile
+from contextlib import redirect_stdout
+from memoravel import Memoravel
+from memoravel.cli import iter_files, main
+
+
+class TestCli(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.sessions = os.path.join(self.directory, "sessions")
+        os.makedirs(os.path.join(self.sessions, "nested"))
+        for i, (name, format) in enumerate([("a.json", "json"), ("nested/b.bin", "binary"),
+                                            ("c.idx", "indexed"), ("d.jsonl", "journal")]):
+            memory = Memoravel(limit=0, max_tokens=0)
+            memory.add("system", "Regras")
+            for j in range(5 + i):
+                memory.add("user", f"Mensagem {j+1}")
+            memory.save(os.path.join(self.sessions, name), format=format)
+            if format == "journal":
+                memory.add("user", "Mensagem do journal")
+                memory.journal.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_cli(self, *args):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            status = main(list(args) + ["--quiet"])
+        return status, json.loads(output.getvalue())
+
+    def test_iter_files(self):
+        files = list(iter_files([self.sessions]))
+        # The .journal file belongs to its snapshot
+        self.assertEqual([relative for _, relative in files], ["a.json", "c.idx", "d.jsonl", os.path.join("nested", "b.bin")])
+        files = list(iter_files([os.path.join(self.sessions, "**", "*.bin")]))
+        self.assertEqual([relative for _, relative in files], [os.path.join("nested", "b.bin")])
+
+    def test_migrates_to_another_directory_in_parallel(self):
+        output = os.path.join(self.directory, "output")
+        report = os.path.join(self.directory, "report.jsonl")
+        status, summary = self.run_cli(self.sessions, "--output", output, "--format", "binary", "--limit", "4",
+                                       "--workers", "2", "--chunksize", "1", "--report", report)
+        self.assertEqual(status, 0)
+        self.assertEqual(summary["files"], 4)
+        self.assertEqual(summary["trimmed"], 4)
+        self.assertEqual(summary["messages_after"], 16)
+        for name in ("a.json", "nested/b.bin", "c.idx", "d.jsonl"):
+            memory = Memoravel(limit=0, max_tokens=0)
+            memory.load(os.path.join(output, name))
+            self.assertEqual(memory.history[0]["content"], "Regras")
+            self.assertEqual(len(memory.recall()), 4)
+            self.assertEqual(memory.count_tokens(), sum(memory._count_messages_tokens(memory.recall())))
+        memory.load(os.path.join(output, "d.jsonl"))
+        self.assertEqual(memory.recall()[-1]["content"], "Mensagem do journal")
+        # The sources were left untouched
+        source = Memoravel(limit=0, max_tokens=0)
+        source.load(os.path.join(self.sessions, "a.json"))
+        self.assertEqual(len(source.recall()), 6)
+        with open(report, encoding="utf-8") as file:
+            results = [json.loads(line) for line in file]
+        self.assertEqual(sorted(result["format"] for result in results), ["binary"] * 4)
+
+    def test_migrates_in_place_and_reports_errors(self):
+        with open(os.path.join(self.sessions, "broken.json"), "w", encoding="utf-8") as file:
+            file.write("{not json")
+        journal_path = os.path.join(self.sessions, "d.jsonl.journal")
+        with open(journal_path, "a", encoding="utf-8") as file:
+            file.write('["i",1,[[3,{"role":"us')
+        with open(journal_path, "rb") as file:
+            journal = file.read()
+        status, summary = self.run_cli(self.sessions, "--dry-run", "--max-tokens", "30", "--workers", "0")
+        # A dry run does not even drop a partial journal record
+        with open(journal_path, "rb") as file:
+            self.assertEqual(file.read(), journal)
+        self.assertEqual(status, 1)
+        self.assertEqual(summary["failed"], 1)
+        self.assertEqual(summary["bytes_written"], 0)
+        self.assertLess(summary["tokens_after"], summary["tokens_before"])
+
+        os.remove(os.path.join(self.sessions, "broken.json"))
+        path = os.path.join(self.sessions, "d.jsonl")
+        status, summary = self.run_cli(path, "--format", "json", "--limit", "3", "--workers", "0")
+        self.assertEqual((status, summary["files"]), (0, 1))
+        self.assertFalse(os.path.exists(path + ".journal"))
+        self.assertFalse(os.path.exists(path + ".tmp"))
+        memory = Memoravel(limit=0, max_tokens=0)
+        memory.load(path)
+        self.assertEqual([msg["content"] for msg in memory.recall()], ["Regras", "Mensagem 8", "Mensagem do journal"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+# tests/test_indexed.py
+
+import unittest
+import json
+import os
+import shutil
+import tempfile
+from memoravel import Memoravel
+from memoravel.indexed import LazyHistory, is_indexed
+
+
+class TestIndexedFormat(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.test_file = os.path.join(self.directory, "memoria.idx")
+        self.memory = Memoravel(limit=0, max_tokens=0)
+        for i in range(100):
+            self.memory.add("system" if i % 10 == 0 else "user", f"Mensagem {i+1} çã")
+        self.memory.save(self.test_file, format="indexed")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_save_and_load(self):
+        self.assertTrue(is_indexed(self.test_file))
+        new_memory = Memoravel(limit=0, max_tokens=0)
+        new_memory.load(self.test_file)
+        self.assertNotIsInstance(new_memory.history, LazyHistory)
+        self.assertEqual(new_memory.recall(), self.memory.recall())
+        self.assertEqual(new_memory.count_tokens(), self.memory.count_tokens())
+
+    def test_lazy_load_decodes_only_what_is_touched(self):
+        new_memory = Memoravel(limit=0, max_tokens=0)
+        new_memory.load(self.test_file, lazy=True)
+        self.assertIsInstance(new_memory.history, LazyHistory)
+        self.assertEqual(new_memory.count_tokens(), self.memory.count_tokens())
+        self.assertEqual(new_memory.history.decoded(), 0)
+
+        self.assertEqual(new_memory.recall(last_n=20), self.memory.recall(last_n=20))
+        self.assertEqual(new_memory.recall(index_or_slice=-1), self.memory.recall(index_or_slice=-1))
+        self.assertEqual(new_memory.history.decoded(), 20)
+
+    def test_lazy_requires_the_indexed_format(self):
+        for format in ("json", "binary"):
+            other_file = os.path.join(self.directory, f"outra.{format}")
+            self.memory.save(other_file, format=format)
+            new_memory = Memoravel(limit=0, max_tokens=0)
+            with self.assertRaises(ValueError):
+                new_memory.load(other_file, lazy=True)
+            with self.assertRaises(ValueError):
+                new_memory.load(self.test_file, format=format, lazy=True)
+            self.assertEqual(new_memory.recall(), [])
+
+    def test_lazy_trimming_decodes_nothing(self):
+        new_memory = Memoravel(limit=30, max_tokens=0, preserve_system_memories=True, preserve_last_memories=0)
+        new_memory.load(self.test_file, lazy=True)
+        new_memory.add("user", "Nova mensagem")
+        # Only the added message is decoded
+        self.assertEqual(new_memory.history.decoded(), 1)
+        self.assertEqual(len(new_memory.history), 30)
+        history = new_memory.recall()
+        self.assertEqual(sum(1 for msg in history if msg["role"] == "system"), 10)
+        self.assertEqual(new_memory.count_tokens(), sum(len(new_memory.encoder.encode(json.dumps(msg))) for msg in history))
+
+    def test_save_lazy_history(self):
+        new_memory = Memoravel(limit=0, max_tokens=0)
+        new_memory.load(self.test_file, lazy=True)
+        new_memory.delete(slice(0, 50))
+        other_file = os.path.join(self.directory, "outra.idx")
+        new_memory.save(other_file, format="indexed")
+        self.assertEqual(new_memory.history.decoded(), 0)
+
+        last_memory = Memoravel(limit=0, max_tokens=0)
+        last_memory.load(other_file)
+        self.assertEqual(last_memory.recall(), self.memory.recall(index_or_slice=slice(50, None)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+# tests/test_journal.py
+
+import unittest
+import os
+import shutil
+import tempfile
+from memoravel import Memoravel, TruncatingSummarizer
+from memoravel.journal import Journal, read_journal
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.test_file = os.path.join(self.directory, "memoria.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def build_memory(self):
+        memory = Memoravel(limit=5, preserve_system_memories=True, preserve_last_memories=1)
+        memory.add("system", "Mensagem de sistema")
+        memory.save(self.test_file, format="journal")
+        for i in range(10):
+            memory.add("user", f"Mensagem {i+1}")
+            if i == 4:
+                memory.insert(1, {"role": "assistant", "content": "Inserida"})
+                memory.delete(-2)
+            memory.save(self.test_file, format="journal")
+        return memory
+
+    def test_save_appends_and_load_replays(self):
+        memory = self.build_memory()
+        snapshot_size = os.path.getsize(self.test_file)
+
+        memory.add("user", "Mensagem 11")
+        memory.save(self.test_file, format="journal")
+        # Saving again only appends to the journal
+        self.assertEqual(os.path.getsize(self.test_file), snapshot_size)
+
+        new_memory = Memoravel(limit=5)
+        new_memory.load(self.test_file)
+        self.assertEqual(new_memory.recall(), memory.recall())
+        self.assertEqual(new_memory.count_tokens(), memory.count_tokens())
+        memory.journal.close()
+
+        # The loaded memory keeps journaling its changes
+        new_memory.add("user", "Mensagem 12")
+        new_memory.save(self.test_file, format="journal")
+        new_memory.journal.close()
+        last_memory = Memoravel(limit=5)
+        last_memory.load(self.test_file)
+        self.assertEqual(last_memory.recall(), new_memory.recall())
+        last_memory.journal.close()
+
+    def test_partial_record_is_ignored(self):
+        memory = self.build_memory()
+        memory.journal.close()
+        with open(self.test_file + ".journal", "a", encoding="utf-8") as file:
+            file.write('["i",3,[[5,{"role":"us')
+        size = os.path.getsize(self.test_file + ".journal")
+
+        # Reading the journal leaves the partial record in place
+        history, _, _, _, valid_size = read_journal(self.test_file)
+        self.assertEqual(history, memory.recall())
+        self.assertEqual(os.path.getsize(self.test_file + ".journal"), size)
+
+        new_memory = Memoravel(limit=5)
+        new_memory.load(self.test_file)
+        self.assertEqual(new_memory.recall(), memory.recall())
+        # Attaching to the journal drops it before appending
+        self.assertEqual(os.path.getsize(self.test_file + ".journal"), valid_size)
+        new_memory.add("user", "Depois da falha")
+        new_memory.save(self.test_file, format="journal")
+        new_memory.journal.close()
+
+        last_memory = Memoravel(limit=5)
+        last_memory.load(self.test_file)
+        self.assertEqual(last_memory.recall(), new_memory.recall())
+        last_memory.journal.close()
+
+    def test_compaction(self):
+        memory = Memoravel(limit=3, preserve_system_memories=False, preserve_last_memories=0)
+        Journal(self.test_file, compact_every=4).attach(memory)
+        for i in range(9):
+            memory.add("user", f"Mensagem {i+1}")
+        memory.save(self.test_file, format="journal")
+        with open(self.test_file + ".journal", encoding="utf-8") as file:
+            self.assertLess(len(file.readlines()), 5)
+
+        new_memory = Memoravel(limit=3)
+        new_memory.load(self.test_file)
+        self.assertEqual(new_memory.recall(), memory.recall())
+        memory.journal.close()
+        new_memory.journal.close()
+
+    def test_compaction_with_summarizer(self):
+        # Compacting the journal in the middle of a summary must not record the summary twice
+        for compact_every in range(3, 8):
+            memory = Memoravel(limit=0, max_tokens=80, summarizer=TruncatingSummarizer(max_chars=120))
+            Journal(self.test_file, compact_every=compact_every).attach(memory)
+            for i in range(40):
+                memory.add("user", f"Mensagem {i+1}")
+            memory.journal.close()
+
+            new_memory = Memoravel(limit=0, max_tokens=80)
+            new_memory.load(self.test_file)
+            self.assertEqual(new_memory.recall(), memory.recall())
+            self.assertEqual(new_memory.count_tokens(), memory.count_tokens())
+            new_memory.journal.close()
+
+    def test_journal_from_another_generation_is_ignored(self):
+        memory = self.build_memory()
+        expected = memory.recall()
+        memory.journal.compact()
+        memory.journal.close()
+        # Simulate a crash after a compaction replaced the snapshot, but not the old journal yet
+        with open(self.test_file + ".journal", "w", encoding="utf-8") as file:
+            file.write('{"generation":"other"}\n["d",[0]]\n')
+
+        new_memory = Memoravel(limit=5)
+        new_memory.load(self.test_file)
+        self.assertEqual(new_memory.recall(), expected)
+        new_memory.journal.close()
+
+    def test_invalid_format(self):
+        memory = Memoravel()
+        with self.assertRaises(ValueError):
+            memory.save(self.test_file, format="xml")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,7 +2,12 @@
 
 import unittest
 import os
-from memoravel import Memoravel
+import json
+import random
+import threading
+from unittest import mock
+from memoravel import Memoravel, PrefixCacheEviction, TruncatingSummarizer
+from memoravel.history import ListHistory, SharedHistory
 
 class TestMemoravel(unittest.TestCase):
     def setUp(self):
@@ -449,5 +454,566 @@ class TestMemoravel(unittest.TestCase):
         self.assertEqual(history[1]["content"], "Mensagem 2")
         self.assertEqual(history[2]["content"], "Mensagem 3")
 
+    def test_count_tokens_is_cached(self):
+        memory = Memoravel(limit=4, max_tokens=0, preserve_system_memories=False, preserve_last_memories=0)
+        for i in range(6):
+            memory.add("user", f"Mensagem {i+1}")
+        memory.insert(1, [{"role": "user", "content": "Mensagem A"}, {"role": "user", "content": "Mensagem B"}])
+        memory.delete(slice(0, 2))
+
+        expected = sum(len(memory.encoder.encode(json.dumps(msg))) for msg in memory.recall())
+        with mock.patch.object(memory.encoder, "encode", side_effect=AssertionError("encoder called")):
+            self.assertEqual(memory.count_tokens(), expected)
+
+    def test_trim_does_not_encode(self):
+        memory = Memoravel(limit=3, max_tokens=0, preserve_system_memories=False, preserve_last_memories=0)
+        for i in range(3):
+            memory.add("user", f"Mensagem {i+1}")
+        with mock.patch.object(memory, "_count_messages_tokens", wraps=memory._count_messages_tokens) as counter:
+            memory.add("user", "Mensagem 4")
+        self.assertEqual(counter.call_count, 1)
+        self.assertEqual(memory.recall()[0]["content"], "Mensagem 2")
+
+    def test_trim_matches_one_by_one_eviction(self):
+        # Bulk trimming must evict exactly what removing one message at a time would
+        memory = Memoravel(limit=6, max_tokens=60, preserve_initial_memories=1, preserve_system_memories=True, preserve_last_memories=2)
+        expected = []
+        for i in range(40):
+            role = "system" if i % 3 == 0 else "user"
+            message = {"role": role, "content": f"Mensagem {i+1}"}
+            memory.add(role, message["content"])
+
+            expected.append(message)
+            while (sum(len(memory.encoder.encode(json.dumps(m))) for m in expected) > 60 or len(expected) > 6):
+                window = range(1, len(expected) - 2)
+                removable = [j for j in window if expected[j]["role"] != "system"]
+                if not removable:
+                    break
+                expected.pop(removable[0])
+
+            self.assertEqual(memory.recall(), expected)
+
+    def test_deque_storage_matches_list(self):
+        settings = dict(limit=8, max_tokens=120, preserve_initial_memories=2, preserve_system_memories=True, preserve_last_memories=2)
+        list_memory = Memoravel(storage="list", **settings)
+        deque_memory = Memoravel(storage="deque", **settings)
+        for i in range(30):
+            for memory in (list_memory, deque_memory):
+                memory.add("system" if i % 4 == 0 else "user", f"Mensagem {i+1}")
+                if i % 5 == 0:
+                    memory.insert(3, [{"role": "user", "content": f"Inserida {i}"}, {"role": "assistant", "content": f"Resposta {i}"}])
+                if i % 7 == 6:
+                    memory.delete(slice(-2, -5, -1))
+                if i % 9 == 8:
+                    memory.delete(0)
+            self.assertEqual(deque_memory.recall(), list_memory.recall())
+            self.assertEqual(deque_memory.count_tokens(), list_memory.count_tokens())
+            for index_or_slice in (1, -1, slice(1, 4), slice(-1, -4, -1), slice(None, None, 2)):
+                self.assertEqual(deque_memory.recall(index_or_slice=index_or_slice), list_memory.recall(index_or_slice=index_or_slice))
+            self.assertEqual(deque_memory.recall(last_n=3), list_memory.recall(last_n=3))
+            length = len(list_memory.history)
+            for start, stop in ((0, length), (1, 4), (length - 3, length), (3, length - 1), (length - 1, length + 5)):
+                self.assertEqual(list(deque_memory.history.entries(start, stop)), list(list_memory.history.entries(start, stop)))
+
+    def test_invalid_storage(self):
+        with self.assertRaises(ValueError):
+            Memoravel(storage="array")
+
+    def test_extend(self):
+        memory = Memoravel(limit=3, max_tokens=0, preserve_system_memories=True, preserve_last_memories=0)
+        memory.add("system", "Mensagem 1")
+        with mock.patch.object(memory, "_trim_history", wraps=memory._trim_history) as trim:
+            memory.extend([
+                {"role": "user", "content": "Mensagem 2"},
+                {"role": "assistant", "content": {"resposta": 3}},
+                {"role": "tool", "content": "Mensagem 4", "tool_call_id": "call_1"},
+            ])
+        self.assertEqual(trim.call_count, 1)
+
+        history = memory.recall()
+        self.assertEqual(len(history), 3)
+        self.assertEqual(history[0]["content"], "Mensagem 1")
+        self.assertEqual(history[1]["content"], json.dumps({"resposta": 3}))
+        self.assertEqual(history[2]["tool_call_id"], "call_1")
+        self.assertEqual(memory.count_tokens(), sum(len(memory.encoder.encode(json.dumps(msg))) for msg in history))
+
+    def test_extend_invalid(self):
+        memory = Memoravel()
+        with self.assertRaises(ValueError):
+            memory.extend({"role": "user", "content": "Mensagem 1"})
+
+    def test_insert_list_counts_tokens(self):
+        memory = Memoravel(limit=10)
+        memory.add("user", "Mensagem 1")
+        memory.insert(0, [{"role": "user", "content": "Mensagem A"}, {"role": "user", "content": "Mensagem B"}])
+        history = memory.recall()
+        self.assertEqual([msg["content"] for msg in history], ["Mensagem A", "Mensagem B", "Mensagem 1"])
+        self.assertEqual(memory.count_tokens(), sum(len(memory.encoder.encode(json.dumps(msg))) for msg in history))
+
+    def test_chat_token_counter(self):
+        json_memory = Memoravel(limit=0, max_tokens=0)
+        chat_memory = Memoravel(limit=0, max_tokens=0, token_counter="chat")
+        for memory in (json_memory, chat_memory):
+            memory.add("system", "You talk like a pirate, always")
+            memory.add("user", "Hello!")
+        expected = sum(3 + len(chat_memory.encoder.encode(msg["role"])) + len(chat_memory.encoder.encode(msg["content"])) for msg in chat_memory.recall())
+        self.assertEqual(chat_memory.count_tokens(), expected)
+        self.assertLess(chat_memory.count_tokens(), json_memory.count_tokens())
+
+    def test_thread_safe_concurrent_adds(self):
+        memory = Memoravel(limit=20, max_tokens=0, preserve_system_memories=True, preserve_last_memories=2, thread_safe=True)
+        memory.add("system", "Mensagem de sistema")
+        errors = []
+
+        def writer(worker):
+            try:
+                for i in range(200):
+                    memory.add("user", f"Mensagem {worker}-{i}")
+                    if i % 50 == 0:
+                        memory.insert(1, {"role": "assistant", "content": f"Inserida {worker}-{i}"})
+            except Exception as e:
+                errors.append(e)
+
+        def reader():
+            try:
+                for _ in range(200):
+                    history = memory.recall()
+                    self.assertLessEqual(len(history), 20)
+                    self.assertEqual(history[0]["role"], "system")
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=writer, args=(worker,)) for worker in range(4)] + [threading.Thread(target=reader)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        history = memory.recall()
+        self.assertEqual(len(history), 20)
+        self.assertEqual(memory.count_tokens(), sum(len(memory.encoder.encode(json.dumps(msg))) for msg in history))
+
+    def test_view_matches_recall(self):
+        for storage in ("list", "deque"):
+            memory = Memoravel(limit=0, max_tokens=0, storage=storage, preserve_initial_memories=2)
+            memory.extend([{"role": "user", "content": f"Mensagem {i}"} for i in range(8)])
+            for kwargs in ({}, {"last_n": 3}, {"first_n": 2}, {"index_or_slice": -2}, {"index_or_slice": slice(1, 7, 2)},
+                           {"index_or_slice": slice(None, None, -3)}, {"index_or_slice": slice(5, 9, -1)}):
+                view = memory.view(**kwargs)
+                self.assertEqual(list(view), memory.recall(**kwargs))
+                self.assertEqual(view, memory.recall(**kwargs))
+            view = memory.view()
+            self.assertEqual(view[1:3], memory.recall()[1:3])
+            self.assertEqual(view.tokens(), memory.history.tokens(slice(None)))
+            self.assertEqual(view[::-2].tokens(), memory.history.tokens(slice(None, None, -2)))
+            with self.assertRaises(IndexError):
+                memory.view(index_or_slice=8)
+
+    def test_view_does_not_copy_the_history(self):
+        memory = Memoravel(limit=6, max_tokens=0, preserve_system_memories=False, preserve_last_memories=0)
+        memory.extend([{"role": "user", "content": f"Mensagem {i}"} for i in range(6)])
+        expected = memory.recall()
+        view = memory.view()
+        with mock.patch("memoravel.history.ListHistory.__getitem__") as getitem:
+            iterator = iter(view)
+            yielded = [next(iterator), next(iterator)]
+        # The messages are read from the list itself, without slicing the history
+        getitem.assert_not_called()
+        # Trimming while iterating does not change the messages already yielded
+        memory.add("user", "Mensagem 6")
+        self.assertEqual(yielded, expected[:2])
+        self.assertIs(yielded[0], expected[0])
+
+    def test_payload_reuses_serialized_messages(self):
+        memory = Memoravel(limit=4, max_tokens=0)
+        memory.add("system", "Mensagem de sistema")
+        for i in range(5):
+            memory.add("user", f"Mensagem {i+1} \u00e9")
+            body = memory.payload(model="gpt-4o", temperature=0)
+            self.assertEqual(json.loads(body), {"model": "gpt-4o", "temperature": 0, "messages": memory.recall()})
+        # Each message was serialized once, when it was first sent
+        self.assertEqual(memory.payload_cache.misses, 6)
+        self.assertEqual(json.loads(memory.payload(last_n=1)), {"messages": memory.recall(last_n=1)})
+        # Sending only part of the history keeps the others cached, until they leave it
+        memory.payload()
+        self.assertEqual(memory.payload_cache.misses, 6)
+        self.assertEqual(len(memory.payload_cache), 4)
+        memory.delete(1)
+        self.assertEqual(len(memory.payload_cache), 3)
+
+    def test_stream_counts_and_trims_incrementally(self):
+        memory = Memoravel(limit=0, max_tokens=70, preserve_system_memories=True, preserve_last_memories=1)
+        memory.add("system", "Mensagem de sistema")
+        for i in range(4):
+            memory.add("user", f"Mensagem {i+1}")
+        length = len(memory.recall())
+
+        text = "Esta é uma resposta longa, transmitida em pedaços pequenos. " * 2
+        with memory.stream() as message:
+            for i in range(0, len(text), 7):
+                message.feed(text[i:i + 7])
+                self.assertLessEqual(memory.count_tokens() + message.tokens, 70)
+            self.assertLess(len(memory.recall()), length)
+            estimate = message.tokens
+
+        history = memory.recall()
+        self.assertEqual(history[-1], {"role": "assistant", "content": text})
+        self.assertEqual(history[0]["role"], "system")
+        self.assertAlmostEqual(memory.history.tokens(-1), estimate, delta=2)
+        self.assertEqual(memory.count_tokens(), sum(len(memory.encoder.encode(json.dumps(msg))) for msg in history))
+
+    def test_stream_tool_calls_and_cancel(self):
+        memory = Memoravel(limit=5)
+        message = memory.stream()
+        with self.assertRaises(ValueError):
+            memory.stream()
+        message.feed(tool_calls=[{"index": 0, "id": "call_1", "type": "function", "function": {"name": "get_weather", "arguments": ""}}])
+        message.feed(tool_calls=[{"index": 0, "function": {"arguments": '{"city": '}}])
+        message.feed(tool_calls=[{"index": 0, "function": {"arguments": '"Recife"}'}}])
+        self.assertEqual(message.finalize(), {"role": "assistant", "tool_calls": [
+            {"id": "call_1", "type": "function", "function": {"name": "get_weather", "arguments": '{"city": "Recife"}'}}]})
+        self.assertEqual(len(memory.recall()), 1)
+
+        with self.assertRaises(RuntimeError):
+            with memory.stream() as message:
+                message.feed("Parcial")
+                raise RuntimeError
+        self.assertEqual(len(memory.recall()), 1)
+        with self.assertRaises(ValueError):
+            message.feed("Depois")
+
+    def test_summarizer_compacts_down_to_target(self):
+        calls = []
+
+        def summarizer(messages):
+            calls.append(len(messages))
+            return TruncatingSummarizer(chars_per_message=10, max_chars=120)(messages)
+
+        memory = Memoravel(limit=0, max_tokens=200, preserve_last_memories=2, summarizer=summarizer, compaction_target=0.5)
+        memory.add("system", "Mensagem de sistema")
+        for i in range(40):
+            memory.add("user", f"Mensagem número {i+1} com algum texto")
+            self.assertLessEqual(memory.count_tokens(), 200)
+
+        history = memory.recall()
+        self.assertEqual(history[0]["role"], "system")
+        self.assertEqual(history[-1]["content"], "Mensagem número 40 com algum texto")
+        self.assertTrue(history[1]["content"].startswith(TruncatingSummarizer.prefix))
+        # Each compaction summarizes a batch of messages, not one per add
+        self.assertLess(len(calls), 10)
+        self.assertTrue(all(count > 1 for count in calls))
+        self.assertEqual(memory.count_tokens(), sum(len(memory.encoder.encode(json.dumps(msg))) for msg in history))
+
+    def test_async_summarizer(self):
+        async def summarizer(messages):
+            return {"role": "system", "content": f"{len(messages)} mensagens"}
+
+        memory = Memoravel(limit=0, max_tokens=60, summarizer=summarizer)
+        for i in range(8):
+            memory.add("user", f"Mensagem {i+1}")
+        self.assertEqual(memory.recall()[0]["role"], "system")
+        self.assertLessEqual(memory.count_tokens(), 60)
+
+    def test_summarizer_runs_outside_of_the_lock(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def summarizer(messages):
+            started.set()
+            release.wait(5)
+            return TruncatingSummarizer()(messages)
+
+        memory = Memoravel(limit=0, max_tokens=60, summarizer=summarizer, thread_safe=True)
+        for i in range(4):
+            memory.add("user", f"Mensagem {i+1}")
+        writer = threading.Thread(target=lambda: [memory.add("user", f"Mensagem {i+5}") for i in range(4)])
+        writer.start()
+        self.assertTrue(started.wait(5))
+        # Readers and writers are not blocked while the summarizer runs
+        recalled = []
+        reader = threading.Thread(target=lambda: recalled.append(memory.recall()))
+        reader.start()
+        reader.join(2)
+        self.assertEqual(len(recalled), 1)
+        release.set()
+        writer.join(5)
+        self.assertLessEqual(memory.count_tokens(), 60)
+        self.assertEqual(memory.recall()[-1]["content"], "Mensagem 8")
+
+    def test_watermarks_trim_in_batches(self):
+        memory = Memoravel(limit=10, max_tokens=0, preserve_system_memories=True, high_watermark=1.0, low_watermark=0.6)
+        memory.add("system", "Mensagem de sistema")
+        lengths = []
+        for i in range(30):
+            memory.add("user", f"Mensagem {i+1}")
+            lengths.append(len(memory.recall()))
+        # The history grows back to the limit before the next batch is evicted
+        self.assertEqual(lengths[:12], [2, 3, 4, 5, 6, 7, 8, 9, 10, 6, 7, 8])
+        self.assertEqual(memory.recall()[0]["role"], "system")
+        self.assertEqual(memory.recall()[-1]["content"], "Mensagem 30")
+
+        memory = Memoravel(limit=0, max_tokens=100, low_watermark=0.5, high_watermark=0.9)
+        for i in range(30):
+            memory.add("user", f"Mensagem {i+1}")
+            self.assertLessEqual(memory.count_tokens(), 90)
+
+    def test_prefix_cache_eviction_keeps_stable_prefix(self):
+        eviction = PrefixCacheEviction(stable_prefix_tokens=40, min_evict_tokens=60)
+        memory = Memoravel(limit=0, max_tokens=200, eviction=eviction)
+        memory.add("system", "Mensagem de sistema")
+        prefix = None
+        trims = 0
+        for i in range(60):
+            memory.recall()
+            memory.add("user", f"Mensagem {i+1}")
+            self.assertLessEqual(memory.count_tokens(), 200)
+            length, tokens = memory.unchanged_prefix()
+            if length < len(memory.recall()) - 1:
+                trims += 1
+                # Only the messages after the stable prefix were evicted
+                self.assertEqual(length, 3)
+                self.assertEqual(tokens, sum(memory.history.tokens(slice(0, 3))))
+            if i == 2:
+                prefix = memory.recall()[:3]
+        self.assertEqual(memory.recall()[:3], prefix)
+        self.assertTrue(0 < trims < 15)
+
+        # The stable prefix is evicted too when the limits cannot be met otherwise
+        memory = Memoravel(limit=4, max_tokens=0, preserve_system_memories=True, eviction=eviction)
+        memory.add("user", "Mensagem 1")
+        for i in range(4):
+            memory.add("system", f"Regra {i+1}")
+        self.assertEqual([msg["content"] for msg in memory.recall()], ["Regra 1", "Regra 2", "Regra 3", "Regra 4"])
+
+    def test_prefix_cache_eviction_within_a_small_budget(self):
+        # The whole history fits in the default stable prefix of 1024 tokens: the prefix is
+        # clamped to half of the limit, and the messages after it are evicted in one chunk
+        memory = Memoravel(limit=20, eviction="prefix_cache")
+        memory.add("system", "Você é um assistente.")
+        evictions = []
+        for i in range(60):
+            previous = len(memory.recall())
+            memory.add("user" if i % 2 else "assistant", f"Mensagem {i+1}")
+            length, tokens = memory.unchanged_prefix()
+            if len(memory.history) <= previous:
+                evictions.append(i)
+                self.assertEqual(length, 10)
+                self.assertEqual(tokens, sum(memory.history.tokens(slice(0, 10))))
+            else:
+                # Every message sent before is still there
+                self.assertEqual(length, previous)
+        # The prefix grows for several turns between two evictions
+        self.assertEqual(evictions, [19, 29, 39, 49, 59])
+
+    def test_unchanged_prefix(self):
+        memory = Memoravel(limit=0, max_tokens=0)
+        memory.extend([{"role": "user", "content": f"Mensagem {i+1}"} for i in range(4)])
+        self.assertEqual(memory.unchanged_prefix(), (0, 0))
+        memory.recall(last_n=2)
+        memory.add("user", "Mensagem 5")
+        self.assertEqual(memory.unchanged_prefix(), (4, sum(memory.history.tokens(slice(0, 4)))))
+        memory.insert(2, {"role": "user", "content": "Inserida"})
+        self.assertEqual(memory.unchanged_prefix()[0], 2)
+        memory.delete(0)
+        self.assertEqual(memory.unchanged_prefix(), (0, 0))
+
+    def test_token_estimation_trims_exactly_the_same(self):
+        configurations = [
+            dict(limit=8, max_tokens=150, preserve_initial_memories=1, preserve_last_memories=2),
+            dict(limit=0, max_tokens=200, low_watermark=0.6, storage="deque", preserve_initial_memories=2),
+            dict(limit=0, max_tokens=200, eviction=PrefixCacheEviction(stable_prefix_tokens=40, min_evict_tokens=50)),
+            dict(limit=6, max_tokens=0, preserve_last_memories=3),
+        ]
+        for settings in configurations:
+            exact = Memoravel(**settings)
+            estimated = Memoravel(token_estimation=True, **settings)
+            for i in range(60):
+                for memory in (exact, estimated):
+                    if i % 10 == 0:
+                        memory.add("system", "Regra " * (i % 7))
+                    elif i % 4 == 0:
+                        memory.extend([{"role": "user", "content": f"Pergunta {i}"}, {"role": "assistant", "content": "Resposta longa " * (i % 5)}])
+                    else:
+                        memory.add("user", f"Mensagem {i} " + "é" * (i % 3))
+                    if i % 13 == 12:
+                        memory.delete(-1)
+                self.assertEqual(estimated.recall(), exact.recall())
+            self.assertEqual(estimated.count_tokens(), exact.count_tokens())
+            self.assertEqual(estimated.history.tokens(slice(None)), exact.history.tokens(slice(None)))
+
+    def test_token_estimation_encodes_only_near_the_budget(self):
+        memory = Memoravel(limit=0, max_tokens=1000, token_estimation=True)
+        with mock.patch.object(memory, "_count_messages_tokens", wraps=memory._count_messages_tokens) as counter:
+            for i in range(5):
+                memory.add("user", f"Mensagem {i+1}")
+            self.assertEqual(counter.call_count, 0)
+            # The bounds are upper bounds: the approximate count never undercounts before calibration
+            bounded = memory.count_tokens(exact=False)
+            expected = sum(len(memory.encoder.encode(json.dumps(msg))) for msg in memory.recall())
+            self.assertGreaterEqual(bounded, expected)
+            self.assertEqual(memory.count_tokens(), expected)
+            self.assertEqual(counter.call_count, 1)
+            # Exact counts are kept, and calibrate the estimate of the next messages
+            self.assertEqual(memory.count_tokens(), expected)
+            self.assertEqual(counter.call_count, 1)
+            memory.add("user", "Mensagem 6")
+            self.assertAlmostEqual(memory.count_tokens(exact=False), expected + len(memory.encoder.encode(json.dumps(memory.recall()[-1]))), delta=1)
+
+            # Near the budget, the last messages are encoded to decide whether to trim
+            memory.add("user", "x " * 500)
+            self.assertEqual(counter.call_count, 2)
+            self.assertLessEqual(memory.count_tokens(), 1000)
+            self.assertEqual(memory.recall()[-1]["content"], "x " * 500)
+
+    def test_token_estimation_with_deletes_and_persistence(self):
+        memory = Memoravel(limit=0, max_tokens=0, storage="deque", preserve_initial_memories=2, token_estimation=True)
+        memory.extend([{"role": "user", "content": f"Mensagem {i+1}"} for i in range(4)])
+        memory.delete(slice(1, 3))
+        memory.add("user", "Mensagem 5")
+        memory.insert(1, {"role": "user", "content": "Inserida"})
+        memory.add("user", "Mensagem 6")
+        memory.save(self.test_file, format="binary")
+        new_memory = Memoravel(limit=0, max_tokens=0)
+        new_memory.load(self.test_file)
+        self.assertEqual(new_memory.recall(), memory.recall())
+        self.assertEqual(new_memory.history.tokens(slice(None)), memory.history.tokens(slice(None)))
+        self.assertEqual(memory.count_tokens(), sum(len(memory.encoder.encode(json.dumps(msg))) for msg in memory.recall()))
+
+        # Messages added to a memory saved as a journal are counted right away
+        memory.save(self.test_file, format="journal")
+        memory.add("user", "Mensagem 7")
+        self.assertEqual(memory._estimated, 0)
+        memory.journal.close()
+        os.remove(self.test_file + ".journal")
+
+    def test_chat_token_counter_upper_bound(self):
+        memory = Memoravel(token_counter="chat", token_estimation=True)
+        messages = [
+            {"role": "user", "content": "Olá, tudo bem? 😀"},
+            {"role": "assistant", "content": None, "tool_calls": [{"id": "call_1", "type": "function", "function": {"name": "f", "arguments": "{\"a\": 1}"}}]},
+            {"role": "user", "name": "ana", "content": [{"type": "text", "text": "Veja"}, {"type": "image_url", "image_url": {"url": "x", "detail": "low"}}]},
+        ]
+        for message in messages:
+            self.assertGreaterEqual(memory.token_counter.upper_bound(message), memory.token_counter.count(message, memory.encoder))
+
+    def test_token_estimation_requires_upper_bound(self):
+        class Counter:
+            name = "custom"
+
+            def count_batch(self, messages, encoder):
+                return [1 for message in messages]
+
+        with self.assertRaises(ValueError):
+            Memoravel(token_counter=Counter(), token_estimation=True)
+        Memoravel(token_counter=Counter())
+
+    def test_shared_history_matches_list(self):
+        rng = random.Random(7)
+        histories = [(SharedHistory(), ListHistory())]
+        counter = 0
+        for step in range(600):
+            shared, reference = rng.choice(histories)
+            operation = rng.random()
+            if operation < 0.45 or not len(reference):
+                count = rng.randint(1, 3)
+                index = rng.randint(-len(reference) - 1, len(reference)) if rng.random() < 0.3 else len(reference)
+                messages = [{"role": "user", "content": f"Mensagem {counter + i}"} for i in range(count)]
+                tokens = [counter + i for i in range(count)]
+                counter += count
+                shared.splice(index, messages, tokens)
+                reference.splice(index, messages, tokens)
+            elif operation < 0.75:
+                indices = sorted(rng.sample(range(len(reference)), rng.randint(1, min(4, len(reference)))))
+                if rng.random() < 0.5:
+                    indices = list(range(rng.randint(0, len(reference) - 1), len(reference)))[:rng.randint(1, 6)]
+                shared.remove(indices)
+                reference.remove(indices)
+            elif operation < 0.85:
+                start = rng.randint(0, len(reference) - 1)
+                tokens = [rng.randint(0, 9) for _ in range(len(reference) - start)]
+                shared.recount(start, tokens)
+                reference.recount(start, tokens)
+            elif len(histories) < 12:
+                copy = ListHistory()
+                copy.splice(0, reference[:], reference.tokens(slice(None)))
+                histories.append((shared.fork(), copy))
+            for shared, reference in histories:
+                self.assertEqual(len(shared), len(reference))
+                self.assertEqual(shared[:], reference[:])
+                self.assertEqual(list(shared), reference[:])
+                self.assertEqual(shared.tokens(slice(None)), reference.tokens(slice(None)))
+                self.assertEqual(shared.total_tokens, reference.total_tokens)
+            for index_or_slice in (0, -1, slice(1, 4), slice(-1, -5, -1), slice(None, None, 3)):
+                if len(reference) > 4:
+                    self.assertEqual(shared[index_or_slice], reference[index_or_slice])
+                    self.assertEqual(shared.tokens(index_or_slice), reference.tokens(index_or_slice))
+                    self.assertEqual(list(shared.entries(1, 4)), list(reference.entries(1, 4)))
+
+    def test_fork_shares_history(self):
+        for storage in ("list", "deque"):
+            memory = Memoravel(limit=8, max_tokens=0, preserve_initial_memories=1, storage=storage)
+            memory.add("system", "Regras")
+            for i in range(6):
+                memory.add("user", f"Mensagem {i+1}")
+            original = memory.recall()
+            with mock.patch.object(memory.encoder, "encode", side_effect=AssertionError("encoder called")):
+                branches = [memory.fork() for _ in range(3)]
+            # The branches share the messages themselves
+            self.assertTrue(all(a is b for a, b in zip(branches[0].recall(), original)))
+            self.assertEqual(branches[0].count_tokens(), memory.count_tokens())
+
+            for n, branch in enumerate(branches):
+                for i in range(5 + n):
+                    branch.add("assistant", f"Ramo {n} resposta {i+1}")
+            branches[1].delete(2)
+            branches[2].insert(3, {"role": "user", "content": "Inserida"})
+            nested = branches[2].fork()
+            nested.extend([{"role": "user", "content": f"Neta {i}"} for i in range(10)])
+
+            # Trimming the branches never changed the memory or each other
+            self.assertEqual(memory.recall(), original)
+            self.assertEqual(memory.count_tokens(), sum(memory._count_messages_tokens(original)))
+            self.assertEqual(branches[0].recall()[-1]["content"], "Ramo 0 resposta 5")
+            self.assertEqual(branches[2].recall()[-1]["content"], "Ramo 2 resposta 7")
+            self.assertEqual(len(nested.recall()), 8)
+            for branch in branches + [nested]:
+                self.assertEqual(branch.recall()[0]["content"], "Regras")
+                self.assertEqual(branch.count_tokens(), sum(branch._count_messages_tokens(branch.recall())))
+
+            memory.add("user", "Mensagem 7")
+            memory.add("user", "Mensagem 8")
+            self.assertEqual([msg["content"] for msg in memory.recall()][1:3], ["Mensagem 2", "Mensagem 3"])
+            self.assertEqual(branches[0].recall()[0:3], [original[0], original[5], original[6]])
+
+    def test_fork_is_independent_of_persistence(self):
+        memory = Memoravel(limit=0, max_tokens=0, token_estimation=True)
+        memory.extend([{"role": "user", "content": f"Mensagem {i+1}"} for i in range(3)])
+        memory.save(self.test_file, format="journal")
+        branch = memory.fork()
+        self.assertIsNone(branch.journal)
+        self.assertEqual(branch.count_tokens(), memory.count_tokens())
+        branch.add("user", "Só no ramo")
+        memory.journal.close()
+        loaded = Memoravel(limit=0, max_tokens=0)
+        loaded.load(self.test_file)
+        self.assertEqual(loaded.recall(), memory.recall())
+        loaded.journal.close()
+        os.remove(self.test_file + ".journal")
+
+    def test_invalid_eviction(self):
+        with self.assertRaises(ValueError):
+            Memoravel(eviction="lru")
+
+    def test_invalid_watermarks(self):
+        with self.assertRaises(ValueError):
+            Memoravel(low_watermark=0.8, high_watermark=0.5)
+        with self.assertRaises(ValueError):
+            Memoravel(high_watermark=1.2)
+
+    def test_invalid_compaction_target(self):
+        with self.assertRaises(ValueError):
+            Memoravel(summarizer=TruncatingSummarizer(), compaction_target=0)
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,109 @@
+# tests/test_metrics.py
+
+import unittest
+import os
+import shutil
+import tempfile
+from memoravel import Memoravel, PrometheusObserver, TokenCountCache
+from memoravel import MemoravelError, PersistenceError, TokenCountError
+
+
+class BrokenEncoder:
+    name = "broken"
+
+    def encode(self, text):
+        raise RuntimeError("encoder unavailable")
+
+    def encode_batch(self, texts):
+        raise RuntimeError("encoder unavailable")
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_observer_receives_measurements(self):
+        observer = PrometheusObserver()
+        memory = Memoravel(limit=5, max_tokens=0, token_cache=TokenCountCache(), observer=observer)
+        for i in range(8):
+            memory.add("user", f"Mensagem {i % 4}")
+        self.assertEqual(observer.value("tokenizer_calls_total"), 8)
+        self.assertEqual(observer.value("tokenized_messages_total"), 8)
+        self.assertEqual(observer.value("tokenized_tokens_total"), memory.count_tokens() + sum(
+            memory._count_messages_tokens([{"role": "user", "content": f"Mensagem {i}"} for i in range(3)])))
+        self.assertEqual(observer.value("trims_total", reason="limit"), 3)
+        self.assertEqual(observer.value("evicted_messages_total", reason="limit"), 3)
+        self.assertEqual(observer.value("cache_hits_total", cache="token_counts"), 7)
+        self.assertEqual(observer.value("cache_misses_total", cache="token_counts"), 4)
+
+        memory = Memoravel(limit=0, max_tokens=30, observer=observer)
+        for i in range(5):
+            memory.add("user", f"Mensagem {i}")
+        self.assertGreater(observer.value("evicted_tokens_total", reason="tokens"), 0)
+
+        path = os.path.join(self.directory, "memoria.json")
+        memory.save(path)
+        memory.load(path)
+        self.assertEqual(observer.value("persistence_bytes_total", operation="save", format="json"), os.path.getsize(path))
+        self.assertEqual(observer.value("persistence_operations_total", operation="load", format="json"), 1)
+
+        memory.payload()
+        memory.payload()
+        self.assertEqual(observer.value("cache_hits_total", cache="payload"), len(memory.recall()))
+
+        text = observer.render()
+        self.assertIn("# TYPE memoravel_trims_total counter", text)
+        self.assertIn('memoravel_trims_total{reason="limit"} 3', text)
+        self.assertIn("memoravel_tokenizer_calls_total ", text)
+
+    def test_journal_save_reports_bytes_written(self):
+        observer = PrometheusObserver()
+        memory = Memoravel(observer=observer)
+        memory.add("user", "Mensagem 1")
+        path = os.path.join(self.directory, "memoria.jsonl")
+        memory.save(path, format="journal")
+        first = observer.value("persistence_bytes_total", operation="save", format="journal")
+        self.assertEqual(first, os.path.getsize(path) + os.path.getsize(path + ".journal"))
+        size = os.path.getsize(path + ".journal")
+        memory.add("user", "Mensagem 2")
+        memory.save(path, format="journal")
+        self.assertEqual(observer.value("persistence_bytes_total", operation="save", format="journal") - first,
+                         os.path.getsize(path + ".journal") - size)
+        memory.journal.close()
+
+    def test_failures_raise_typed_exceptions(self):
+        memory = Memoravel()
+        with self.assertRaises(PersistenceError):
+            memory.load(os.path.join(self.directory, "missing.json"))
+        with self.assertRaises(PersistenceError):
+            memory.save(os.path.join(self.directory, "missing", "memoria.json"))
+
+        memory.encoder = BrokenEncoder()
+        with self.assertRaises(TokenCountError) as context:
+            memory.add("user", "Mensagem")
+        self.assertIsInstance(context.exception, MemoravelError)
+        self.assertIsInstance(context.exception.__cause__, RuntimeError)
+        self.assertEqual(memory.recall(), [])
+
+    def test_failed_exact_count_leaves_the_history_unchanged(self):
+        # With token estimation, the exact counts are only made when trimming needs them,
+        # after the message was added
+        memory = Memoravel(limit=0, max_tokens=100, token_estimation=True)
+        memory.add("system", "Regras")
+        memory.add("user", "Mensagem")
+        history, tokens = memory.recall(), memory.count_tokens()
+
+        encoder = memory.encoder
+        memory.encoder = BrokenEncoder()
+        with self.assertRaises(TokenCountError):
+            memory.add("user", "Mensagem longa " * 40)
+        self.assertEqual(memory.recall(), history)
+        memory.encoder = encoder
+        self.assertEqual(memory.count_tokens(), tokens)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+# tests/test_pool.py
+
+import unittest
+import os
+import shutil
+import tempfile
+from unittest import mock
+from memoravel import MemoravelPool
+from memoravel.indexed import encode_message
+
+
+class TestMemoravelPool(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "sessions.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_lru_sessions_are_spilled_and_restored(self):
+        pool = MemoravelPool(self.path, max_sessions=2, limit=0, max_tokens=0)
+        for session in ("a", "b", "c"):
+            pool.get(session).add("user", f"Mensagem {session}")
+        self.assertEqual(len(pool), 2)
+        self.assertNotIn("a", pool)
+        self.assertEqual(pool.evictions, 1)
+
+        # "a" is restored from the backend, evicting "b", the least recently used
+        self.assertEqual(pool.get("a").recall(), [{"role": "user", "content": "Mensagem a"}])
+        self.assertNotIn("b", pool)
+        pool.get("c")
+        self.assertEqual((pool.hits, pool.misses, pool.evictions), (1, 4, 2))
+        self.assertEqual(pool.hit_rate, 0.2)
+        pool.close()
+
+        pool = MemoravelPool(self.path, limit=0, max_tokens=0)
+        self.assertEqual([pool.get(session).recall()[0]["content"] for session in ("a", "b", "c")],
+                         ["Mensagem a", "Mensagem b", "Mensagem c"])
+        pool.close()
+
+    def test_token_and_byte_limits(self):
+        pool = MemoravelPool(self.path, max_sessions=0, max_resident_tokens=30, limit=0, max_tokens=0)
+        for session in ("a", "b", "c"):
+            pool.get(session).extend([{"role": "user", "content": f"Mensagem {i}"} for i in range(2)])
+        pool.get("d")
+        self.assertLessEqual(pool.resident_tokens(), 30)
+        self.assertIn("d", pool)
+
+        pool.max_resident_tokens = None
+        pool.max_resident_bytes = pool.resident_bytes() - 1
+        pool.get("d")
+        self.assertLessEqual(pool.resident_bytes(), pool.max_resident_bytes)
+        pool.close()
+
+    def test_resident_size_follows_changes(self):
+        pool = MemoravelPool(self.path, max_sessions=0, max_resident_bytes=10 ** 6, limit=6, max_tokens=0)
+        memory = pool.get("a")
+        memory.add("system", "Regras")
+        with mock.patch("memoravel.pool.encode_message", wraps=encode_message) as encode:
+            for i in range(20):
+                pool.get("a").add("user", f"Mensagem {i}")
+                if i == 10:
+                    memory.insert(2, [{"role": "assistant", "content": "Inserida"}, {"role": "user", "content": "Outra"}])
+                    memory.delete(slice(1, 4, 2))
+        # Only the messages added were serialized, never the whole session
+        self.assertEqual(encode.call_count, 22)
+        self.assertEqual(pool.resident_bytes(), sum(len(encode_message(message)) for message in memory.recall()))
+        self.assertEqual(pool.resident_tokens(), memory.count_tokens())
+
+        # Restored sessions are measured as they are loaded
+        pool.evict("a")
+        memory = pool.get("a")
+        self.assertEqual(pool.resident_bytes(), sum(len(encode_message(message)) for message in memory.recall()))
+        pool.close()
+
+    def test_sessions_in_use_are_not_evicted(self):
+        pool = MemoravelPool(self.path, max_sessions=1)
+        with pool.session("a") as memory:
+            pool.get("b")
+            self.assertIn("a", pool)
+            memory.add("user", "Ainda residente")
+        self.assertNotIn("a", pool)
+        self.assertEqual(pool.get("a").recall()[-1]["content"], "Ainda residente")
+        pool.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+# tests/test_relevance.py
+
+import unittest
+import importlib.util
+from memoravel import Memoravel
+
+numpy = importlib.util.find_spec("numpy")
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class TestRelevanceEviction(unittest.TestCase):
+    def test_hashing_embedder(self):
+        from memoravel import HashingEmbedder
+        embedder = HashingEmbedder(dim=256)
+        vectors = embedder(["O gato preto dorme", "o GATO preto", "Previsão do tempo", ""])
+        self.assertEqual(vectors.shape, (4, 256))
+        self.assertAlmostEqual(float(vectors[0] @ vectors[0]), 1.0, places=5)
+        self.assertGreater(float(vectors[0] @ vectors[1]), float(vectors[0] @ vectors[2]))
+        self.assertEqual(float(abs(vectors[3]).sum()), 0.0)
+
+    def test_relevant_facts_are_kept(self):
+        memory = Memoravel(limit=6, max_tokens=0, preserve_last_memories=1, eviction="relevance")
+        memory.add("system", "Você é um assistente")
+        memory.add("user", "Meu gato se chama Tom e tem alergia a frango")
+        for i in range(4):
+            memory.add("user", f"Conversa aleatória número {i+1} sobre futebol")
+        memory.add("user", "Que ração posso dar para o meu gato com alergia?")
+
+        contents = [msg["content"] for msg in memory.recall()]
+        self.assertEqual(len(contents), 6)
+        self.assertEqual(contents[0], "Você é um assistente")
+        self.assertIn("Meu gato se chama Tom e tem alergia a frango", contents)
+        self.assertNotIn("Conversa aleatória número 1 sobre futebol", contents)
+        self.assertEqual(contents[-1], "Que ração posso dar para o meu gato com alergia?")
+
+    def test_index_is_updated_incrementally(self):
+        from memoravel import RelevanceEviction
+        calls = []
+
+        class CountingEmbedder:
+            def __init__(self):
+                from memoravel import HashingEmbedder
+                self.embedder = HashingEmbedder(dim=64)
+
+            def __call__(self, texts):
+                calls.append(len(texts))
+                return self.embedder(texts)
+
+        eviction = RelevanceEviction(embedder=CountingEmbedder())
+        memory = Memoravel(limit=10, max_tokens=0, eviction=eviction)
+        for i in range(200):
+            memory.add("user", f"Mensagem {i+1}")
+        self.assertEqual(len(memory.recall()), 10)
+        # Each message is embedded once, plus the query of each trim
+        self.assertLess(sum(calls), 2 * 200 + 20)
+        index = eviction._indexes[memory]
+        self.assertLessEqual(len(index.rows), 10)
+        self.assertLessEqual(index.size, 64)
+
+
+if __name__ == '__main__':
+    unittest.main()
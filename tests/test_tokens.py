@@ -0,0 +1,154 @@
+# tests/test_tokens.py
+
+import unittest
+import json
+import subprocess
+import sys
+from memoravel import Memoravel
+from memoravel.tokens import JSONTokenCounter, ChatTokenCounter, TokenCountCache, CachedTokenCounter, get_token_counter, get_encoder, register_encoder
+
+
+class WordEncoder:
+    # Deterministic stand-in for a tiktoken encoding: one token per word
+    name = "words"
+
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, text):
+        self.calls.append(text)
+        return text.split()
+
+    def encode_batch(self, texts):
+        return [self.encode(text) for text in texts]
+
+
+class TestTokenCounters(unittest.TestCase):
+    def setUp(self):
+        self.encoder = WordEncoder()
+
+    def test_json_counter(self):
+        message = {"role": "user", "content": "Hello there"}
+        counter = JSONTokenCounter()
+        self.assertEqual(counter.count(message, self.encoder), len(json.dumps(message).split()))
+        self.assertEqual(counter.count_batch([message, message], self.encoder), [5, 5])
+
+    def test_chat_counter_text(self):
+        counter = ChatTokenCounter()
+        # 3 per message + "user" + "Hello there"
+        self.assertEqual(counter.count({"role": "user", "content": "Hello there"}, self.encoder), 6)
+        # The name costs its tokens plus one
+        self.assertEqual(counter.count({"role": "user", "name": "Bob", "content": "Hi"}, self.encoder), 7)
+
+    def test_chat_counter_tool_calls(self):
+        counter = ChatTokenCounter()
+        message = {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [{"id": "call_1", "type": "function", "function": {"name": "get_weather", "arguments": "{\"city\": \"Paris\"}"}}],
+        }
+        # 3 per message + "assistant" + 3 per tool call + name (1) + arguments (2)
+        self.assertEqual(counter.count(message, self.encoder), 10)
+
+    def test_chat_counter_images(self):
+        counter = ChatTokenCounter(image_size=lambda url: (1024, 1024))
+        message = {"role": "user", "content": [
+            {"type": "text", "text": "What is this?"},
+            {"type": "image_url", "image_url": {"url": "https://example.com/a.png"}},
+            {"type": "image_url", "image_url": {"url": "https://example.com/b.png", "detail": "low"}},
+        ]}
+        # 1024x1024 is scaled to 768x768: 4 tiles
+        self.assertEqual(counter.image_tokens(1024, 1024), 765)
+        self.assertEqual(counter.count(message, self.encoder), 3 + 1 + 3 + 765 + 85)
+        # Unknown sizes are costed as the most expensive image
+        self.assertEqual(ChatTokenCounter().image_tokens(2048, 768), 1445)
+
+    def test_chat_counter_batch_matches_count(self):
+        counter = ChatTokenCounter()
+        messages = [
+            {"role": "system", "content": "You are helpful"},
+            {"role": "user", "name": "Ana", "content": [{"type": "text", "text": "Hi there"}]},
+            {"role": "tool", "content": "42", "tool_call_id": "call_1"},
+        ]
+        self.assertEqual(counter.count_batch(messages, self.encoder), [counter.count(message, self.encoder) for message in messages])
+
+    def test_get_token_counter(self):
+        self.assertIsInstance(get_token_counter("json"), JSONTokenCounter)
+        self.assertIsInstance(get_token_counter("chat"), ChatTokenCounter)
+        counter = ChatTokenCounter(tokens_per_message=4)
+        self.assertIs(get_token_counter(counter), counter)
+        with self.assertRaises(ValueError):
+            get_token_counter("bytes")
+
+
+
+class TestTokenCountCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = TokenCountCache(maxsize=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)  # "b" is the least recently used
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(cache.hit_rate, 0.5)
+
+    def test_cached_counter_encodes_once(self):
+        encoder = WordEncoder()
+        cache = TokenCountCache()
+        first = CachedTokenCounter(ChatTokenCounter(), cache)
+        second = CachedTokenCounter(ChatTokenCounter(), cache)
+        prompt = {"role": "system", "content": "You are a very helpful assistant"}
+
+        self.assertEqual(first.count(prompt, encoder), 3 + 1 + 6)
+        calls = len(encoder.calls)
+        self.assertEqual(second.count_batch([dict(prompt), {"role": "user", "content": "Hi"}], encoder), [10, 5])
+        # Only the new message was encoded
+        self.assertEqual(encoder.calls[calls:], ["user", "Hi"])
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_counters_with_different_rules_do_not_share_counts(self):
+        encoder = WordEncoder()
+        cache = TokenCountCache()
+        message = {"role": "user", "content": "Hi"}
+        self.assertEqual(CachedTokenCounter(ChatTokenCounter(), cache).count(message, encoder), 5)
+        self.assertEqual(CachedTokenCounter(ChatTokenCounter(tokens_per_message=4), cache).count(message, encoder), 6)
+        self.assertNotEqual(CachedTokenCounter(JSONTokenCounter(), cache).count(message, encoder), 5)
+
+    def test_memory_with_shared_cache(self):
+        register_encoder("test-words", WordEncoder())
+        cache = TokenCountCache()
+        for _ in range(3):
+            memory = Memoravel(model="test-words", max_tokens=0, token_cache=cache)
+            memory.add("system", "You are a very helpful assistant")
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        with self.assertRaises(ValueError):
+            Memoravel(token_cache=10)
+
+
+class TestEncoderRegistry(unittest.TestCase):
+    def test_registered_encoder_is_shared(self):
+        encoder = WordEncoder()
+        register_encoder("test-words", encoder)
+        self.assertIs(get_encoder("test-words"), encoder)
+
+        first = Memoravel(model="test-words", max_tokens=0)
+        second = Memoravel(model="test-words", max_tokens=0)
+        first.add("user", "Hello there")
+        self.assertIs(first.encoder, second.encoder)
+        self.assertEqual(first.count_tokens(), 5)
+
+    def test_encoder_is_created_lazily(self):
+        code = (
+            "import sys, memoravel\n"
+            "memory = memoravel.Memoravel()\n"
+            "assert 'tiktoken' not in sys.modules\n"
+            "assert 'asyncio' not in sys.modules\n"
+            "assert memoravel.AsyncMemoravel.__module__ == 'memoravel.aio'\n"
+        )
+        subprocess.run([sys.executable, "-c", code], check=True)
+
+
+if __name__ == "__main__":
+    unittest.main()